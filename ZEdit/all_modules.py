@@ -11,10 +11,16 @@ import traceback # for debugging
 import sys, os # for path operations
 import shutil # for saving/loading
 import shlex # for parsing homemade *.dat files
+import json # for mesh cache headers
+import struct # for mesh cache headers
+import hashlib # for content hashes of asset files
 import zipfile # for saving/loading
+import concurrent.futures # for the asset import pipeline
+import threading # for worker thread ids
 import ctypes # for making OpenGL buffer objects
 import numpy as np # for matrix and array math
 import copy # for pythonic use of __copy__ and __deepcopy__
+import weakref # for registries that should not keep objects alive
 from math import sin, cos, tan, atan, atan2, pi, tau, degrees, radians, hypot, floor, ceil, sqrt # staple math functions
 from itertools import chain # for chaining generators
 from collections import defaultdict as ddict
@@ -29,6 +35,7 @@ import logging
 import OpenGL
 from OpenGL.GL import *
 from OpenGL.GL import shaders
+from OpenGL.GL.EXT.texture_filter_anisotropic import * # for sharper textures at grazing angles
 from OpenGL.GLU import *
 from OpenGL.GLUT import *
 
@@ -44,3 +51,6 @@ from PyQt5.QtOpenGL import *
 MAX_LIGHTS = 500
 APPNAME = "ZEdit"
 APPDATA_FOLDERNAME = "ZEdit"
+MESH_CACHE_SIZE = 2**30 # bytes of processed meshes kept in appdata
+MAX_ANISOTROPY = 16.0 # default texture anisotropy, clamped to what the GPU supports
+TEX_VRAM_BUDGET = 512*2**20 # bytes of VRAM textures may take before stale ones are shrunk
@@ -35,7 +35,7 @@ def dataopen(datafn, *args, **kwargs):
 def datainit():
   '''Initialise folder structure in appdata'''
   for relpath in ["save", "save/assets", "save/assets/meshes",
-                  "save/assets/textures"]:
+                  "save/assets/textures", "cache", "cache/meshes", "cache/sources"]:
     try:
       os.makedirs(datapath(relpath))
     except:
@@ -13,7 +13,47 @@ thanks edward344!
 '''
 from all_modules import *
 from appdata import datapath
-from shader import *
+from objparse import parse_obj, group_index
+import meshcache
+from bvh import BVH, ray_triangle_intersections
+
+# Layout of one interleaved VBO vertex: position, texcoord, normal
+VBO_VERTEX = slice(0, 3)
+VBO_TEXCOORD = slice(3, 5)
+VBO_NORMAL = slice(5, 8)
+VBO_WIDTH = 8
+VBO_STRIDE = VBO_WIDTH*4 # bytes
+
+TEX_SIZE = (1024, 1024)
+THUMBNAIL_SIZE = (150, 150)
+SOURCE_CACHE = "cache/sources" # one working copy of each distinct asset file
+
+def vbo_offset(field):
+    '''Byte offset of a field (VBO_VERTEX, VBO_TEXCOORD, VBO_NORMAL) in an interleaved VBO vertex'''
+    return ctypes.c_void_p(field.start*4)
+
+def unique_rows(rows):
+    '''
+    Finds the distinct rows of int array (rows) with one vectorized unique over packed keys.
+    Returns (first, inverse):
+        first   - index of the first occurrence of each distinct row, in order of appearance
+        inverse - for each row, the position of its distinct row in first
+    '''
+    if not len(rows):
+        return np.empty(0, np.int64), np.empty(0, np.int64)
+    lo = rows.min(axis=0)
+    span = rows.max(axis=0) - lo + 1
+    if np.prod(span.astype(np.float64)) < 2**62:
+        keys = np.zeros(len(rows), np.int64)
+        for column, lo_n, span_n in zip(rows.T, lo, span):
+            keys = keys*span_n + (column - lo_n)
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    else: # too wide to pack, compare whole rows instead
+        _, first, inverse = np.unique(rows, return_index=True, return_inverse=True, axis=0)
+    order = np.argsort(first, kind="stable")
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return first[order], rank[inverse.reshape(-1)]
 
 def id_gen(start=1):
     '''Generator that yields consecutive numbers'''
@@ -22,6 +62,69 @@ def id_gen(start=1):
         yield next_id
         next_id += 1
 
+def content_key(filename):
+    '''Get sha1 hex digest of the content of file (filename)'''
+    h = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1<<20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def source_path(key, ext):
+    '''Get absolute path of the working copy of the asset file with content key'''
+    return datapath(os.path.join(SOURCE_CACHE, key+ext))
+
+def link_or_copy(src, dst):
+    '''Make dst a hard link to src, or a copy of it where links are not supported'''
+    if os.path.lexists(dst):
+        os.remove(dst) # never write through an old link
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+class Registry:
+    '''
+    Resources shared between assets of identical content, with reference counts.
+    A resource is made by the first asset that acquires its key and
+    its delete() is called when the last one releases it.
+    '''
+    def __init__(self):
+        self.entries = dict() # key -> [resource, refcount]
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def resources(self):
+        return [resource for resource, _ in self.entries.values()]
+
+    def refcount(self, key):
+        return self.entries[key][1] if key in self.entries else 0
+
+    def acquire(self, key, create):
+        '''Take a reference to the resource for key, calling create() to make it if there is none'''
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = [create(), 0]
+        entry[1] += 1
+        return entry[0]
+
+    def release(self, key):
+        '''Drop a reference to the resource for key, deleting the resource with the last one'''
+        entry = self.entries[key]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self.entries[key]
+            entry[0].delete()
+
+    def rekey(self, key, newKey):
+        '''Move the resource for key, which must be unshared, to newKey'''
+        assert self.refcount(key) == 1 and newKey not in self.entries
+        self.entries[newKey] = self.entries.pop(key)
+
 def gentexcoord(f):
     '''Generates texcoord for missing texcoord vertices--UNUSED'''
     X = (sin(f*tau)+1)/2
@@ -29,28 +132,66 @@ def gentexcoord(f):
     return (X, Y)
 
 def standardizeImage(filename):
-    '''Resized image to standard size (1024, 1024) and converts it into RGBA'''
-    return Image.open(filename).resize((1024, 1024)).convert("RGBA")
-
-def load_texture(filename):
-    '''Loads OpenGL TexImage object from filename
-       and Returns the id for the texture'''
+    '''Decodes image from filename, resized to standard size TEX_SIZE and converted into RGBA'''
+    im = Image.open(filename)
+    im.draft("RGB", TEX_SIZE) # JPEGs: let the decoder downscale, never below TEX_SIZE
+    return im.resize(TEX_SIZE).convert("RGBA")
+
+def prepare_texture(filename, key=None):
+    '''Does the CPU work of loading a texture: decodes and resizes filename once,
+       then feeds that one image to the GL data, the standard copy saved to
+       source_path(key, ".png") and the thumbnail.
+       Returns (key, textureData, size, thumbnail). Safe to run in a worker thread.'''
+    if key is None:
+        key = content_key(filename)
     textureSurface = standardizeImage(filename)
     textureData = textureSurface.tobytes("raw")
-    IM = Image.frombytes("RGBA", textureSurface.size, textureData)
-    width, height = textureSurface.size
+    save_texture_source(textureSurface, key)
+    return key, textureData, textureSurface.size, make_thumbnail(textureSurface)
+
+def save_texture_source(im, key):
+    '''Writes PIL image im as the working copy source_path(key, ".png")'''
+    path = source_path(key, ".png")
+    tmppath = "%s.%d.tmp"%(path, threading.get_ident()) # workers may prepare the same image at once
+    im.save(tmppath, "PNG", compress_level=1) # fast, it is only a working copy
+    os.replace(tmppath, path)
+
+def gl_max_anisotropy():
+    '''Largest texture anisotropy the GPU supports, 1.0 if it has no anisotropic filtering'''
+    global _gl_max_anisotropy
+    if _gl_max_anisotropy is None:
+        if glInitTextureFilterAnisotropicEXT():
+            _gl_max_anisotropy = float(glGetFloatv(GL_MAX_TEXTURE_MAX_ANISOTROPY_EXT))
+        else:
+            _gl_max_anisotropy = 1.0
+    return _gl_max_anisotropy
+_gl_max_anisotropy = None # only known once a context exists
+
+def set_texture_filtering(mipmap, anisotropy):
+    '''Sets sampling of the bound texture: trilinear if mipmap else bilinear,
+       with anisotropy 1.0 (off) up to the GPU's maximum'''
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR if mipmap else GL_LINEAR)
+    if gl_max_anisotropy() > 1.0:
+        glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MAX_ANISOTROPY_EXT, max(1.0, min(anisotropy, gl_max_anisotropy())))
+
+def upload_texture(textureData, size, mipmap=True, anisotropy=MAX_ANISOTROPY):
+    '''Loads OpenGL TexImage object from RGBA textureData of size,
+       with mipmaps generated on the GPU if mipmap,
+       and Returns the id for the texture'''
+    width, height = size
     ID = glGenTextures(1)
     glBindTexture(GL_TEXTURE_2D,ID)
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
     glTexImage2D(GL_TEXTURE_2D,0,GL_RGBA,width,height,
                  0,GL_RGBA,GL_UNSIGNED_BYTE,textureData)
+    if mipmap:
+        glGenerateMipmap(GL_TEXTURE_2D)
+    set_texture_filtering(mipmap, anisotropy)
     return ID
 
-def load_thumbnail(filename):
-    '''Resizes image from filename to (150, 150) and returns it.'''
-    im = Image.open(filename)
-    return im.resize((150, 150))
+def make_thumbnail(im):
+    '''Resizes PIL image im to THUMBNAIL_SIZE and returns it.'''
+    return im.resize(THUMBNAIL_SIZE)
 
 def im2pixmap(im):
     '''Turns PIL image im into a Qt pixmap.'''
@@ -68,41 +209,162 @@ class Asset:
     name = "asset0"
 
 
+class TexSource:
+    '''Working copy and thumbnail of one image content, shared by every Tex made from it'''
+    def __init__(self, key, thumbnail):
+        self.filename = source_path(key, ".png") # written by prepare_texture
+        self.thumbnail = thumbnail # 150x150
+        self.thumbnailQt = im2qim(thumbnail)
+
+    def read(self, level=0):
+        '''Get (textureData, size) of the image at resolution TEX_SIZE/2**level'''
+        size = (TEX_SIZE[0]>>level, TEX_SIZE[1]>>level)
+        return Image.open(self.filename).resize(size).convert("RGBA").tobytes("raw"), size
+
+    def delete(self):
+        try:
+            os.remove(self.filename)
+        except OSError:
+            pass
+
+class TexImage:
+    '''GL texture of one image content with one sampling, shared by every Tex that draws it'''
+    def __init__(self, source, mipmap, anisotropy, textureData=None, size=None):
+        self.source = source
+        self.mipmap = mipmap # trilinear sampling from GPU-generated mipmaps
+        self.anisotropy = anisotropy # 1.0 is off
+        if textureData is None:
+            textureData, size = source.read()
+        self.texID = upload_texture(textureData, size, mipmap, anisotropy)
+        self.hasMipmaps = mipmap
+        self.level = 0 # resident resolution is TEX_SIZE/2**level, see texbudget.py
+        self.wantLevel = 0
+        self.lastDrawn = 0 # frame number
+
+    def vram_bytes(self):
+        '''Bytes of GPU memory taken by this texture at its current level'''
+        nbytes = (TEX_SIZE[0]>>self.level)*(TEX_SIZE[1]>>self.level)*4
+        return nbytes*4//3 if self.hasMipmaps else nbytes
+
+    def setLevel(self, level):
+        '''Re-upload at resolution TEX_SIZE/2**level, freeing or taking VRAM'''
+        if level == self.level:
+            return
+        if level > self.level and self.hasMipmaps: # already on the GPU as a mipmap
+            glBindTexture(GL_TEXTURE_2D, self.texID)
+            textureData = glGetTexImage(GL_TEXTURE_2D, level-self.level, GL_RGBA, GL_UNSIGNED_BYTE)
+            size = (TEX_SIZE[0]>>level, TEX_SIZE[1]>>level)
+        else:
+            textureData, size = self.source.read(level)
+        glDeleteTextures([self.texID])
+        self.texID = upload_texture(textureData, size, self.mipmap, self.anisotropy)
+        self.hasMipmaps = self.mipmap
+        self.level = level
+
+    def setFiltering(self, mipmap, anisotropy):
+        '''Change how the texture is sampled, generating mipmaps if they are missing'''
+        self.mipmap = mipmap
+        self.anisotropy = anisotropy
+        glBindTexture(GL_TEXTURE_2D, self.texID)
+        if mipmap and not self.hasMipmaps:
+            glGenerateMipmap(GL_TEXTURE_2D)
+            self.hasMipmaps = True
+        set_texture_filtering(mipmap, anisotropy)
+
+    def delete(self):
+        glDeleteTextures([self.texID]) # Removes this texture's image from memory
+        self.texID = 0
+
 class Tex(Asset):
     '''Describes a texture with an image and shading properties'''
     IDs = id_gen(1)
     texDict = dict()
-    def __init__(self, filename, diffuse=1.0, specular=0.0, fresnel=0.0, shininess=10.0, name=None):
+    sources = Registry() # content key -> TexSource
+    images = Registry() # (content key, mipmap, anisotropy) -> TexImage
+    def __init__(self, filename, diffuse=1.0, specular=0.0, fresnel=0.0, shininess=10.0, name=None,
+                 mipmap=True, anisotropy=MAX_ANISOTROPY, prepared=None):
         self.ID = next(Tex.IDs)
         self._clear()
         self.diffuse = diffuse
         self.specular = specular
         self.fresnel = fresnel
         self.shininess = shininess
+        self.mipmap = mipmap
+        self.anisotropy = anisotropy
         self.filename = filename
         if name is None:
             name = os.path.basename(filename)
         self.name = name
         self.thumbnail = None
         self.thumbnailQt = None
-        self._load()
+        self._load(prepared)
         Tex.texDict[self.ID] = self
 
     def _clear(self):
         self.deleted = False
-        self.texID = None
-
-    def _load(self):
-        self.texID = load_texture(self.filename)
-        self.thumbnail = load_thumbnail(self.filename) # 100x100 res
-        self.thumbnailQt = im2qim(self.thumbnail)
-        self.tmpFilename = datapath("save/assets/textures/%d.png"%self.ID)
-        standardizeImage(self.filename).save(self.tmpFilename, "PNG")
+        self.key = None # content hash of the image file
+        self.source = None
+        self.image = None
+
+    @property
+    def texID(self):
+        return self.image.texID if self.image is not None else 0 # OpenGL's default texture, white
+
+    def imageKey(self):
+        return (self.key, self.mipmap, self.anisotropy)
+
+    @staticmethod
+    def tmpFilenameOf(ID):
+        return datapath("save/assets/textures/%d.png"%ID)
+
+    def _load(self, prepared=None):
+        '''Load from the result of prepare_texture, preparing it here if not given.
+           Textures with the same image content share its working copy and GL texture.'''
+        if prepared is None:
+            key = content_key(self.filename)
+            prepared = (key, None, None, None) if key in Tex.sources else prepare_texture(self.filename, key)
+        self.key, textureData, size, thumbnail = prepared
+        # the working copy goes when the last texture of its content is deleted,
+        # which may happen while this one was being prepared
+        if self.key not in Tex.sources and textureData is not None and not os.path.isfile(source_path(self.key, ".png")):
+            save_texture_source(Image.frombytes("RGBA", size, textureData), self.key)
+        self.tmpFilename = Tex.tmpFilenameOf(self.ID)
+        link_or_copy(source_path(self.key, ".png"), self.tmpFilename) # before taking any references, so a failure leaks none
+        self.source = Tex.sources.acquire(self.key, lambda: TexSource(self.key, thumbnail))
+        try:
+            self.image = Tex.images.acquire(self.imageKey(),
+                                            lambda: TexImage(self.source, self.mipmap, self.anisotropy, textureData, size))
+        except Exception:
+            Tex.sources.release(self.key)
+            raise
+        self.thumbnail = self.source.thumbnail
+        self.thumbnailQt = self.source.thumbnailQt
+
+    def vram_bytes(self):
+        '''Bytes of GPU memory taken by this texture's image, shared with identical textures'''
+        return self.image.vram_bytes() if self.image is not None else 0
+
+    def setFiltering(self, mipmap, anisotropy):
+        '''Change how the texture is sampled, without touching other textures sharing its image'''
+        oldKey = self.imageKey()
+        self.mipmap = mipmap
+        self.anisotropy = anisotropy
+        if self.image is None or self.imageKey() == oldKey:
+            return
+        if Tex.images.refcount(oldKey) == 1 and self.imageKey() not in Tex.images:
+            Tex.images.rekey(oldKey, self.imageKey()) # sole user, change it in place
+            self.image.setFiltering(mipmap, anisotropy)
+        else: # copy on write
+            self.image = Tex.images.acquire(self.imageKey(), lambda: TexImage(self.source, mipmap, anisotropy))
+            Tex.images.release(oldKey)
 
     def delete(self):
         self.deleted = True
-        glDeleteTextures([self.texID]) # Removes this texture's image from memory
-        self.texID = 0 # OpenGL's default texture, white
+        if self.image is not None:
+            Tex.images.release(self.imageKey())
+            Tex.sources.release(self.key)
+        self.image = None
+        self.source = None
         self.filename = None
         self.name = None
         self.diffuse = 0.0
@@ -112,16 +374,70 @@ class Tex(Asset):
         del Tex.texDict[self.ID]
 
     def __copy__(self):
-        return Tex(self.tmpFilename, diffuse=self.diffuse, specular=self.specular, fresnel=self.fresnel, shininess=self.shininess,name=self.name)
+        # shares the image, only the shading properties are copied
+        return Tex(self.tmpFilename, diffuse=self.diffuse, specular=self.specular, fresnel=self.fresnel, shininess=self.shininess,name=self.name,
+                   mipmap=self.mipmap, anisotropy=self.anisotropy, prepared=(self.key, None, None, None))
 
     def __deepcopy__(self, memo):
         return copy.copy(self)
 
+class MeshGeometry:
+    '''Working copy, render-ready arrays and GL buffers of one mesh file content,
+       shared by every Mesh loaded from it'''
+    def __init__(self, key, filename, arrays, meta):
+        self.filename = source_path(key, ".obj")
+        shutil.copyfile(filename, self.filename)
+        for name in Mesh.CACHED_ARRAYS:
+            setattr(self, name, arrays[name])
+        for name in Mesh.CACHED_META:
+            setattr(self, name, meta[name])
+        self.bvh = None # of the triangles, built on the first exact pick
+        self._gen_vbo_buffers()
+
+    def _gen_vbo_buffers(self):
+        '''Make buffers from VBO arrays'''
+        # interleaved vertices/texcoords/normals, indices for tris, indices for lines
+        buffers = glGenBuffers(3)
+
+        # uploaded straight from the arrays' memory
+        glBindBuffer(GL_ARRAY_BUFFER, buffers[0])
+        glBufferData(GL_ARRAY_BUFFER, self.vbo_array.nbytes, self.vbo_array, GL_STATIC_DRAW)
+
+        # vertex indices for tris [Ai, Bi, Ci, Ai, Bi, Ci, ...]
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, buffers[1])
+        glBufferData(GL_ELEMENT_ARRAY_BUFFER, self.vbo_tri_indices.nbytes, self.vbo_tri_indices, GL_STATIC_DRAW)
+
+        # wireframe lines (has redundancies, but gets the job done)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, buffers[2])
+        glBufferData(GL_ELEMENT_ARRAY_BUFFER, self.vbo_line_indices.nbytes, self.vbo_line_indices, GL_STATIC_DRAW)
+
+        self.vbo_buffers = buffers
+
+    def triangle_corners(self, triangles):
+        '''Corners A, B, C (n,3) of (triangles), indices into vbo_tri_indices in threes'''
+        corners = self.vbo_array[self.vbo_tri_indices.reshape(-1, 3)[triangles], VBO_VERTEX].astype(np.float64)
+        return corners[:, 0], corners[:, 1], corners[:, 2]
+
+    def triangle_bvh(self):
+        '''BVH over the boxes of my triangles, built once'''
+        if self.bvh is None:
+            A, B, C = self.triangle_corners(slice(None))
+            self.bvh = BVH(np.stack([np.minimum(np.minimum(A, B), C), np.maximum(np.maximum(A, B), C)], axis=1))
+        return self.bvh
+
+    def delete(self):
+        glDeleteBuffers(len(self.vbo_buffers), self.vbo_buffers)
+        try:
+            os.remove(self.filename)
+        except OSError:
+            pass
+
 class Mesh(Asset):
     '''Describes a mesh with geometry and rendering specifications'''
     IDs = id_gen(1)
     meshDict = dict()
-    def __init__(self, filename, name=None, cullbackface=True):
+    geometries = Registry() # content key -> MeshGeometry
+    def __init__(self, filename, name=None, cullbackface=True, prepared=None):
         self.ID = next(Mesh.IDs)
         self._clear()
         self.filename = filename
@@ -130,228 +446,205 @@ class Mesh(Asset):
             name = os.path.basename(filename)
         self.name = name
         try:
-            self._load()
+            self._load(prepared)
         except Exception as e:
             raise IOError("Bad mesh file. More info:\n"+str(e))
         else:
             self.tmpFilename = datapath("save/assets/meshes/%d.obj"%self.ID)
-            shutil.copyfile(self.filename, self.tmpFilename)
+            link_or_copy(self.geometry.filename, self.tmpFilename)
             Mesh.meshDict[self.ID] = self
 
     def _clear(self):
         self.deleted = False
+        self.key = None # content hash of the .obj file
+        self.geometry = None
         
         # cullbackface
         #   OFF: show both front and back of each polygon
         #   ON:  show only front face of each polygon
         self.cullbackface = True # modify this as you please
         
-        self.vertices = [(0.0, 0.0, 0.0)] # 1-indexing
-        self.texcoords = [(0.0, 0.0)] # 1-indexing, accounts for no-texcoord polygons
-        self.normals = [(0.0, 0.0, 1.0)] # 1-indexing
-        self.edges = set()
-        self.tri_faces = []
-        self.quad_faces = []
+        self.vertices = np.array([(0.0, 0.0, 0.0)], np.float32) # 1-indexing
+        self.texcoords = np.array([(0.0, 0.0)], np.float32) # 1-indexing, accounts for no-texcoord polygons
+        self.normals = np.array([(0.0, 0.0, 1.0)], np.float32) # 1-indexing
+        self.edges = np.empty((0, 2), np.int64)
+        self.tri_faces = np.empty((0, 3, 3), np.int64)
+        self.quad_faces = np.empty((0, 4, 3), np.int64)
         self.poly_faces = []
+        self.vertex_count = 0
+        self.face_count = 0
 
+        self.vbo_cornercount = 0
         self.vbo_bufferlen = 0
-        self.vbo_vertices = []
-        self.vbo_texcoords = []
-        self.vbo_normals = []
-        self.vbo_tri_indices = []
-        self.vbo_line_indices = []
+        self.vbo_array = np.empty((0, VBO_WIDTH), np.float32)
+        self.vbo_tri_indices = np.empty(0, np.uint32)
+        self.vbo_line_indices = np.empty(0, np.uint32)
         self.vbo_buffers = []
 
         self.min_xyz = [None, None, None]
         self.max_xyz = [None, None, None]
 
-    def _load(self):
-        '''Load from .obj file'''
-        filename = self.filename
-        f = open(filename)
-        for line in f:
-            words = line.split()
-            if not words:
-                continue
-            command = words[0]
-            if command == "v":
-                vertex = tuple(float(word) for word in words[1:4])
-                self.vertices.append(vertex)
-                self._update_bbox(vertex)
-
-            elif command == "vt":
-                texcoord = tuple(float(word) for word in words[1:3])
-                self.texcoords.append(texcoord)
-
-            elif command == "vn":
-                normal = tuple(float(word) for word in words[1:4])
-                self.normals.append(normal)
-                
-            elif command == "f":
-                face = []
-
-                # face := [(v0, vt0, vn0), (v1, vt1, vn1), (v2, vt2, vn2), ...]
-                for word in words[1:]:
-                    word = word.replace("//", "/0/")
-                    nums = [int(strint) for strint in word.split("/")]
-                    nums += [0]*(3-len(nums))
-                    face.append(tuple(nums)) # v, vt, vn
-                
-                for i in range(-1, len(face)-1): # Add new (A, B) pairs into self.edges
-                    edge = (face[i][0], face[i+1][0])
-                    if edge in self.edges or edge[::-1] in self.edges:
-                        continue
-                    self.edges.add(edge)
-
-                N_v = len(face)
-                
-                if N_v == 3:
-                    self.tri_faces.append(face)
-                elif N_v == 4:
-                    self.quad_faces.append(face)
-                else:
-                    self.poly_faces.append(face)
-                    
-        f.close()
+    # arrays and attributes kept in the mesh cache; enough to render and pick
+    CACHED_ARRAYS = ["edges", "vbo_array", "vbo_tri_indices", "vbo_line_indices"]
+    CACHED_META = ["min_xyz", "max_xyz", "vertex_count", "face_count", "vbo_cornercount", "vbo_bufferlen"]
+
+    def _load(self, prepared=None):
+        '''Load from the result of prepare_mesh, preparing it here if not given.
+           Meshes with the same file content share its geometry.'''
+        if prepared is None:
+            key = content_key(self.filename)
+            prepared = (key, None, None) if key in Mesh.geometries else self._prepare(key)
+        self.key, arrays, meta = prepared
+        self.geometry = Mesh.geometries.acquire(self.key, lambda: MeshGeometry(self.key, self.filename, arrays, meta))
+        for name in Mesh.CACHED_ARRAYS + Mesh.CACHED_META + ["vbo_buffers"]:
+            setattr(self, name, getattr(self.geometry, name))
+
+    def _prepare(self, key):
+        '''Get (key, arrays, meta) from the mesh cache, or parse .obj file and cache them. No GL calls'''
+        entry = meshcache.load(key)
+        if entry is None:
+            self._parse()
+            entry = ({name: getattr(self, name) for name in Mesh.CACHED_ARRAYS},
+                     {name: getattr(self, name) for name in Mesh.CACHED_META})
+            try:
+                meshcache.store(key, *entry)
+            except OSError: # a full or read-only appdata folder only costs the cache
+                pass
+        return (key,) + tuple(entry)
+
+    def _parse(self):
+        '''Parse .obj file and generate normals and VBO arrays'''
+        vertices, texcoords, normals, corners, face_sizes = parse_obj(self.filename)
+        self.vertex_count = len(vertices)
+        self.face_count = len(face_sizes)
+        self.vertices = np.concatenate((self.vertices[:1], vertices))
+        self.texcoords = np.concatenate((self.texcoords[:1], texcoords))
+        self.normals = np.concatenate((self.normals[:1], normals))
+        if len(vertices):
+            self.min_xyz = vertices.min(axis=0).tolist()
+            self.max_xyz = vertices.max(axis=0).tolist()
+        self._gen_faces(corners, face_sizes)
         self._gen_normals()
         self._gen_vbo_arrays()
-        self._gen_vbo_buffers()
 
-    def _update_bbox(self, v):
-        for i, (minn, maxn, n) in enumerate(zip(self.min_xyz, self.max_xyz, v)):
-            if minn is None or n < minn:
-                self.min_xyz[i] = n
-            if maxn is None or n > maxn:
-                self.max_xyz[i] = n
-        
+    def _gen_faces(self, corners, face_sizes):
+        '''Sort faces into tris, quads and polys and collect their edges'''
+        # face := [(v0, vt0, vn0), (v1, vt1, vn1), (v2, vt2, vn2), ...]
+        starts = np.cumsum(face_sizes) - face_sizes
+        self.tri_faces = corners[starts[face_sizes == 3, None] + np.arange(3)]
+        self.quad_faces = corners[starts[face_sizes == 4, None] + np.arange(4)]
+        polys = np.flatnonzero((face_sizes != 3) & (face_sizes != 4))
+        self.poly_faces = [corners[start:start+N_v] for start, N_v in zip(starts[polys], face_sizes[polys])]
+
+        # (A, B) pairs of consecutive corners, each edge counted once in either direction
+        if not len(corners):
+            return
+        v = corners[:, 0]
+        nxt = np.arange(1, len(corners)+1)
+        nxt[starts + face_sizes - 1] = starts
+        edges = np.sort(np.stack((v, v[nxt]), axis=1), axis=1)
+        first, _ = unique_rows(edges)
+        self.edges = edges[first]
 
     def _gen_normals(self):
         '''Generate missing normal vectors'''
-        for face in chain(self.tri_faces, self.quad_faces, self.poly_faces):
-            if face[0][2] != 0:
+        new_normals = [self.normals]
+        normal_index = len(self.normals)
+        faceGroups = [self.tri_faces, self.quad_faces] + [face[None] for face in self.poly_faces]
+        for faces in faceGroups:
+            missing = faces[:, 0, 2] == 0
+            if not missing.any():
                 continue
-            A = self.vertices[face[0][0]]
-            B = self.vertices[face[1][0]]
-            C = self.vertices[face[2][0]]
-            AB = tuple(Bn-An for An, Bn in zip(A, B))
-            AC = tuple(Cn-An for An, Cn in zip(A, C))
-            x, y, z = normal = np.cross(AC, AB)
-            self.normals.append(tuple(normal))
-            normal_index = len(self.normals)-1
-            for i, (v, vt, vn) in enumerate(face):
-                face[i] = (v, vt, normal_index)
-            
+            A, B, C = (self.vertices[faces[missing, i, 0]].astype(np.float64) for i in range(3))
+            normals = np.cross(C-A, B-A)
+            new_normals.append(normals.astype(np.float32))
+            faces[missing, :, 2] = np.arange(normal_index, normal_index+len(normals))[:, None]
+            normal_index += len(normals)
+        self.normals = np.concatenate(new_normals)
 
     def _gen_vbo_arrays(self):
         '''Generate VBO arrays'''
-        # TRIS
-        for face in chain(self.tri_faces, self.quad_faces, self.poly_faces):
-            di = self.vbo_bufferlen
-            N_v = len(face)
-            for v, vt, vn in face:
-                self.vbo_vertices.extend(self.vertices[v])
-                self.vbo_texcoords.extend(self.texcoords[vt])
-                self.vbo_normals.extend(self.normals[vn])
-            Ai = di
-            for Bi, Ci in zip(range(di+1,di+N_v-1), range(di+2,di+N_v)):
-                self.vbo_tri_indices.extend((Ai, Bi, Ci))
-                self.vbo_line_indices.extend((Ai, Bi, Bi, Ci, Ci, Ai))
-            self.vbo_bufferlen += N_v
-
-    def _gen_vbo_buffers(self):
-        '''Make buffers from VBO arrays'''
-        # vertices, texcoords, normals, indices for tris
-        buffers = glGenBuffers(5)
-
-        # vertices [x, y, z, x, y, z, ...]
-        glBindBuffer(GL_ARRAY_BUFFER, buffers[0])
-        glBufferData(GL_ARRAY_BUFFER,
-                     len(self.vbo_vertices)*4,
-                     (ctypes.c_float*len(self.vbo_vertices))(*self.vbo_vertices),
-                     GL_STATIC_DRAW)
-
-        # texcoords [X, Y, X, Y, X, Y, ...]
-        glBindBuffer(GL_ARRAY_BUFFER, buffers[1])
-        glBufferData(GL_ARRAY_BUFFER,
-                     len(self.vbo_texcoords)*4,
-                     (ctypes.c_float*len(self.vbo_texcoords))(*self.vbo_texcoords),
-                     GL_STATIC_DRAW)
-
-        # normals [dx, dy, dz, dx, dy, dz, ...]
-        glBindBuffer(GL_ARRAY_BUFFER, buffers[2])
-        glBufferData(GL_ARRAY_BUFFER,
-                     len(self.vbo_normals)*4,
-                     (ctypes.c_float*len(self.vbo_normals))(*self.vbo_normals),
-                     GL_STATIC_DRAW)
-
-        # vertex indices for tris [Ai, Bi, Ci, Ai, Bi, Ci, ...]
-        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, buffers[3])
-        glBufferData(GL_ELEMENT_ARRAY_BUFFER,
-                     len(self.vbo_tri_indices)*4,
-                     (ctypes.c_uint*len(self.vbo_tri_indices))(*self.vbo_tri_indices),
-                     GL_STATIC_DRAW)
-
-        # wireframe lines (has redundancies, but gets the job done)
-        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, buffers[4])
-        glBufferData(GL_ELEMENT_ARRAY_BUFFER,
-                     len(self.vbo_line_indices)*4,
-                     (ctypes.c_uint*len(self.vbo_line_indices))(*self.vbo_line_indices),
-                     GL_STATIC_DRAW)
-
-        self.vbo_buffers = buffers
+        corners = np.concatenate([self.tri_faces.reshape(-1, 3), self.quad_faces.reshape(-1, 3)]
+                                 + self.poly_faces)
+        face_sizes = np.concatenate((np.full(len(self.tri_faces), 3), np.full(len(self.quad_faces), 4),
+                                     [len(face) for face in self.poly_faces])).astype(np.int64)
+
+        # WELD: corners with the same (v, vt, vn) share one VBO vertex
+        first, welded = unique_rows(corners)
+        welded = welded.astype(np.uint32)
+        unique_corners = corners[first]
+
+        # interleaved [x, y, z, X, Y, dx, dy, dz, x, y, z, X, Y, dx, dy, dz, ...]
+        self.vbo_array = np.empty((len(unique_corners), VBO_WIDTH), np.float32)
+        self.vbo_array[:, VBO_VERTEX] = self.vertices[unique_corners[:, 0]]
+        self.vbo_array[:, VBO_TEXCOORD] = self.texcoords[unique_corners[:, 1]]
+        self.vbo_array[:, VBO_NORMAL] = self.normals[unique_corners[:, 2]]
+
+        # TRIS: fan out from the first corner of each face
+        tri_counts = np.maximum(face_sizes-2, 0)
+        Ai = np.repeat(np.cumsum(face_sizes) - face_sizes, tri_counts)
+        Bi = Ai + 1 + group_index(tri_counts)
+        Ai, Bi, Ci = welded[Ai], welded[Bi], welded[Bi+1]
+        tri_indices = np.empty((len(Ai), 3), np.uint32)
+        tri_indices[:, 0], tri_indices[:, 1], tri_indices[:, 2] = Ai, Bi, Ci
+        line_indices = np.empty((len(Ai), 6), np.uint32)
+        line_indices[:, 0:2] = tri_indices[:, 0:2]
+        line_indices[:, 2:4] = tri_indices[:, 1:3]
+        line_indices[:, 4], line_indices[:, 5] = Ci, Ai
+        self.vbo_tri_indices = tri_indices.ravel()
+        self.vbo_line_indices = line_indices.ravel()
+        self.vbo_cornercount = len(corners)
+        self.vbo_bufferlen = len(unique_corners)
+
+    def vram_bytes(self):
+        '''Bytes of GPU memory taken by this mesh's buffers, shared with identical meshes'''
+        return self.vbo_array.nbytes + self.vbo_tri_indices.nbytes + self.vbo_line_indices.nbytes
+
+    def weld_savings(self):
+        '''Bytes of GPU memory saved by sharing VBO vertices between face corners'''
+        return (self.vbo_cornercount - self.vbo_bufferlen)*VBO_STRIDE
 
     def __repr__(self):
         return "Mesh(%s)"%self.filename
-            
-    def render(self, tex): # GPU-powered rendering!
-        '''Render mesh into buffers with texture from textureID.'''
-        glEnable(GL_TEXTURE_2D)
-        if self.cullbackface:
-            glEnable(GL_CULL_FACE)
-        glActiveTexture(GL_TEXTURE0)
-        glBindTexture(GL_TEXTURE_2D, tex.texID)
-        glUniform1i(Shader.current.uniformLocs["texture"], 0)
-        glUniform1f(Shader.current.uniformLocs["diffuse"], tex.diffuse)
-        glUniform1f(Shader.current.uniformLocs["specular"], tex.specular)
-        glUniform1f(Shader.current.uniformLocs["fresnel"], tex.fresnel)
-        glUniform1f(Shader.current.uniformLocs["shininess"], tex.shininess)
-
-        #====VBO (STANDARD, GPU PIPELINE)====
-        V, TC, N, TRI_I, _ = self.vbo_buffers
-        glEnableClientState(GL_VERTEX_ARRAY)
-        glEnableClientState(GL_TEXTURE_COORD_ARRAY)
-        glEnableClientState(GL_NORMAL_ARRAY)
-        
-        glBindBuffer(GL_ARRAY_BUFFER, V)
-        glVertexPointer(3, GL_FLOAT, 0, None)
-        glBindBuffer(GL_ARRAY_BUFFER, TC)
-        glTexCoordPointer(2, GL_FLOAT, 0, None)
-        glBindBuffer(GL_ARRAY_BUFFER, N)
-        glNormalPointer(GL_FLOAT, 0, None)
-
-        # WE SHOULD TAKE RENDERING JOBS
-        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, TRI_I)
-        # AND PUSH IT TO THE GPU PIPELINE
-        glDrawElements(GL_TRIANGLES, len(self.vbo_tri_indices), GL_UNSIGNED_INT, None)
-        
-        glDisableClientState(GL_NORMAL_ARRAY)
-        glDisableClientState(GL_TEXTURE_COORD_ARRAY)
-        glDisableClientState(GL_VERTEX_ARRAY)
 
-        glDisable(GL_TEXTURE_2D)
-        glDisable(GL_CULL_FACE)
+    def ray_hit(self, origin, direction):
+        '''First of my triangles hit by the ray from origin along direction, in mesh coordinates.
+           Returns (t, triangle), the ray parameter of the hit and the triangle's index into
+           vbo_tri_indices in threes, or None. Back faces are missed if cullbackface.'''
+        triangles = self.geometry.triangle_bvh().ray(origin, direction)
+        t = ray_triangle_intersections(origin, direction, *self.geometry.triangle_corners(triangles), self.cullbackface)
+        if not len(t) or not np.isfinite(t.min()):
+            return None
+        return t.min(), triangles[t.argmin()]
+            
+    def bind(self, lines=False):
+        '''Bind my buffers for draw(lines), pointing the enabled client arrays into them'''
+        VBO, TRI_I, LINE_I = self.vbo_buffers
+        glBindBuffer(GL_ARRAY_BUFFER, VBO)
+        glVertexPointer(3, GL_FLOAT, VBO_STRIDE, vbo_offset(VBO_VERTEX))
+        glTexCoordPointer(2, GL_FLOAT, VBO_STRIDE, vbo_offset(VBO_TEXCOORD))
+        glNormalPointer(GL_FLOAT, VBO_STRIDE, vbo_offset(VBO_NORMAL))
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, LINE_I if lines else TRI_I)
+
+    def draw(self, lines=False, instances=None): # GPU-powered rendering!
+        '''Draw my triangles, or my wireframe if lines, from the buffers bound by bind(lines).
+           Draws (instances) instances with one call if given.'''
+        mode, indices = (GL_LINES, self.vbo_line_indices) if lines else (GL_TRIANGLES, self.vbo_tri_indices)
+        if instances is None:
+            glDrawElements(mode, len(indices), GL_UNSIGNED_INT, None)
+        else:
+            glDrawElementsInstanced(mode, len(indices), GL_UNSIGNED_INT, None, instances)
 
     def render_wireframe(self):
-        V, _, _, _, LINE_I = self.vbo_buffers
         glEnableClientState(GL_VERTEX_ARRAY)
-        glBindBuffer(GL_ARRAY_BUFFER, V)
-        glVertexPointer(3, GL_FLOAT, 0, None)
-        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, LINE_I)
-        glDrawElements(GL_LINES, len(self.vbo_line_indices), GL_UNSIGNED_INT, None)
+        self.bind(lines=True)
+        self.draw(lines=True)
         glDisableClientState(GL_VERTEX_ARRAY)
 
     def delete(self):
         '''Unload self, turning into a cube'''
+        if self.geometry is not None:
+            Mesh.geometries.release(self.key)
         self._clear()
         self.filename = r"./assets/meshes/_default.obj"
         self.name = None
@@ -360,11 +653,20 @@ class Mesh(Asset):
         del Mesh.meshDict[self.ID]
 
     def __copy__(self):
-        return Mesh(self.tmpFilename, cullbackface=self.cullbackface, name=self.name)
+        # shares the geometry, only the rendering specifications are copied
+        return Mesh(self.tmpFilename, cullbackface=self.cullbackface, name=self.name, prepared=(self.key, None, None))
 
     def __deepcopy__(self, memo):
         return copy.copy(self)
 
+def prepare_mesh(filename):
+    '''Does the CPU work of loading mesh filename and returns the prepared
+       (key, arrays, meta) for Mesh(filename, prepared=...). Safe to run in a worker process.'''
+    mesh = Mesh.__new__(Mesh) # no ID and no GL buffers, only the CPU stage of _load
+    mesh._clear()
+    mesh.filename = filename
+    return mesh._prepare(content_key(filename))
+
 class Bulb(Asset):
     '''Describes a bulb with power and color specifications.'''
     IDs = id_gen()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+'''
+bvh.py
+bounding volume hierarchy over axis-aligned boxes
+
+Boxes are sorted along a Morton curve through their centers and packed
+LEAF_SIZE to a leaf in that order, then every BRANCHING nodes of a level
+are merged into a node of the level above, up to the root. Each level
+is one flat array, so building, refitting and querying take a few NumPy
+operations per level of the tree rather than per node.
+Moving boxes only refits the leaves they are in and the ancestors of
+those leaves. The tree keeps its shape until it is built again, which
+RenderList does whenever the scene tree changes.
+
+Boxes are (n,2,3) arrays of [minPoint, maxPoint]. A query runs one test
+on the nodes and then on the items of the leaves it reaches, so the test
+has to pass every box around a box that passes.
+'''
+
+from all_modules import *
+
+LEAF_SIZE = 8 # items per leaf
+BRANCHING = 8 # children per node
+MORTON_BITS = 10 # per axis
+EMPTY_BOUNDS = np.array([[np.inf]*3, [-np.inf]*3]) # [minPoint, maxPoint] of no box
+
+def spread_bits(x):
+  '''Spread the low MORTON_BITS bits of integer array x two bits apart'''
+  x = x & 0x3ff
+  x = (x | x << 16) & 0x30000ff
+  x = (x | x << 8) & 0x300f00f
+  x = (x | x << 4) & 0x30c30c3
+  x = (x | x << 2) & 0x9249249
+  return x
+
+def morton_codes(points):
+  '''Codes of points (n,3) along a Morton curve through their bounding box'''
+  points = np.nan_to_num(points, posinf=0, neginf=0) # centers of empty boxes go anywhere
+  lo, hi = points.min(axis=0, initial=0), points.max(axis=0, initial=0)
+  scale = (1 << MORTON_BITS) - 1
+  cells = ((points - lo) / np.where(hi > lo, hi - lo, 1) * scale).astype(np.int64)
+  return spread_bits(cells[:, 0]) | spread_bits(cells[:, 1]) << 1 | spread_bits(cells[:, 2]) << 2
+
+def ray_box_intersections(origins, directions, lo, hi):
+  '''
+Slab test of rays (origins, directions) against boxes [lo, hi], all given
+per axis as arrays (3,...) that broadcast together. Returns (near, far):
+the ray parameters where each ray enters and leaves its box's slabs.
+The ray hits the box if far >= max(near, 0).
+  '''
+  near = far = None
+  for axis in range(3):
+    o, d = origins[axis], directions[axis]
+    with np.errstate(divide="ignore", invalid="ignore"): # parallel to the slabs, handled below
+      t1, t2 = (lo[axis]-o)/d, (hi[axis]-o)/d
+    axisNear, axisFar = np.minimum(t1, t2), np.maximum(t1, t2)
+    if np.any(d == 0): # between the slabs all along, or never
+      between = (lo[axis] <= o) & (o <= hi[axis])
+      axisNear = np.where(d == 0, np.where(between, -np.inf, np.inf), axisNear)
+      axisFar = np.where(d == 0, np.where(between, np.inf, -np.inf), axisFar)
+    near = axisNear if near is None else np.maximum(near, axisNear)
+    far = axisFar if far is None else np.minimum(far, axisFar)
+  return near, far
+
+def ray_hits(origin, direction, bounds):
+  '''
+Boolean array of which boxes (n,2,3) the ray from origin along direction
+hits. Multiplies by the reciprocal direction, which rounds the same way
+for a box and any box inside it, so a node is never missed when one of
+its items is hit.
+  '''
+  inverse = 1/np.where(direction == 0, 1e-300, direction) # huge instead of inf, which would give 0*inf
+  t1, t2 = (bounds[:, 0]-origin)*inverse, (bounds[:, 1]-origin)*inverse
+  near = np.minimum(t1, t2).max(axis=1)
+  far = np.maximum(t1, t2).min(axis=1)
+  return far >= np.maximum(near, 0)
+
+def ray_triangle_intersections(origin, direction, A, B, C, cull=False):
+  '''
+Ray parameters where the ray from origin along direction hits triangles
+with corners A, B, C (n,3), inf where it misses. Triangles facing away
+from the ray, clockwise as it sees them, are missed if cull.
+  '''
+  e1, e2 = B-A, C-A
+  p = np.cross(direction, e2)
+  det = np.einsum("ni,ni->n", e1, p) # > 0 facing the ray
+  s = origin-A
+  q = np.cross(s, e1)
+  with np.errstate(divide="ignore", invalid="ignore"): # det is 0 parallel to the triangle, a miss
+    u = np.einsum("ni,ni->n", s, p)/det
+    v = (q @ direction)/det
+    t = np.einsum("ni,ni->n", e2, q)/det
+  hit = (u >= 0) & (v >= 0) & (u+v <= 1) & (t >= 0) & ((det > 0) if cull else (det != 0))
+  return np.where(hit, t, np.inf)
+
+def frustum_overlaps(planes, bounds):
+  '''
+Boolean array of which boxes (n,2,3) may be in the frustum of planes, the
+columns of a 4xm matrix: a point p is in it if [*p, 1] @ planes >= 0.
+A box is outside only if it is entirely behind one of the planes.
+  '''
+  # the corner of each box furthest along each plane's normal, (n,m,3)
+  corners = np.where(planes[0:3].T[None] > 0, bounds[:, None, 1], bounds[:, None, 0])
+  with np.errstate(invalid="ignore"): # empty boxes give nan, which is outside
+    return (np.einsum("npi,ip->np", corners, planes[0:3]) + planes[3] >= 0).all(axis=1)
+
+def box_overlaps(lo, hi, bounds):
+  '''Boolean array of which boxes (n,2,3) overlap the box [lo, hi]'''
+  return ((bounds[:, 0] <= hi) & (bounds[:, 1] >= lo)).all(axis=1)
+
+def merge(bounds):
+  '''Boxes around each run of BRANCHING boxes of bounds (n*BRANCHING,2,3)'''
+  bounds = bounds.reshape(-1, BRANCHING, 2, 3)
+  return np.stack([bounds[:, :, 0].min(axis=1), bounds[:, :, 1].max(axis=1)], axis=1)
+
+def pad(bounds):
+  '''bounds (n,2,3) with empty boxes up to a multiple of BRANCHING'''
+  return np.concatenate([bounds, np.broadcast_to(EMPTY_BOUNDS, (-len(bounds)%BRANCHING, 2, 3))])
+
+class BVH:
+  '''Bounding volume hierarchy over n boxes, which are called items 0 to n-1'''
+  def __init__(self, bounds):
+    '''Build over boxes (n,2,3)'''
+    self.count = n = len(bounds)
+    self.boxes = np.concatenate([np.asarray(bounds, float).reshape(-1, 2, 3), EMPTY_BOUNDS[None]]) # item n pads the last leaf
+    order = np.argsort(morton_codes(self.boxes[:n, 0] + self.boxes[:n, 1])) # centers, doubled
+    self.slots = np.full(-(-max(n, 1)//LEAF_SIZE)*LEAF_SIZE, n)
+    self.slots[:n] = order
+    self.slots = self.slots.reshape(-1, LEAF_SIZE) # items of each leaf
+    self.leafOf = np.empty(n, int)
+    self.leafOf[order] = np.arange(n)//LEAF_SIZE
+    # node boxes a level at a time, the root's last; node j's children are
+    # nodes j*BRANCHING to j*BRANCHING+BRANCHING-1 of the level below
+    leaves = self.boxes[self.slots]
+    self.levels = [pad(np.stack([leaves[:, :, 0].min(axis=1), leaves[:, :, 1].max(axis=1)], axis=1))]
+    self.sizes = [len(self.slots)] # real nodes of each level, the rest pad
+    while self.sizes[-1] > 1:
+      self.sizes.append(len(self.levels[-1])//BRANCHING)
+      self.levels.append(pad(merge(self.levels[-1])))
+
+  def update(self, items, bounds):
+    '''Move (items) to boxes (bounds), refitting the tree around them'''
+    if not len(items):
+      return
+    self.boxes[items] = bounds
+    nodes = np.unique(self.leafOf[items])
+    leaves = self.boxes[self.slots[nodes]]
+    self.levels[0][nodes, 0] = leaves[:, :, 0].min(axis=1)
+    self.levels[0][nodes, 1] = leaves[:, :, 1].max(axis=1)
+    for below, level in zip(self.levels, self.levels[1:]):
+      nodes = np.unique(nodes//BRANCHING)
+      children = below[(nodes[:, None]*BRANCHING + np.arange(BRANCHING)).ravel()]
+      level[nodes] = merge(children)
+
+  def query(self, test):
+    '''Items whose boxes pass test(bounds (k,2,3)) -> boolean (k,), which must pass every box containing them'''
+    nodes = np.zeros(1, int)
+    for level in range(len(self.levels)-1, 0, -1):
+      nodes = nodes[test(self.levels[level][nodes])]
+      nodes = (nodes[:, None]*BRANCHING + np.arange(BRANCHING)).ravel()
+      nodes = nodes[nodes < self.sizes[level-1]]
+    nodes = nodes[test(self.levels[0][nodes])]
+    items = self.slots[nodes].ravel()
+    items = np.sort(items[items < self.count])
+    return items[test(self.boxes[items])]
+
+  def ray(self, origin, direction):
+    '''Items whose boxes the ray from origin along direction hits, see ray_hits'''
+    return self.query(lambda bounds: ray_hits(origin, direction, bounds))
+
+  def frustum(self, planes):
+    '''Items whose boxes may be in the frustum of planes, see frustum_overlaps'''
+    return self.query(lambda bounds: frustum_overlaps(planes, bounds))
+
+  def box(self, minPoint, maxPoint):
+    '''Items whose boxes overlap the box [minPoint, maxPoint]'''
+    lo, hi = np.asarray(minPoint, float), np.asarray(maxPoint, float)
+    return self.query(lambda bounds: box_overlaps(lo, hi, bounds))
@@ -9,6 +9,11 @@ The stack is used to walk through a tree of Renderables in a depth-first search.
 Whenever a Renderable is processed in the dfs, it modifies the current working
 modelview matrix and pushes it onto the stack. Several layers of matrix math
 are handled, each layer consisting of a translation, rotation, and scaling.
+
+The modelview stack is kept in NumPy (MODELVIEW) and only loaded into GL.
+Matrices are 4x4 arrays in GL's memory layout, so a point is transformed
+as the row vector [x, y, z, 1] times the matrix. Every Renderable caches
+its local and world matrices until its pose or an ancestor's changes.
 '''
 
 from all_modules import *
@@ -19,6 +24,9 @@ from all_modules import *
 from rotpoint import Point, Rot
 from shader import *
 from asset import id_gen
+from texbudget import TEX_BUDGET
+from lightclusters import LIGHT_CLUSTERS, ALL_LIGHTS, MODEL_LIGHTS, CLUSTERED_LIGHTS, material_max
+from bvh import BVH, EMPTY_BOUNDS, ray_box_intersections, frustum_overlaps
 
 EPSILON = abs(0.3 - 0.1 - 0.1 - 0.1)
 
@@ -32,6 +40,10 @@ FLAT = 0
 FULL = 1
 exporting = False
 renderingMode = FULL
+depthPrepass = False # lay down depth first, so that the phong shader only shades visible pixels
+lightAssignment = CLUSTERED_LIGHTS # which lamps each fragment is shaded with, see lightclusters.py
+exactPicking = True # pick models by their triangles, not only their boxes
+gpuPicking = True # pick what is drawn at the cursor from the ID buffer instead of casting a ray
 selected = set()
 monoselected = None
 highlighted = None
@@ -39,6 +51,19 @@ clipboard = None
 camPos = None
 camTrueFovy = None
 linkDepth = 0
+changeListeners = [] # called with no arguments whenever something that is drawn changes
+
+def changed():
+  '''Tell the changeListeners that the next frame will look different'''
+  for listener in changeListeners:
+    listener()
+
+def highlight(rend):
+  '''Highlight rend, publishing a change only if it was not highlighted already'''
+  global highlighted
+  if rend is not highlighted:
+    highlighted = rend
+    changed()
 
 def mix_permute(A, B):
   '''
@@ -94,6 +119,99 @@ def glApplyRot(rot, invert=False):
     glRotate(-degrees(rx), 1.0, 0.0, 0.0)
     glRotate(-degrees(-ry), 0.0, 1.0, 0.0)
 
+IDENTITY = np.identity(4)
+
+def translateMat(xyz):
+  '''Matrix of glTranslate(*xyz)'''
+  M = np.identity(4)
+  M[3, 0:3] = xyz
+  return M
+
+def rotateMat(angle, axis):
+  '''Matrix of a glRotate by (angle) radians about x, y or z (axis 0, 1 or 2)'''
+  i, j = [(1, 2), (2, 0), (0, 1)][axis]
+  M = np.identity(4)
+  M[i, i] = M[j, j] = cos(angle)
+  M[i, j] = sin(angle)
+  M[j, i] = -sin(angle)
+  return M
+
+def scaleMat(xyz):
+  '''Matrix of glScale(*xyz)'''
+  return np.diag([*xyz, 1.0])
+
+def rotMat(rot, invert=False):
+  '''Matrix of glApplyRot(rot, invert)'''
+  rx, ry, rz = rot
+  if not invert:
+    return rotateMat(-rz, 2) @ rotateMat(rx, 0) @ rotateMat(-ry, 1)
+  return rotateMat(ry, 1) @ rotateMat(-rx, 0) @ rotateMat(rz, 2)
+
+def viewMat(camera):
+  '''Matrix of the camera's view, as gluLookAt from the camera's position'''
+  f = normalize(np.array(camera.rot.get_forward_vector(invert=True)))
+  s = normalize(np.cross(f, np.array(camera.rot.get_upward_vector(invert=True))))
+  u = np.cross(s, f)
+  M = np.identity(4)
+  M[0:3, 0], M[0:3, 1], M[0:3, 2] = s, u, -f
+  return translateMat(-np.array(camera.pos)) @ M
+
+def frustumPlanes(camera, aspect, window=(-1, -1, 1, 1)):
+  '''
+Planes of the camera's view frustum in view coordinates as the columns of
+a 4x6 matrix: a point p is in the frustum if [*p, 1] @ planes >= 0.
+Only the part through window (x0, y0, x1, y1), in normalised device
+coordinates, if given.
+  '''
+  t = tan(radians(camera.getTrueFovy())/2)
+  near, far = camera.zRange
+  x0, y0, x1, y1 = window
+  return np.array([[0, 0, -1, -near], [0, 0, 1, far], # near, far
+                   [0, -1, -t*y1, 0], [0, 1, t*y0, 0], # top, bottom
+                   [-1, 0, -t*aspect*x1, 0], [1, 0, t*aspect*x0, 0]], float).T # right, left
+
+def transformBounds(bounds, matrices):
+  '''
+Axis-aligned boxes (n,2,3) of [minPoint, maxPoint] boxes (n,2,3)
+in 4x4 matrices (n,4,4). Empty boxes, with min > max, stay empty.
+  '''
+  empty = (bounds[:, 0] > bounds[:, 1]).any(axis=1)
+  bounds = np.where(empty[:, None, None], 0.0, bounds)
+  center, half = (bounds[:, 0]+bounds[:, 1])/2, (bounds[:, 1]-bounds[:, 0])/2
+  center = np.einsum("ni,nij->nj", center, matrices[:, 0:3, 0:3]) + matrices[:, 3, 0:3]
+  half = np.einsum("ni,nij->nj", half, np.abs(matrices[:, 0:3, 0:3]))
+  result = np.stack([center-half, center+half], axis=1)
+  result[empty] = EMPTY_BOUNDS
+  return result
+
+class TransformStack:
+  '''
+CPU copy of GL's modelview matrix stack for walking the scene tree.
+Each node puts its matrix on top and loads it into GL with one call,
+so the matrix never has to be read back from GL.
+  '''
+  def __init__(self):
+    self.stack = [IDENTITY]
+
+  def reset(self, M):
+    self.stack = [M]
+    glLoadMatrixd(M)
+
+  def top(self):
+    return self.stack[-1]
+
+  def push(self):
+    self.stack.append(self.stack[-1])
+
+  def pop(self): # GL's matrix is left for the next node to load
+    self.stack.pop()
+
+  def load(self, M):
+    self.stack[-1] = M
+    glLoadMatrixd(M)
+
+MODELVIEW = TransformStack()
+
 def gluGlobe():
   '''
 Places a radius 1 sphere where OpenGL's Model*View
@@ -107,84 +225,381 @@ transformation matrix iswithout writing to depth buffer.
   glPolygonMode(GL_FRONT_AND_BACK, GL_LINE)
   glDepthMask(False)
   glRotated(90, 1,0,0)
-  gluSphere(gluNewQuadric(), 1, 24, 12)
+  gluSphere(GPU.getQuadric(), 1, 24, 12)
   glRotated(-90, 1,0,0)
   glDepthMask(True)
   glPolygonMode(GL_FRONT_AND_BACK, GL_FILL)
   glPopMatrix()
 
+def gluMarquee(x0, y0, x1, y1, viewport):
+  '''Shade and outline the rectangle from (x0, y0) to (x1, y1) in window coordinates of viewport over the scene'''
+  x, y, w, h = viewport
+  glMatrixMode(GL_PROJECTION)
+  glPushMatrix()
+  glLoadIdentity()
+  glMatrixMode(GL_MODELVIEW)
+  glPushMatrix()
+  # unit square to the rectangle in normalised device coordinates
+  glLoadMatrixd(scaleMat([2*(x1-x0)/w, 2*(y1-y0)/h, 1]) @ translateMat([2*(x0-x)/w - 1, 2*(y0-y)/h - 1, 0]))
+  PLAIN_SHADER.use()
+  glDisable(GL_DEPTH_TEST)
+  glEnable(GL_BLEND)
+  glColor4f(0.79, 1.0, 0.75, 0.25)
+  GPU.geometry("planes").draw(GL_TRIANGLES, 0, 6)
+  glColor4f(0.79, 1.0, 0.75, 1.0)
+  glLineWidth(1)
+  GPU.geometry("square").draw(GL_LINES)
+  glDisable(GL_BLEND)
+  glEnable(GL_DEPTH_TEST)
+  glPopMatrix()
+  glMatrixMode(GL_PROJECTION)
+  glPopMatrix()
+  glMatrixMode(GL_MODELVIEW)
+
 def gluCamera(camera, aspect):
   glMatrixMode(GL_PROJECTION)
   glLoadIdentity()
   defacto_fovy = degrees(atan(tan(radians(camera.fovy)/2)/camera.zoom))*2
   gluPerspective(defacto_fovy, aspect, *camera.zRange)
   glMatrixMode(GL_MODELVIEW)
-  glLoadIdentity()
-  gluLookAt(0,0,0, *camera.rot.get_forward_vector(invert=True), *camera.rot.get_upward_vector(invert=True))
-  glTranslatef(*-camera.pos)
-
-def testRayBBIntersection(rayV, BBmin, BBmax):
-  '''Test if a ray from modelview origin intersects a bounding box in current modelview matrix. Returns the distance if they instersect and None they do not.'''
-  ## credit: http://www.opengl-tutorial.org/miscellaneous/clicking-on-objects/picking-with-custom-ray-obb-function/
-  rayV = np.array(rayV)
-  BBmin = np.array(BBmin)
-  BBmax = np.array(BBmax)
-  invertedModelview = glGetModelview()**-1
-  # test if origin is in the OBB
-  xyz1 = np.matrix([0.0, 0.0, 0.0, 1.0])*invertedModelview
-  origin_rel = np.array(xyz1).flatten()[0:3]
-  if (BBmin < origin_rel).all() and (origin_rel < BBmax).all():
-    return None
-  dMin = 0.0
-  dMax = float('Inf')
-  rayV_rel = np.array(np.matrix([*rayV, 1.0])*invertedModelview).flatten()[0:3] - origin_rel
-##  print()
-##  print(origin_rel, rayV_rel)
-  # test all axes
-  def extrapolateDistance(xyz, dxyz, axis, n):
-    if dxyz[axis] == 0:
-      return float("Inf")
-    m = np.linalg.norm(dxyz)/dxyz[axis]
-    a = n - xyz[axis]
-    return a*m
-  # x
-  d1 = extrapolateDistance(origin_rel, rayV_rel, 0, BBmin[0])
-  d2 = extrapolateDistance(origin_rel, rayV_rel, 0, BBmax[0])
-##  print("x", d1, d2)
-  if d1 > d2:
-    d1, d2 = d2, d1
-  dMin = max(dMin, d1)
-  dMax = min(dMax, d2)
-  if dMax < dMin:
-    return None
-
-  # y
-  d1 = extrapolateDistance(origin_rel, rayV_rel, 1, BBmin[1])
-  d2 = extrapolateDistance(origin_rel, rayV_rel, 1, BBmax[1])
-##  print("y", d1, d2)
-  if d1 > d2:
-    d1, d2 = d2, d1
-  dMin = max(dMin, d1)
-  dMax = min(dMax, d2)
-  if dMax < dMin:
-    return None
-
-  # z
-  d1 = extrapolateDistance(origin_rel, rayV_rel, 2, BBmin[2])
-  d2 = extrapolateDistance(origin_rel, rayV_rel, 2, BBmax[2])
-##  print("z", d1, d2)
-  if d1 > d2:
-    d1, d2 = d2, d1
-  dMin = max(dMin, d1)
-  dMax = min(dMax, d2)
-  if dMax < dMin:
-    return None
-
-  intersectionPoint_rel = origin_rel + normalize(rayV_rel)*dMin
-  intersectionPoint = np.array(
-    np.matrix([*intersectionPoint_rel, 1])*glGetModelview()
-    ).flatten()[0:3]
-  return np.linalg.norm(intersectionPoint)
+  MODELVIEW.reset(camera.viewMatrix())
+
+# HELPER GEOMETRY: the same for every node, so it is kept once in unit space
+# and each node stretches it over its own bounding box with a transform
+UNIT_BOX_VERTICES = np.array(list(mix_permute([0.0, 0.0, 0.0], [1.0, 1.0, 1.0])), np.float32)
+UNIT_BOX_LINE_INDICES = np.array([0,1, 0,2, 0,4,
+                                  1,3, 1,5, 2,3,
+                                  2,6, 4,5, 4,6,
+                                  3,7, 5,7, 6,7], np.uint32)
+UNIT_BOX_TRI_INDICES = np.array([0,2,6, 0,6,4,  1,3,7, 1,7,5, # the faces of each axis,
+                                 0,1,5, 0,5,4,  2,3,7, 2,7,6, # by the bit of the vertex index they share
+                                 0,1,3, 0,3,2,  4,5,7, 4,7,6], np.uint32)
+# a unit square on each plane through the origin, normal to z, x and y
+UNIT_PLANE_VERTICES = np.array([[0, 0, 0], [0, 1, 0], [1, 1, 0], [1, 0, 0],
+                                [0, 0, 0], [0, 0, 1], [0, 1, 1], [0, 1, 0],
+                                [0, 0, 0], [1, 0, 0], [1, 0, 1], [0, 0, 1]], np.float32)
+UNIT_PLANE_TRI_INDICES = np.array([0, 1, 2,  0, 2, 3,
+                                   4, 5, 6,  4, 6, 7,
+                                   8, 9,10,  8,10,11], np.uint32)
+UNIT_PLANE_NORMALS = [2, 0, 1] # axis each square of UNIT_PLANE_VERTICES is normal to
+UNIT_SQUARE_LINE_INDICES = np.array([0,1, 1,2, 2,3, 3,0], np.uint32) # outline of the first square
+AXES_VERTICES = np.array([[0, 0, 0], [100000, 0, 0],
+                          [0, 0, 0], [0, 100000, 0],
+                          [0, 0, 0], [0, 0, -100000]], np.float32)
+AXES_COLORS = np.array([[1, 0, 0], [1, 0, 0],
+                        [0, 1, 0], [0, 1, 0],
+                        [0, 0, 1], [0, 0, 1]], np.float32)
+AXES_LINE_INDICES = np.array([0,1, 2,3, 4,5], np.uint32)
+HELPER_GEOMETRY = { # name: (vertices, colors, indices)
+  "box": (UNIT_BOX_VERTICES, None, UNIT_BOX_LINE_INDICES),
+  "solid box": (UNIT_BOX_VERTICES, None, UNIT_BOX_TRI_INDICES),
+  "planes": (UNIT_PLANE_VERTICES, None, UNIT_PLANE_TRI_INDICES),
+  "square": (UNIT_PLANE_VERTICES[0:4], None, UNIT_SQUARE_LINE_INDICES),
+  "axes": (AXES_VERTICES, AXES_COLORS, AXES_LINE_INDICES),
+}
+
+class Geometry:
+  '''Vertex, optional color and index buffers of one shared shape'''
+  def __init__(self, resources, name, vertices, colors, indices):
+    self.V = resources.makeBuffer(name, GL_ARRAY_BUFFER, vertices)
+    self.C = None if colors is None else resources.makeBuffer(name, GL_ARRAY_BUFFER, colors)
+    self.I = resources.makeBuffer(name, GL_ELEMENT_ARRAY_BUFFER, indices)
+    self.count = len(indices)
+
+  def draw(self, mode, first=0, count=None):
+    '''Draw (count) indices from index (first), all of them by default'''
+    if count is None:
+      count = self.count - first
+    glEnableClientState(GL_VERTEX_ARRAY)
+    glBindBuffer(GL_ARRAY_BUFFER, self.V)
+    glVertexPointer(3, GL_FLOAT, 0, None)
+    if self.C is not None:
+      glEnableClientState(GL_COLOR_ARRAY)
+      glBindBuffer(GL_ARRAY_BUFFER, self.C)
+      glColorPointer(3, GL_FLOAT, 0, None)
+    glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.I)
+    glDrawElements(mode, count, GL_UNSIGNED_INT, ctypes.c_void_p(first*4))
+    glDisableClientState(GL_COLOR_ARRAY)
+    glDisableClientState(GL_VERTEX_ARRAY)
+
+class GPUResources:
+  '''
+Owner of the GL objects the engine draws with, apart from assets.
+Every buffer is tracked by owner from creation to deletion, so the
+live count and size stay visible over a long editing session.
+Helper geometry is made once, on first use, and shared by all nodes.
+  '''
+  def __init__(self):
+    self.owned = dict() # owner -> [(buffer, nbytes), ...]
+    self.geometries = dict() # name -> Geometry
+    self.quadric = None
+
+  def makeBuffer(self, owner, target, data):
+    '''Make a GL buffer for owner holding array data'''
+    data = np.ascontiguousarray(data)
+    buffer = glGenBuffers(1)
+    glBindBuffer(target, buffer)
+    glBufferData(target, data.nbytes, data, GL_STATIC_DRAW)
+    self.owned.setdefault(owner, []).append((buffer, data.nbytes))
+    return buffer
+
+  def streamBuffer(self, owner, target, data):
+    '''Refill the one buffer of owner with array data, for data that changes every frame'''
+    data = np.ascontiguousarray(data)
+    if owner not in self.owned:
+      self.owned[owner] = [(glGenBuffers(1), 0)]
+    buffer, _ = self.owned[owner][0]
+    glBindBuffer(target, buffer)
+    glBufferData(target, data.nbytes, data, GL_STREAM_DRAW)
+    self.owned[owner][0] = (buffer, data.nbytes)
+    return buffer
+
+  def free(self, owner):
+    '''Delete every buffer of owner'''
+    buffers = [buffer for buffer, _ in self.owned.pop(owner, [])]
+    if buffers:
+      glDeleteBuffers(len(buffers), buffers)
+    self.geometries.pop(owner, None)
+
+  def bufferCount(self):
+    return sum(len(buffers) for buffers in self.owned.values())
+
+  def bufferBytes(self):
+    return sum(nbytes for buffers in self.owned.values() for _, nbytes in buffers)
+
+  def geometry(self, name):
+    '''Get shared helper geometry (name) of HELPER_GEOMETRY'''
+    if name not in self.geometries:
+      vertices, colors, indices = HELPER_GEOMETRY[name]
+      self.geometries[name] = Geometry(self, name, vertices, colors, indices)
+    return self.geometries[name]
+
+  def getQuadric(self):
+    '''Get the one GLU quadric all spheres are drawn with'''
+    if self.quadric is None:
+      self.quadric = gluNewQuadric()
+    return self.quadric
+
+GPU = GPUResources()
+
+WIREFRAMES, SURFACES = 0, 1 # groups of queued draws, in drawing order
+DRAW_COUNTERS = ["Draws", "Instanced draws", "Program changes", "Texture binds", "Material uploads", "Mesh binds", "Depth pre-pass draws"]
+INSTANCE_WIDTH = 16+9+2 # floats per instance: modelview, normal matrix, then (offset, count) of its lamp list
+INSTANCE_STRIDE = INSTANCE_WIDTH*4 # bytes
+
+def normalMatrices(modelviews):
+  '''
+Normal matrices of 4x4 matrices modelviews (n,4,4), as (n,3,3) in GL's layout.
+They are the cofactor matrices, which are the inverse transposes up to
+scale, so they exist for flattened models too. Shaders normalise normals.
+  '''
+  A = modelviews[:, 0:3, 0:3]
+  cofactors = np.stack([np.cross(A[:, 1], A[:, 2]), np.cross(A[:, 2], A[:, 0]), np.cross(A[:, 0], A[:, 1])], axis=1)
+  det = np.einsum("ij,ij->i", A[:, 0], cofactors[:, 0])
+  return cofactors * np.where(det < 0, -1.0, 1.0)[:, None, None] # keep normals pointing out of mirrored models
+
+class DrawQueue:
+  '''
+The model draws of a frame. Models queue their draws while the scene is
+walked and flush() draws them sorted by GL state (program, texture,
+material, mesh), only changing state between draws that differ.
+Draws with the same state are merged: with instancing, each run is
+one instanced call reading its matrices and lamp lists from a per-frame
+instance buffer.
+The changes of the last flush are kept in counts for the stats panel.
+  '''
+  def __init__(self):
+    self.draws = []
+    self.counts = dict.fromkeys(DRAW_COUNTERS, 0)
+    self.instancing = False # set by initEngine if the GL supports it
+
+  def add(self, group, shader, mesh, tex, modelviews, frontFace=GL_CCW, lights=None):
+    '''
+Queue draws of mesh (its wireframe if group is WIREFRAMES) in each 4x4 matrix
+of modelviews (n,4,4). lights (n,2) are the (offset, count) of each copy's
+lamp list from LIGHT_CLUSTERS.assign, if lamps are assigned per model.
+    '''
+    if lights is None:
+      lights = np.zeros((len(modelviews), 2), np.float32)
+    if tex is None:
+      texID, material = 0, ()
+    else:
+      texID, material = tex.texID, (tex.diffuse, tex.specular, tex.fresnel, tex.shininess)
+    key = (group, shader.program, texID, material, int(mesh.vbo_buffers[0]), mesh.cullbackface, frontFace)
+    self.draws.append((key, shader, mesh, modelviews, lights))
+
+  def runs(self):
+    '''Sorted [(key, shader, mesh, modelviews, lights), ...] with the draws of the same key merged'''
+    self.draws.sort(key=lambda draw: draw[0])
+    runs = []
+    for key, shader, mesh, modelviews, lights in self.draws:
+      if runs and runs[-1][0] == key:
+        runs[-1][3].append(modelviews)
+        runs[-1][4].append(lights)
+      else:
+        runs.append((key, shader, mesh, [modelviews], [lights]))
+    return [(key, shader, mesh, np.concatenate(modelviews), np.concatenate(lights))
+            for key, shader, mesh, modelviews, lights in runs]
+
+  def uploadInstances(self, runs):
+    '''Fill the instance buffer with the matrices and lamp lists of every run'''
+    modelviews = np.concatenate([run[3] for run in runs])
+    instances = np.empty((len(modelviews), INSTANCE_WIDTH), np.float32)
+    instances[:, 0:16] = modelviews.reshape(-1, 16)
+    instances[:, 16:25] = normalMatrices(modelviews).reshape(-1, 9)
+    instances[:, 25:27] = np.concatenate([run[4] for run in runs])
+    return GPU.streamBuffer("instances", GL_ARRAY_BUFFER, instances)
+
+  def setInstanceAttribs(self, shader, enable):
+    for name, size in [("instanceModelview", 4), ("instanceNormalMatrix", 3), ("instanceLights", 1)]:
+      loc = shader.attribLocs[name]
+      if loc == -1:
+        continue
+      for column in range(loc, loc+size):
+        if enable:
+          glEnableVertexAttribArray(column)
+          glVertexAttribDivisor(column, 1)
+        else:
+          glVertexAttribDivisor(column, 0)
+          glDisableVertexAttribArray(column)
+
+  def pointInstanceAttribs(self, shader, buffer, first):
+    '''Point the instance attributes of shader at instances from (first) on in buffer'''
+    glBindBuffer(GL_ARRAY_BUFFER, buffer)
+    for name, columns, size, offset in [("instanceModelview", 4, 4, 0), ("instanceNormalMatrix", 3, 3, 16), ("instanceLights", 1, 2, 25)]:
+      loc = shader.attribLocs[name]
+      if loc == -1:
+        continue
+      for column in range(columns):
+        glVertexAttribPointer(loc+column, size, GL_FLOAT, False, INSTANCE_STRIDE,
+                              ctypes.c_void_p((first*INSTANCE_WIDTH + offset + column*size)*4))
+
+  def drawDepth(self, runs, instanceBuffer, firsts):
+    '''
+Depth pre-pass: draw only the depth of runs, so that the shading pass
+after it, testing with GL_LEQUAL, shades each pixel once.
+firsts are the runs' first instances in instanceBuffer.
+    '''
+    DEPTH_SHADER.use()
+    glColorMask(False, False, False, False)
+    if self.instancing:
+      self.setInstanceAttribs(DEPTH_SHADER, True)
+      glUniform1i(DEPTH_SHADER.uniformLocs["instanced"], 1)
+    meshKey = None
+    for (key, _, mesh, modelviews, _), first in zip(runs, firsts):
+      if key[4] != meshKey:
+        meshKey = key[4]
+        mesh.bind()
+      (glEnable if key[5] else glDisable)(GL_CULL_FACE)
+      glFrontFace(key[6])
+      if self.instancing:
+        self.pointInstanceAttribs(DEPTH_SHADER, instanceBuffer, first)
+        mesh.draw(instances=len(modelviews))
+      else:
+        for modelview in modelviews:
+          glLoadMatrixd(modelview)
+          mesh.draw()
+    if self.instancing:
+      self.setInstanceAttribs(DEPTH_SHADER, False)
+      glUniform1i(DEPTH_SHADER.uniformLocs["instanced"], 0)
+    glColorMask(True, True, True, True)
+    glDepthFunc(GL_LEQUAL)
+    glDepthMask(False) # the pre-pass has written it
+    self.counts["Depth pre-pass draws"] = sum(len(run[3]) for run in runs)
+
+  def flush(self):
+    '''Draw and empty the queue'''
+    counts = self.counts = dict.fromkeys(DRAW_COUNTERS, 0)
+    runs = self.runs()
+    self.draws.clear()
+    if not runs:
+      return
+    instanceBuffer = self.uploadInstances(runs) if self.instancing else None
+    firsts = np.cumsum([0]+[len(run[3]) for run in runs]).tolist() # of each run's instances in the instance buffer
+    # phong shading is the expensive part, so only its pixels are worth a pre-pass
+    prepassed = [i for i, run in enumerate(runs) if depthPrepass and run[0][0] == SURFACES and run[1] is PHONG_SHADER]
+    shader = group = texID = material = meshKey = cull = frontFace = None
+    glEnableClientState(GL_VERTEX_ARRAY)
+    glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+    glEnableClientState(GL_NORMAL_ARRAY)
+    glActiveTexture(GL_TEXTURE0)
+    for i, (key, runShader, mesh, modelviews, lights) in enumerate(runs):
+      lines = key[0] == WIREFRAMES
+      if prepassed and i == prepassed[0]:
+        if self.instancing and shader is not None:
+          self.setInstanceAttribs(shader, False)
+          glUniform1i(shader.uniformLocs["instanced"], 0)
+        self.drawDepth([runs[j] for j in prepassed], instanceBuffer, [firsts[j] for j in prepassed])
+        shader = meshKey = cull = frontFace = None # changed by the pre-pass
+      elif prepassed and i == prepassed[-1]+1:
+        glDepthFunc(GL_LESS)
+        glDepthMask(True)
+      if key[0] != group:
+        group, meshKey = key[0], None # a mesh's lines and tris are in different buffers
+        if lines:
+          glColor4f(0.0, 0.0, 0.0, 1.0)
+          glLineWidth(2)
+          glDisable(GL_TEXTURE_2D)
+        else:
+          glColor4f(1.0, 1.0, 1.0, 1.0)
+          glEnable(GL_TEXTURE_2D)
+      if runShader is not shader:
+        if self.instancing and shader is not None:
+          self.setInstanceAttribs(shader, False)
+          glUniform1i(shader.uniformLocs["instanced"], 0)
+        shader, material = runShader, None # uniforms belong to the program
+        shader.use()
+        glUniform1i(shader.uniformLocs["texture"], 0)
+        if self.instancing:
+          self.setInstanceAttribs(shader, True)
+          glUniform1i(shader.uniformLocs["instanced"], 1)
+        counts["Program changes"] += 1
+      if key[2] != texID:
+        texID = key[2]
+        glBindTexture(GL_TEXTURE_2D, texID)
+        counts["Texture binds"] += 1
+      if key[3] != material and not lines:
+        material = key[3]
+        for name, value in zip(["diffuse", "specular", "fresnel", "shininess"], material):
+          glUniform1f(shader.uniformLocs[name], value)
+        counts["Material uploads"] += 1
+      if key[4] != meshKey:
+        meshKey = key[4]
+        mesh.bind(lines=lines)
+        counts["Mesh binds"] += 1
+      if key[5] != cull:
+        cull = key[5]
+        (glEnable if cull and not lines else glDisable)(GL_CULL_FACE)
+      if key[6] != frontFace:
+        frontFace = key[6]
+        glFrontFace(frontFace)
+      if self.instancing:
+        self.pointInstanceAttribs(shader, instanceBuffer, firsts[i])
+        mesh.draw(lines=lines, instances=len(modelviews))
+        counts["Instanced draws"] += 1
+      else:
+        for modelview, light in zip(modelviews, lights):
+          glLoadMatrixd(modelview)
+          glUniform2f(shader.uniformLocs["drawLights"], *light)
+          mesh.draw(lines=lines)
+      counts["Draws"] += len(modelviews)
+    if self.instancing:
+      self.setInstanceAttribs(shader, False)
+      glUniform1i(shader.uniformLocs["instanced"], 0)
+    glDisableClientState(GL_NORMAL_ARRAY)
+    glDisableClientState(GL_TEXTURE_COORD_ARRAY)
+    glDisableClientState(GL_VERTEX_ARRAY)
+    glDisable(GL_TEXTURE_2D)
+    glDisable(GL_CULL_FACE)
+    glFrontFace(GL_CCW)
+    glDepthFunc(GL_LESS)
+    glDepthMask(True)
+
+  def stats(self):
+    '''[[label, count], ...] of the last flush for the stats panel'''
+    return [[name, self.counts[name]] for name in DRAW_COUNTERS]
+
+DRAWS = DrawQueue()
 
 class Camera:
   '''Describes a camera in 3-D position and rotation'''
@@ -197,6 +612,18 @@ class Camera:
     self.zoom = zoom # true fovy == atan(tan(fovy/2)/zoom)*2
     self.zRange = zRange # visible slice of the scene
 
+  def __setattr__(self, name, value):
+    super().__setattr__(name, value)
+    if name != "_view":
+      self._view = None # out of date
+      changed()
+
+  def viewMatrix(self):
+    '''Matrix of my view (viewMat), cached until I change'''
+    if getattr(self, "_view", None) is None:
+      self._view = viewMat(self)
+    return self._view
+
   def get_forward_vector(self, *args, **kwargs):
     return self.rot.get_forward_vector(*args, **kwargs)
 
@@ -214,6 +641,8 @@ class Renderable:
   def __init__(self, pos=Point(0, 0, 0), rot=Rot(0, 0, 0), scale=np.array([1.0, 1.0, 1.0]), visible=True, name="renderable0"):
 ##    self.ID = next(Renderable.IDs)
 ##    Renderable.rendDict[self.ID] = self
+    self._local = self._localInv = None # cached matrices, None when out of date
+    self._world = self._worldInv = None
     self.parent = None
     self.pos = pos
     self.rot = rot
@@ -223,25 +652,102 @@ class Renderable:
     self.minPoint = Point(0, 0, 0)
     self.maxPoint = Point(0, 0, 0)
     self.update_bbox()
-    self.init_axes()
 
   def __str__(self):
     return self.name
 
-  def glMat(self, invert=False): # gl transform according to position, orientation, and scale
-    if not invert:
-      # TRANSLATE
-      glTranslatef(*self.pos)
+  # setting the pose or the parent marks the cached matrices out of date
+  @property
+  def pos(self):
+    return self._pos
+
+  @pos.setter
+  def pos(self, pos):
+    self._pos = pos
+    self.invalidate()
+
+  @property
+  def rot(self):
+    return self._rot
+
+  @rot.setter
+  def rot(self, rot):
+    self._rot = rot
+    self.invalidate()
+
+  @property
+  def scale(self):
+    return self._scale
+
+  @scale.setter
+  def scale(self, scale):
+    self._scale = scale
+    self.invalidate()
+
+  @property
+  def visible(self):
+    return self._visible
+
+  @visible.setter
+  def visible(self, visible):
+    self._visible = visible
+    RenderList.shown()
+
+  @property
+  def parent(self):
+    return self._parent
+
+  @parent.setter
+  def parent(self, parent):
+    self._parent = parent
+    self.invalidate(local=False)
+
+  def invalidate(self, local=True):
+    '''Forget the cached world matrices of self and its subtree, and self's local ones if local'''
+    if local:
+      self._local = self._localInv = None
+      RenderList.moved(self)
+    else:
+      RenderList.treeChanged(self, self.parent) # shown if it was or will be, under its old or new parent
+    todo = [self]
+    while todo:
+      rend = todo.pop()
+      rend._world = rend._worldInv = None
+      # a child's world matrix is only ever cached while its parent's is
+      todo.extend(child for child in rend.worldChildren() if child._world is not None)
 
-      # ROTATE
-      glApplyRot(self.rot)
+  def worldChildren(self):
+    '''Renderables whose parent is self'''
+    return []
 
-      # SCALE
-      glScalef(self.scale[0], self.scale[1], self.scale[2])
-    else:
-      glScalef(1/self.scale[0], 1/self.scale[1], 1/self.scale[2])
-      glApplyRot(self.rot, invert=True)
-      glTranslatef(*-self.pos)
+  def localMatrix(self, invert=False):
+    '''Matrix of glMat(invert)'''
+    if self._local is None:
+      scale = np.array(self.scale, float)
+      self._local = scaleMat(scale) @ rotMat(self.rot) @ translateMat(self.pos)
+      self._localInv = translateMat(-np.array(self.pos)) @ rotMat(self.rot, invert=True) @ scaleMat(1/scale)
+    return self._localInv if invert else self._local
+
+  def worldMatrix(self, invert=False):
+    '''Matrix from my coordinates to world coordinates, or back if invert'''
+    if self._world is None:
+      if self.parent is None:
+        self._world, self._worldInv = self.localMatrix(), self.localMatrix(invert=True)
+      else:
+        self._world = self.localMatrix() @ self.parent.worldMatrix()
+        self._worldInv = self.parent.worldMatrix(invert=True) @ self.localMatrix(invert=True)
+    return self._worldInv if invert else self._world
+
+  def dirWorldMatrix(self, invert=False):
+    '''worldMatrix of my directory, identity at the top of the scene'''
+    return IDENTITY if self.parent is None else self.parent.worldMatrix(invert)
+
+  def glMat(self, invert=False): # gl transform according to position, orientation, and scale
+    glMultMatrixd(self.localMatrix(invert))
+
+  def loadMatrix(self):
+    '''Put my modelview on top of MODELVIEW and into GL'''
+    MODELVIEW.load(self.localMatrix() @ MODELVIEW.top())
 
   def place(self): # overload with function that puts the renderable in the OpenGL environment
     pass
@@ -267,42 +773,36 @@ class Renderable:
     elif renderingMode == FLAT:
       glColor4f(0.0, 0.0, 0.0, 0.75)
     glLineWidth(3)
-    V, LINE_I = self.vbo_bbox_buffers
-    glEnableClientState(GL_VERTEX_ARRAY)
-    glBindBuffer(GL_ARRAY_BUFFER, V)
-    glVertexPointer(3, GL_FLOAT, 0, None)
-    glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, LINE_I)
-    glDrawElements(GL_LINES, len(self.vbo_bbox_line_indices), GL_UNSIGNED_INT, None)
-    glDisableClientState(GL_VERTEX_ARRAY)
+    glPushMatrix()
+    glTranslatef(*self.minPoint)
+    glScalef(*(np.array(self.maxPoint) - np.array(self.minPoint)))
+    GPU.geometry("box").draw(GL_LINES)
+    glPopMatrix()
     glDisable(GL_BLEND)
 
   def placeAxes(self):
     PLAIN_SHADER.use()
     glLineWidth(5)
-    V, C, LINE_I = self.vbo_axes_buffers
-    glEnableClientState(GL_VERTEX_ARRAY)
-    glEnableClientState(GL_COLOR_ARRAY)
-    glBindBuffer(GL_ARRAY_BUFFER, V)
-    glVertexPointer(3, GL_FLOAT, 0, None)
-    glBindBuffer(GL_ARRAY_BUFFER, C)
-    glColorPointer(3, GL_FLOAT, 0, None)
-    glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, LINE_I)
-    glDrawElements(GL_LINES, len(self.vbo_bbox_line_indices), GL_UNSIGNED_INT, None)
-    glDisableClientState(GL_VERTEX_ARRAY)
-    glDisableClientState(GL_COLOR_ARRAY)
+    GPU.geometry("axes").draw(GL_LINES)
 
   def placePlanes(self):
     PLAIN_SHADER.use()
     # Face culling is, by default, disabled
     glEnable(GL_BLEND) # needed for alpha
     glDepthMask(False) # prevent writing to depth buffer
-    V, TRI_I = self.vbo_plane_buffers
     glColor4f(1.0, 1.0, 1.0, 0.25)
-    glEnableClientState(GL_VERTEX_ARRAY)
-    glBindBuffer(GL_ARRAY_BUFFER, V)
-    glVertexPointer(3, GL_FLOAT, 0, None)
-    glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, TRI_I)
-    glDrawElements(GL_TRIANGLES, len(self.vbo_plane_tri_indices), GL_UNSIGNED_INT, None)
+    planes = GPU.geometry("planes")
+    minPoint = np.array(self.minPoint)
+    extent = np.array(self.maxPoint) - minPoint
+    for i, axis in enumerate(UNIT_PLANE_NORMALS):
+      # stretch square i over the box, keeping it on its plane through the origin
+      offset, scale = minPoint.copy(), extent.copy()
+      offset[axis], scale[axis] = 0.0, 1.0
+      glPushMatrix()
+      glTranslatef(*offset)
+      glScalef(*scale)
+      planes.draw(GL_TRIANGLES, 6*i, 6)
+      glPopMatrix()
     glDepthMask(True) # resume writing to depth buffer
     glDisable(GL_BLEND) # needed for alpha
 
@@ -317,16 +817,16 @@ class Renderable:
 ##    dist = ((x-camx)**2 + (y-camy)**2 + (z-camz)**2)**0.5
 ##    scale = tan(radians(camTrueFovy))*dist/(100*glGetScale())
 ##    gluSphere(gluNewQuadric(), scale, 25, 25)
-    gluSphere(gluNewQuadric(), 1, 25, 25)
+    gluSphere(GPU.getQuadric(), 1, 25, 25)
     glDisable(GL_BLEND)
 
+  # per-node parts of the passes of Scene.render;
+  # RenderList walks the tree and loads each node's modelview beforehand
   def renderLight(self):
-    self.glMat()
+    pass
   
   def render(self, ancestorSelected=False):
-    self.glMat()
-    if self.visible:
-      self.place()
+    '''render selection decorations, drawn over the placed renderables'''
     if exporting:
       return
     if ancestorSelected:
@@ -344,7 +844,6 @@ class Renderable:
     '''render after effects for selected'''
     if exporting:
       return
-    self.glMat()
     if self is monoselected:
       self.placePlanes()
     # dashed lines for hidden lines
@@ -361,7 +860,6 @@ class Renderable:
   def renderOverlay(self):
     if exporting:
       return
-    self.glMat()
     if self is highlighted:
       self.placeOrigin()
 
@@ -394,161 +892,27 @@ class Renderable:
 
   def getTruePos(self, basePos=(0, 0, 0)):
     # xyz in my modelview matrix to xyz in world
-    glPushMatrix()
-    glLoadIdentity()
-##    glTranslatef(*basePos)
-    for rend in self.getPath():
-      rend.glMat()
-    M = np.matrix([[*basePos, 1]])
-    T = glGetModelview()
-    R = np.array(M*T)
-    glPopMatrix()
-    return Point(*R[0,0:3])
+    return Point(*(np.array([*basePos, 1.0]) @ self.worldMatrix())[0:3])
 
   def getTrueRot(self, baseRot=(0, 0, 0)):
-    glPushMatrix()
-    glLoadIdentity()
-    glApplyRot(baseRot, invert=True)
-    for rend in self.getPath():
-      rend.glMat()
-    r = Rot.from_transmat(glGetModelview())
-    glPopMatrix()
-    return r
+    return Rot.from_transmat(self.worldMatrix() @ rotMat(baseRot, invert=True))
 
   def getBasePos(self, truePos=(0, 0, 0)):
     # inverse of getTruePos: xyz in world to xyz in my modelview matrix
-    glPushMatrix()
-    glLoadIdentity()
-    for rend in self.getPath()[-1::-1]:
-      rend.glMat(invert=True)
-    M = np.matrix([[*truePos, 1]])
-    T = glGetFloatv(GL_MODELVIEW_MATRIX)
-    R = np.array(M*T)
-    glPopMatrix()
-    return Point(*R[0,0:3])
+    return Point(*(np.array([*truePos, 1.0]) @ self.worldMatrix(invert=True))[0:3])
 
   def getDirBasePos(self, truePos=(0, 0, 0)):
     # xyz in world to xyz in my directory's modelview matrix
-    glPushMatrix()
-    glLoadIdentity()
-    for rend in self.getPath()[-2::-1]:
-      rend.glMat(invert=True)
-    M = np.matrix([[*truePos, 1]])
-    T = glGetFloatv(GL_MODELVIEW_MATRIX)
-    R = np.array(M*T)
-    glPopMatrix()
-    return Point(*R[0,0:3])
+    return Point(*(np.array([*truePos, 1.0]) @ self.dirWorldMatrix(invert=True))[0:3])
 
   def getBaseRot(self, trueRot=(0, 0, 0)):
-    glPushMatrix()
-    glLoadIdentity()
-    for rend in self.getPath()[-1::-1]:
-      rend.glMat(invert=True)
-    glApplyRot(trueRot)
-    r = Rot.from_transmat(glGetModelview())
-    glPopMatrix()
-    return r
+    return Rot.from_transmat(rotMat(trueRot) @ self.worldMatrix(invert=True))
 
   def getDirBaseRot(self, trueRot=(0, 0, 0)):
-    glPushMatrix()
-    glLoadIdentity()
-    for rend in self.getPath()[-2::-1]:
-      rend.glMat(invert=True)
-    glApplyRot(trueRot)
-    r = Rot.from_transmat(glGetModelview())
-    glPopMatrix()
-    return r
+    return Rot.from_transmat(rotMat(trueRot) @ self.dirWorldMatrix(invert=True))
 
-  def update_bbox(self):
-    self.vbo_bbox_vertices = []
-    for xyz in mix_permute(self.minPoint, self.maxPoint):
-      self.vbo_bbox_vertices.extend(xyz)
-    self.vbo_bbox_line_indices = [0,1, 0,2, 0,4,
-                                  1,3, 1,5, 2,3,
-                                  2,6, 4,5, 4,6,
-                                  3,7, 5,7, 6,7]
-
-    # update buffers
-    buffers = glGenBuffers(2)
-    glBindBuffer(GL_ARRAY_BUFFER, buffers[0])
-    glBufferData(GL_ARRAY_BUFFER,
-                 len(self.vbo_bbox_vertices)*4,
-                 (ctypes.c_float*len(self.vbo_bbox_vertices))(*self.vbo_bbox_vertices),
-                 GL_STATIC_DRAW)
-    glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, buffers[1])
-    glBufferData(GL_ELEMENT_ARRAY_BUFFER,
-                 len(self.vbo_bbox_line_indices)*4,
-                 (ctypes.c_uint*len(self.vbo_bbox_line_indices))(*self.vbo_bbox_line_indices),
-                 GL_STATIC_DRAW)
-    self.vbo_bbox_buffers = buffers
-
-    self.update_planes()
-
-  def update_planes(self):
-    minx, miny, minz = self.minPoint
-    maxx, maxy, maxz = self.maxPoint
-    self.vbo_plane_vertices = [minx, miny,  0.0,
-                               minx, maxy,  0.0,
-                               maxx, maxy,  0.0,
-                               maxx, miny,  0.0,
-                                0.0, miny, minz,
-                                0.0, miny, maxz,
-                                0.0, maxy, maxz,
-                                0.0, maxy, minz,
-                               minx,  0.0, minz,
-                               maxx,  0.0, minz,
-                               maxx,  0.0, maxz,
-                               minx,  0.0, maxz,
-                               ]
-    self.vbo_plane_tri_indices = [ 0, 1, 2,  0, 2, 3,
-                                   4, 5, 6,  4, 6, 7,
-                                   8, 9,10,  8,10,11,
-                                  12,13,14, 12,14,15
-                                  ]
-    buffers = glGenBuffers(2)
-    glBindBuffer(GL_ARRAY_BUFFER, buffers[0])
-    glBufferData(GL_ARRAY_BUFFER,
-                 len(self.vbo_plane_vertices)*4,
-                 (ctypes.c_float*len(self.vbo_plane_vertices))(*self.vbo_plane_vertices),
-                 GL_STATIC_DRAW)
-    glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, buffers[1])
-    glBufferData(GL_ELEMENT_ARRAY_BUFFER,
-                 len(self.vbo_plane_tri_indices)*4,
-                 (ctypes.c_uint*len(self.vbo_plane_tri_indices))(*self.vbo_plane_tri_indices),
-                 GL_STATIC_DRAW)
-    self.vbo_plane_buffers = buffers
-
-  def init_axes(self):
-    self.vbo_axes_vertices = [0.0, 0.0, 0.0,
-                              100000.0, 0.0, 0.0,
-                              0.0, 0.0, 0.0,
-                              0.0, 100000.0, 0.0,
-                              0.0, 0.0, 0.0,
-                              0.0, 0.0, -100000.0]
-    self.vbo_axes_colors = [1.0, 0.0, 0.0,
-                            1.0, 0.0, 0.0,
-                            0.0, 1.0, 0.0,
-                            0.0, 1.0, 0.0,
-                            0.0, 0.0, 1.0,
-                            0.0, 0.0, 1.0]
-    self.vbo_axes_line_indices = [0,1, 2,3, 4,5]
-    buffers = glGenBuffers(3)
-    glBindBuffer(GL_ARRAY_BUFFER, buffers[0])
-    glBufferData(GL_ARRAY_BUFFER,
-                 len(self.vbo_axes_vertices)*4,
-                 (ctypes.c_float*len(self.vbo_axes_vertices))(*self.vbo_axes_vertices),
-                 GL_STATIC_DRAW)
-    glBindBuffer(GL_ARRAY_BUFFER, buffers[1])
-    glBufferData(GL_ARRAY_BUFFER,
-                 len(self.vbo_axes_colors)*4,
-                 (ctypes.c_float*len(self.vbo_axes_colors))(*self.vbo_axes_colors),
-                 GL_STATIC_DRAW)
-    glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, buffers[2])
-    glBufferData(GL_ELEMENT_ARRAY_BUFFER,
-                 len(self.vbo_axes_line_indices)*4,
-                 (ctypes.c_uint*len(self.vbo_axes_line_indices))(*self.vbo_axes_line_indices),
-                 GL_STATIC_DRAW)
-    self.vbo_axes_buffers = buffers
+  def update_bbox(self): # overload with function that sets minPoint and maxPoint, then calls this
+    RenderList.moved(self) # for my world-space bounds
 
   def cycleCheck(self):
     todo = [[self]]
@@ -563,13 +927,6 @@ class Renderable:
   def cycleCheckChildren(self):
     return []
 
-  def rayBBIntersections(self, rayV):
-    self.glMat()
-    dist = testRayBBIntersection(rayV, self.minPoint, self.maxPoint)
-    if dist is None:
-      return
-    yield self, dist
-
 class Model(Renderable):
   '''Describes polyhedron-like 3-D model in a position and orientation'''
   
@@ -579,6 +936,25 @@ class Model(Renderable):
     self.tex = tex
     super().__init__(*args, **kwargs)
 
+  # RenderList batches models by mesh and texture
+  @property
+  def mesh(self):
+    return self._mesh
+
+  @mesh.setter
+  def mesh(self, mesh):
+    self._mesh = mesh
+    RenderList.treeChanged(self)
+
+  @property
+  def tex(self):
+    return self._tex
+
+  @tex.setter
+  def tex(self, tex):
+    self._tex = tex
+    RenderList.treeChanged(self)
+
   def __repr__(self):
     reprtuple = (repr(self.mesh), repr(self.tex), repr(self.pos), repr(self.rot), repr(self.scale), repr(self.visible))
     return "Model(%s, %s, pos=%s, rot=%s, scale=%s, visible=%s)"%reprtuple
@@ -591,19 +967,22 @@ class Model(Renderable):
     return copy.copy(self) # i am a dead end
 
   def place(self):
+    Model.placeMany(self.mesh, self.tex, MODELVIEW.top()[None])
+
+  @staticmethod
+  def placeMany(mesh, tex, modelviews, lights=None):
+    '''Place models of mesh and tex in each 4x4 matrix of modelviews (n,4,4), lit by lamp lists (lights) if given'''
     if renderingMode == FULL:
-      PHONG_SHADER.use()
+      shader = PHONG_SHADER
     elif renderingMode == FLAT:
-      PLAIN_SHADER.use()
-      glColor4f(0.0, 0.0, 0.0, 1.0)
-      glLineWidth(2)
-      self.mesh.render_wireframe()
-      FLAT_SHADER.use()
-    glColor4f(1.0, 1.0, 1.0, 1.0)
-    if np.prod(self.scale) < 0.0:
-      glFrontFace(GL_CW)
-    self.mesh.render(self.tex)
-    glFrontFace(GL_CCW)
+      DRAWS.add(WIREFRAMES, PLAIN_SHADER, mesh, None, modelviews)
+      shader = FLAT_SHADER
+    TEX_BUDGET.request(tex, mesh.min_xyz, mesh.max_xyz, modelviews)
+    mirrored = np.linalg.det(modelviews[:, 0:3, 0:3]) < 0.0
+    for frontFace, batch in [(GL_CCW, ~mirrored), (GL_CW, mirrored)]:
+      if batch.any():
+        DRAWS.add(SURFACES, shader, mesh, tex, modelviews[batch], frontFace,
+                  None if lights is None else lights[batch])
 
   def placeASel(self):
     PLAIN_SHADER.use()
@@ -641,8 +1020,7 @@ class Lamp(Renderable):
   def renderLight(self):
     if not self.visible:
       return
-    super().renderLight()
-    Lamp.lPositions[Lamp.i] = glGetModelviewPos()
+    Lamp.lPositions[Lamp.i] = MODELVIEW.top()[3, 0:3]
     Lamp.lColorPowers[Lamp.i] = np.array(self.bulb.color) * self.bulb.power
     Lamp.i += 1
 
@@ -664,7 +1042,7 @@ class Lamp(Renderable):
     if renderingMode == FLAT:
       PLAIN_SHADER.use()
       glColor4f(1.0, 1.0, 0.0, 1.0)
-      gluSphere(gluNewQuadric(), 1, 25, 25)
+      gluSphere(GPU.getQuadric(), 1, 25, 25)
 
   def __copy__(self):
     return Lamp(self.bulb, pos=self.pos, rot=self.rot, scale=self.scale.copy(), visible=self.visible, name=self.name)
@@ -683,6 +1061,9 @@ class Directory(Renderable):
   def __iter__(self):
     return self.rends.__iter__()
 
+  def worldChildren(self):
+    return self.rends
+
   def __copy__(self):
     return Link(self)
 
@@ -704,38 +1085,7 @@ class Directory(Renderable):
 
   def clear(self):
     self.rends.clear()
-
-  def renderLight(self):
-    super().renderLight()
-    for rend in self.rends:
-      glPushMatrix()
-      rend.renderLight()
-      glPopMatrix()
-
-  def render(self, ancestorSelected=False):
-    super().render(ancestorSelected=ancestorSelected)
-    if self in selected:
-      ancestorSelected = True
-    if not self.visible:
-      return
-    for rend in self.rends:
-      glPushMatrix()
-      rend.render(ancestorSelected=ancestorSelected)
-      glPopMatrix()
-
-  def renderSelectedAE(self):
-    super().renderSelectedAE()
-    for rend in self.rends:
-      glPushMatrix()
-      rend.renderSelectedAE()
-      glPopMatrix()
-
-  def renderOverlay(self):
-    super().renderOverlay()
-    for rend in self.rends:
-      glPushMatrix()
-      rend.renderOverlay()
-      glPopMatrix()
+    RenderList.treeChanged(self)
 
   def update_bbox(self):
     if not self.rends:
@@ -743,28 +1093,19 @@ class Directory(Renderable):
       self.maxPoint = Point(0, 0, 0)
       super().update_bbox()
       return
-    min_xyz = [None, None, None]
-    max_xyz = [None, None, None]
-    for rend in self.rends:
-      for i, (minn, maxn, n) in enumerate(zip(min_xyz, max_xyz, rend.pos)):
-        if minn is None or n < minn:
-          min_xyz[i] = n
-        if maxn is None or n > maxn:
-          max_xyz[i] = n
-    self.minPoint = Point(*min_xyz)
-    self.maxPoint = Point(*max_xyz)
+    # the boxes of my renderables, turned and scaled into my coordinates
+    rends = list(self.rends)
+    for rend in rends:
+      rend.update_bbox()
+    bounds = transformBounds(np.array([[rend.minPoint, rend.maxPoint] for rend in rends], float),
+                             np.array([rend.localMatrix() for rend in rends]))
+    self.minPoint = Point(*bounds[:, 0].min(axis=0))
+    self.maxPoint = Point(*bounds[:, 1].max(axis=0))
     super().update_bbox()
 
   def cycleCheckChildren(self):
     return self.rends
 
-  def rayBBIntersections(self, rayV):
-    self.glMat()
-    for rend in self.rends:
-      glPushMatrix()
-      yield from rend.rayBBIntersections(rayV)
-      glPopMatrix()
-
 class Link(Renderable): # TODO: more overloads
   # Be cautious while using these
   # they're like link files in directories
@@ -786,50 +1127,11 @@ class Link(Renderable): # TODO: more overloads
   def __deepcopy__(self, memo):
     return copy.copy(self)
 
-  def renderLight(self):
-    super().renderLight()
-    for rend in self.directory.rends:
-      glPushMatrix()
-      rend.renderLight()
-      glPopMatrix()
-
-  def render(self, ancestorSelected=False):
-    if self.directory in selected:
-      selected.add(self)
-    super().render(ancestorSelected=ancestorSelected)
-    if self in selected:
-      ancestorSelected = True
-    if not self.visible:
-      return
-    global linkDepth
-    linkDepth += 1
-    for rend in self.directory.rends:
-      glPushMatrix()
-      rend.render(ancestorSelected=ancestorSelected)
-      glPopMatrix()
-    linkDepth -= 1
-
-  def renderSelectedAE(self):
-    super().renderSelectedAE()
-    global linkDepth
-    linkDepth += 1
-    for rend in self.directory.rends:
-      glPushMatrix()
-      rend.renderSelectedAE()
-      glPopMatrix()
-    linkDepth -= 1
-
-  def renderOverlay(self):
-    super().renderOverlay()
-    for rend in self.directory.rends:
-      glPushMatrix()
-      rend.renderOverlay()
-      glPopMatrix()
-
   def update_bbox(self):
+    # the directory's renderables are placed in my coordinates
     self.directory.update_bbox()
-    self.minPoint = Point(0, 0, 0)
-    self.maxPoint = Point(0, 0, 0)
+    self.minPoint = self.directory.minPoint
+    self.maxPoint = self.directory.maxPoint
     super().update_bbox()
 
   def placeBBox(self):
@@ -838,13 +1140,6 @@ class Link(Renderable): # TODO: more overloads
   def cycleCheckChildren(self):
     return self.directory.rends
 
-  def rayBBIntersections(self, rayV):
-    self.glMat()
-    for rend in self.directory.rends:
-      glPushMatrix()
-      yield from rend.rayBBIntersections(rayV)
-      glPopMatrix()
-
 class TreeError(Exception): # call when a tree is invalid (including links--they should not cycle to themselves)
   def __init__(self, path):
     self.path = path
@@ -852,6 +1147,485 @@ class TreeError(Exception): # call when a tree is invalid (including links--they
   def __str__(self):
     return " > ".join(node.name for node in self.path)
 
+RESORT_DISTANCE = 0.5 # how far the camera moves before draws are sorted again
+RESORT_ANGLE = 5.0 # degrees the camera turns before draws are sorted again
+
+class RenderList:
+  '''
+Scene tree compiled into flat arrays in depth-first order, so that each
+pass of Scene.render is one loop instead of a recursive traversal.
+Renderables shown through several Links get an entry for each path.
+Entry i's subtree is the range [i, ends[i]). Moving a Renderable only
+recomputes the world matrices of its entries' subtrees; changing the
+tree rebuilds the list on the next update.
+Models are placed in batches of the same mesh and texture, so every
+copy of a model, through Links or not, is part of one instanced draw.
+Every entry has world-space bounds of its subtree, kept up to date
+with the world matrices, and entries outside the frustum are culled.
+The world-space boxes of the pickable entries are also kept in a BVH,
+refitted as they move and built again with the list, for ray, frustum
+and box queries.
+The models of each batch are drawn front to back, so that the depth
+test rejects hidden fragments before they are shaded. The order is
+only sorted again once the camera has moved or turned noticeably.
+  '''
+  compiled = weakref.WeakSet() # every RenderList, told about changes by Renderables
+
+  def __init__(self, scene):
+    self.scene = scene
+    self.dirty = True
+    self.movedRends = set()
+    self.sortedFrom = None # (camera position, forward) the batches were last sorted from
+    self.version = 0 # counts changes to what is drawn where
+    self.placed = (None, None, None) # (version, *shownMasks()) of the last shownMasks
+    self.counts = {"Models drawn": 0, "Models culled": 0}
+    RenderList.compiled.add(self)
+
+  @staticmethod
+  def moved(rend):
+    for renderList in RenderList.compiled:
+      if not renderList.dirty:
+        renderList.movedRends.add(rend)
+      renderList.version += 1
+    changed()
+
+  @staticmethod
+  def treeChanged(*rends):
+    '''Rebuild the lists that show any of rends, every list if none are given'''
+    shown = False
+    for renderList in RenderList.compiled:
+      if renderList.dirty or not rends or any(rend in renderList.entriesOf for rend in rends):
+        renderList.dirty = True
+        renderList.version += 1
+        shown = True
+    if shown: # renderables outside any scene, like clipboard copies, change nothing drawn
+      changed()
+
+  @staticmethod
+  def shown():
+    '''A Renderable was shown or hidden'''
+    for renderList in RenderList.compiled:
+      renderList.version += 1
+    changed()
+
+  def build(self):
+    rends, parents, depths, levels, ends = [], [], [], [], []
+    def visit(rend, parent, depth, level):
+      i = len(rends)
+      rends.append(rend)
+      parents.append(parent)
+      depths.append(depth)
+      levels.append(level)
+      ends.append(None)
+      if isinstance(rend, Link):
+        depth += 1
+      for child in rend.cycleCheckChildren():
+        visit(child, i, depth, level+1)
+      ends[i] = len(rends)
+    for rend in self.scene.rends:
+      visit(rend, -1, 0, 0)
+
+    self.rends, self.depths = rends, depths
+    self.parents = np.array(parents, int) # -1 for roots
+    self.ends = np.array(ends, int)
+    self.levels = np.array(levels, int)
+    self.entriesOf = ddict(list)
+    for i, rend in enumerate(rends):
+      self.entriesOf[rend].append(i)
+    self.rendIDs = np.empty(len(rends), int) # the same for every entry of a renderable
+    for k, entries in enumerate(self.entriesOf.values()):
+      self.rendIDs[entries] = k
+    self.lamps = [i for i, rend in enumerate(rends) if isinstance(rend, Lamp)]
+    self.links = [i for i, rend in enumerate(rends) if isinstance(rend, Link)]
+    self.batches = ddict(list) # (mesh, tex) -> Model entries
+    for i, rend in enumerate(rends):
+      if isinstance(rend, Model):
+        self.batches[rend.mesh, rend.tex].append(i)
+    self.batches = {key: np.array(batch) for key, batch in self.batches.items()}
+    self.models = np.array([i for i, rend in enumerate(rends) if isinstance(rend, Model)], int)
+    self.others = np.array([i for i, rend in enumerate(rends) if not isinstance(rend, Model)], int)
+    self.pickable = np.array([i for i, rend in enumerate(rends) if not isinstance(rend, (Directory, Link))], int)
+    self.locals = np.array([rend.localMatrix() for rend in rends]).reshape(-1, 4, 4)
+    self.localInvs = np.array([rend.localMatrix(invert=True) for rend in rends]).reshape(-1, 4, 4)
+    self.world = np.empty((len(rends)+1, 4, 4))
+    self.worldInv = np.empty((len(rends)+1, 4, 4)) # for picking
+    self.world[-1] = self.worldInv[-1] = IDENTITY # parent of the roots
+    self.updateWorld(0, len(rends))
+    # own boxes in local coordinates; Directories and Links only have their subtrees'
+    self.localBounds = np.array([EMPTY_BOUNDS if isinstance(rend, (Directory, Link)) else [rend.minPoint, rend.maxPoint]
+                                 for rend in rends], float).reshape(-1, 2, 3)
+    self.ownBounds = np.empty((len(rends), 2, 3)) # world-space
+    self.bounds = np.empty((len(rends), 2, 3)) # world-space, with the subtree
+    self.bvh = None
+    self.updateBounds(0, len(rends))
+    self.bvh = BVH(self.ownBounds[self.pickable]) # item k is entry pickable[k]
+    self.dirty = False
+    self.movedRends.clear()
+    self.sortedFrom = None
+    self.version += 1 # the Scene marks it dirty without telling treeChanged
+
+  def updateWorld(self, start, end):
+    '''Recompute the world matrices of entries [start, end), a level at a time'''
+    if start == end:
+      return
+    levels = self.levels[start:end]
+    for level in range(levels.min(), levels.max()+1):
+      i = start + np.flatnonzero(levels == level)
+      self.world[i] = self.locals[i] @ self.world[self.parents[i]]
+      self.worldInv[i] = self.worldInv[self.parents[i]] @ self.localInvs[i]
+
+  def updateBounds(self, start, end):
+    '''Recompute the world-space bounds of the subtree [start, end) and of its ancestors'''
+    if start == end:
+      return
+    self.ownBounds[start:end] = transformBounds(self.localBounds[start:end], self.world[start:end])
+    if self.bvh is not None:
+      first, last = np.searchsorted(self.pickable, [start, end])
+      self.bvh.update(np.arange(first, last), self.ownBounds[self.pickable[first:last]])
+    self.bounds[start:end] = self.ownBounds[start:end]
+    levels = self.levels[start:end]
+    for level in range(levels.max(), levels.min(), -1): # children into their parents, deepest first
+      i = start + np.flatnonzero(levels == level)
+      np.minimum.at(self.bounds[:, 0], self.parents[i], self.bounds[i, 0])
+      np.maximum.at(self.bounds[:, 1], self.parents[i], self.bounds[i, 1])
+    i = self.parents[start]
+    while i != -1:
+      self.bounds[i, 0] = self.ownBounds[i:self.ends[i], 0].min(axis=0)
+      self.bounds[i, 1] = self.ownBounds[i:self.ends[i], 1].max(axis=0)
+      i = self.parents[i]
+
+  def update(self):
+    '''Bring the list up to date with the scene'''
+    if self.dirty:
+      self.build()
+      return
+    ranges = []
+    if self.movedRends:
+      self.sortedFrom = None
+    for rend in self.movedRends:
+      for i in self.entriesOf.get(rend, ()):
+        self.locals[i] = rend.localMatrix()
+        self.localInvs[i] = rend.localMatrix(invert=True)
+        if not isinstance(rend, (Directory, Link)):
+          self.localBounds[i] = [rend.minPoint, rend.maxPoint]
+        ranges.append((i, self.ends[i]))
+    self.movedRends.clear()
+    end = -1
+    for start, stop in sorted(ranges):
+      if start >= end: # not inside a subtree already done
+        self.updateWorld(start, stop)
+        self.updateBounds(start, stop)
+        end = stop
+
+  def begin(self, view, planes):
+    '''Compute every entry's modelview for a frame seen through (view), and cull outside the frustum (planes)'''
+    self.modelviews = self.world[:-1] @ view
+    self.inFrustum = frustum_overlaps(view @ planes, self.bounds) # planes into world space
+    self.sortBatches(view)
+
+  def sortBatches(self, view):
+    '''Order the models of each batch front to back as seen through (view), unless the camera has barely moved since the last sort'''
+    position = -view[3, 0:3] @ view[0:3, 0:3].T
+    forward = -view[0:3, 2]
+    if self.sortedFrom is not None:
+      lastPosition, lastForward = self.sortedFrom
+      if (np.linalg.norm(position - lastPosition) < RESORT_DISTANCE
+          and forward @ lastForward > cos(radians(RESORT_ANGLE))):
+        return
+    depth = -self.modelviews[:, 3, 2] # of each entry's origin
+    self.sortedBatches = {key: batch[np.argsort(depth[batch], kind="stable")] for key, batch in self.batches.items()}
+    self.sortedFrom = position, forward
+
+  def load(self, i):
+    global linkDepth
+    linkDepth = self.depths[i]
+    MODELVIEW.load(self.modelviews[i])
+
+  def entries(self, rends):
+    '''Entries of (rends) in tree order'''
+    return sorted(chain.from_iterable(self.entriesOf.get(rend, ()) for rend in rends))
+
+  def mask(self, entries):
+    '''Boolean array over all entries, True for (entries)'''
+    mask = np.zeros(len(self.rends), bool)
+    mask[list(entries)] = True
+    return mask
+
+  def inside(self, mask):
+    '''Boolean array of the entries in the subtree of an entry in mask, not counting those entries'''
+    starts = np.flatnonzero(mask)
+    count = np.zeros(len(self.rends)+1, int)
+    np.add.at(count, starts+1, 1)
+    np.add.at(count, self.ends[starts], -1)
+    return np.cumsum(count)[:-1] > 0
+
+  def shownMasks(self):
+    '''
+Boolean arrays (shown, placed) of the entries not inside a hidden entry,
+and of those that are also visible themselves
+    '''
+    version, shown, placed = self.placed
+    if version != self.version:
+      visible = np.fromiter((rend.visible for rend in self.rends), bool, len(self.rends))
+      shown = ~self.inside(~visible)
+      placed = shown & visible
+      self.placed = self.version, shown, placed
+    return shown, placed
+
+  def placedMask(self):
+    '''Boolean array of the entries that are placed: visible, and not inside a hidden entry'''
+    return self.shownMasks()[1]
+
+  def renderLights(self):
+    for i in self.lamps:
+      self.load(i)
+      self.rends[i].renderLight()
+
+  def render(self):
+    '''Place the visible renderables, drawing the queued draws, then draw the selection decorations'''
+    rends = self.rends
+    for i in self.links: # a Link is selected with its directory
+      if rends[i].directory in selected:
+        selected.add(rends[i])
+    shown, placed = self.shownMasks() # hidden renderables hide their subtree
+    self.counts = dict.fromkeys(self.counts, 0)
+    lights = None
+    if lightAssignment == MODEL_LIGHTS and renderingMode == FULL:
+      drawn = self.models[placed[self.models] & self.inFrustum[self.models]]
+      lights = np.empty((len(rends), 2), np.float32)
+      lights[drawn] = LIGHT_CLUSTERS.assign(transformBounds(self.localBounds[drawn], self.modelviews[drawn]))
+    for (mesh, tex), batch in self.sortedBatches.items():
+      batch = batch[placed[batch]]
+      inFrustum = self.inFrustum[batch]
+      self.counts["Models culled"] += len(batch) - inFrustum.sum()
+      batch = batch[inFrustum]
+      self.counts["Models drawn"] += len(batch)
+      if len(batch):
+        Model.placeMany(mesh, tex, self.modelviews[batch], None if lights is None else lights[batch])
+    for i in self.others[placed[self.others] & self.inFrustum[self.others]]:
+      self.load(i)
+      rends[i].place()
+    DRAWS.flush()
+
+    isSelected = self.mask(self.entries(selected))
+    ancestorSelected = self.inside(isSelected)
+    decorated = isSelected | ancestorSelected | self.mask(self.entries([highlighted, monoselected]))
+    for i in np.flatnonzero(decorated & shown):
+      self.load(i)
+      rends[i].render(ancestorSelected=ancestorSelected[i])
+
+  def stats(self):
+    '''[[label, count], ...] of the last frame for the stats panel'''
+    return [[name, int(count)] for name, count in self.counts.items()]
+
+  def pick(self, origin, direction):
+    '''
+First hit (rend, distance, triangle) of the ray from origin along unit
+vector direction, in world coordinates, or None. Renderables are hit
+where the ray enters their boxes, skipping boxes it starts in, and
+triangle is None. With exactPicking Models are hit where the ray meets
+one of their mesh's triangles instead, see Mesh.ray_hit. Hidden
+renderables are not skipped.
+    '''
+    # world-space boxes rule out most entries without transforming the ray
+    candidates = self.pickable[self.bvh.ray(origin, direction)]
+    if not len(candidates):
+      return None
+    inverses = self.worldInv[candidates]
+    origins = (np.append(origin, 1.0) @ inverses)[:, 0:3].T # (3,n)
+    directions = (np.append(direction, 0.0) @ inverses)[:, 0:3].T
+    lo, hi = self.localBounds[candidates].transpose(1, 2, 0)
+    near, far = ray_box_intersections(origins, directions, lo, hi)
+    hit = far >= np.maximum(near, 0)
+    inside = ((lo < origins) & (origins < hi)).all(axis=0)
+    # directions keep world lengths, so near is the distance in world coordinates
+    dist = np.where(hit & ~inside, near, np.inf)
+    if exactPicking:
+      isModel = np.fromiter((isinstance(self.rends[i], Model) for i in candidates), bool, len(candidates))
+      nearest = np.where(hit & isModel, np.maximum(near, 0), np.inf) # no triangle is nearer than its box
+      dist[isModel] = np.inf
+    best = dist.argmin()
+    hitAt, triangle = dist[best], None
+    if exactPicking:
+      for k in np.argsort(nearest):
+        if nearest[k] >= hitAt: # this box and the rest start behind the hit so far
+          break
+        result = self.rends[candidates[k]].mesh.ray_hit(origins[:, k], directions[:, k])
+        if result is not None and result[0] < hitAt:
+          best, (hitAt, triangle) = k, result
+    return (self.rends[candidates[best]], hitAt, triangle) if np.isfinite(hitAt) else None
+
+  def entriesInFrustum(self, planes):
+    '''Pickable entries whose boxes may be in the frustum of planes, given in world coordinates'''
+    candidates = self.pickable[self.bvh.frustum(planes)] # by their world-space boxes
+    # then by their own boxes, with the planes in each entry's coordinates
+    planes = self.world[candidates] @ planes # (n,4,m)
+    lo, hi = self.localBounds[candidates, 0], self.localBounds[candidates, 1]
+    corners = np.where(planes[:, 0:3].transpose(0, 2, 1) > 0, hi[:, None], lo[:, None]) # (n,m,3)
+    inside = (np.einsum("npi,nip->np", corners, planes[:, 0:3]) + planes[:, 3] >= 0).all(axis=1)
+    return candidates[inside]
+
+  def rendsInFrustum(self, planes):
+    '''Renderables whose boxes may be in the frustum of planes, given in world coordinates'''
+    return {self.rends[i] for i in self.entriesInFrustum(planes).tolist()}
+
+  def rendsInBox(self, minPoint, maxPoint):
+    '''Renderables whose world-space boxes overlap the box [minPoint, maxPoint]'''
+    return {self.rends[i] for i in self.pickable[self.bvh.box(minPoint, maxPoint)].tolist()}
+
+  def renderSelectedAE(self):
+    for i in self.entries(selected | {monoselected}):
+      self.load(i)
+      self.rends[i].renderSelectedAE()
+
+  def renderOverlay(self):
+    for i in self.entries([highlighted]):
+      self.load(i)
+      self.rends[i].renderOverlay()
+
+ID_WIDTH = 16+1 # floats per instance of the ID pass: modelview, then entry+1
+ID_STRIDE = ID_WIDTH*4 # bytes
+
+class IDBuffer:
+  '''
+Offscreen image of which renderable is drawn at each pixel, for picking
+by reading pixels. Every placed Model and Lamp in the frustum is drawn
+into frameBuffer by the id shader, flat in the color of its entry in the
+render list plus one, so 0 is the background. Lamps are drawn as their
+boxes. The image is only drawn again once the camera, the viewport or
+the scene has changed, so hovering over a still view only reads pixels.
+  '''
+  def __init__(self):
+    self.size = None # of the attachments
+    self.renderbuffers = None # color, depth
+    self.key = None # what the image was drawn from, see update
+    self.renderList = None
+    self.counts = {"ID buffer renders": 0, "ID buffer reads": 0}
+
+  def stats(self):
+    '''[[label, count], ...] since the start for the stats panel'''
+    return [[name, count] for name, count in self.counts.items()]
+
+  def resize(self, w, h):
+    '''Make the attachments of the bound frameBuffer w by h'''
+    if self.renderbuffers is None:
+      self.renderbuffers = glGenRenderbuffers(2)
+    color, depth = self.renderbuffers
+    glBindRenderbuffer(GL_RENDERBUFFER, color)
+    glRenderbufferStorage(GL_RENDERBUFFER, GL_RGBA8, w, h)
+    glBindRenderbuffer(GL_RENDERBUFFER, depth)
+    glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH_COMPONENT24, w, h)
+    glBindRenderbuffer(GL_RENDERBUFFER, 0)
+    glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_RENDERBUFFER, color)
+    glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_RENDERBUFFER, depth)
+    self.size = (w, h)
+
+  def update(self, renderList, camera, aspect, viewport):
+    '''Draw the image of renderList seen by camera in viewport (x, y, w, h), unless it is already of that'''
+    renderList.update()
+    key = (renderList, renderList.version, camera.viewMatrix().tobytes(), camera.getTrueFovy(),
+           aspect, tuple(camera.zRange), tuple(viewport))
+    if key == self.key:
+      return
+    self.key, self.renderList = key, renderList
+    self.counts["ID buffer renders"] += 1
+    w, h = viewport[2:4]
+    previous = glGetIntegerv(GL_FRAMEBUFFER_BINDING)
+    previousViewport = glGetIntegerv(GL_VIEWPORT)
+    glBindFramebuffer(GL_FRAMEBUFFER, frameBuffer)
+    if self.size != (w, h):
+      self.resize(w, h)
+    glViewport(0, 0, w, h)
+    glDisable(GL_DITHER) # IDs are exact colors
+    glClearColor(0.0, 0.0, 0.0, 0.0)
+    glClear(GL_COLOR_BUFFER_BIT|GL_DEPTH_BUFFER_BIT)
+    glMatrixMode(GL_PROJECTION)
+    glPushMatrix()
+    gluCamera(camera, aspect)
+    renderList.begin(MODELVIEW.top(), frustumPlanes(camera, aspect))
+    drawn = renderList.placedMask() & renderList.inFrustum
+    self.draw(renderList, drawn)
+    glMatrixMode(GL_PROJECTION)
+    glPopMatrix()
+    glMatrixMode(GL_MODELVIEW)
+    glEnable(GL_DITHER)
+    glBindFramebuffer(GL_FRAMEBUFFER, previous)
+    glViewport(*previousViewport)
+
+  def setInstanceAttribs(self, enable):
+    for name, size in [("instanceModelview", 4), ("instanceID", 1)]:
+      loc = ID_SHADER.attribLocs[name]
+      for column in range(loc, loc+size):
+        if enable:
+          glEnableVertexAttribArray(column)
+          glVertexAttribDivisor(column, 1)
+        else:
+          glVertexAttribDivisor(column, 0)
+          glDisableVertexAttribArray(column)
+
+  def draw(self, renderList, drawn):
+    '''Draw the entries of renderList in boolean array (drawn), each in its ID'''
+    ID_SHADER.use()
+    modelviews = renderList.modelviews
+    runs = [] # (mesh, cull, frontFace, entries)
+    for (mesh, tex), batch in renderList.batches.items():
+      batch = batch[drawn[batch]]
+      mirrored = np.linalg.det(modelviews[batch, 0:3, 0:3]) < 0.0
+      for frontFace, entries in [(GL_CCW, batch[~mirrored]), (GL_CW, batch[mirrored])]:
+        if len(entries):
+          runs.append((mesh, mesh.cullbackface, frontFace, entries))
+    glEnableClientState(GL_VERTEX_ARRAY)
+    if runs and DRAWS.instancing:
+      entries = np.concatenate([run[3] for run in runs])
+      instances = np.empty((len(entries), ID_WIDTH), np.float32)
+      instances[:, 0:16] = modelviews[entries].reshape(-1, 16)
+      instances[:, 16] = entries + 1
+      buffer = GPU.streamBuffer("ids", GL_ARRAY_BUFFER, instances)
+      self.setInstanceAttribs(True)
+      glUniform1i(ID_SHADER.uniformLocs["instanced"], 1)
+    first = 0
+    for mesh, cull, frontFace, entries in runs:
+      mesh.bind()
+      (glEnable if cull else glDisable)(GL_CULL_FACE)
+      glFrontFace(frontFace)
+      if DRAWS.instancing:
+        glBindBuffer(GL_ARRAY_BUFFER, buffer)
+        for column in range(4):
+          glVertexAttribPointer(ID_SHADER.attribLocs["instanceModelview"]+column, 4, GL_FLOAT, False, ID_STRIDE,
+                                ctypes.c_void_p((first*ID_WIDTH + column*4)*4))
+        glVertexAttribPointer(ID_SHADER.attribLocs["instanceID"], 1, GL_FLOAT, False, ID_STRIDE,
+                              ctypes.c_void_p((first*ID_WIDTH + 16)*4))
+        mesh.draw(instances=len(entries))
+      else:
+        for i in entries:
+          glLoadMatrixd(modelviews[i])
+          glUniform1f(ID_SHADER.uniformLocs["drawID"], i+1)
+          mesh.draw()
+      first += len(entries)
+    if runs and DRAWS.instancing:
+      self.setInstanceAttribs(False)
+      glUniform1i(ID_SHADER.uniformLocs["instanced"], 0)
+    glDisableClientState(GL_VERTEX_ARRAY)
+    glDisable(GL_CULL_FACE)
+    glFrontFace(GL_CCW)
+    box = GPU.geometry("solid box")
+    for i in np.intersect1d(renderList.pickable[drawn[renderList.pickable]], renderList.others):
+      lo, hi = renderList.localBounds[i]
+      glLoadMatrixd(scaleMat(hi-lo) @ translateMat(lo) @ modelviews[i])
+      glUniform1f(ID_SHADER.uniformLocs["drawID"], i+1)
+      box.draw(GL_TRIANGLES)
+
+  def read(self, x, y, w=1, h=1):
+    '''Render list entries drawn at the pixels of rectangle (x, y, w, h) of the image, (h,w) with -1 for none'''
+    self.counts["ID buffer reads"] += 1
+    previous = glGetIntegerv(GL_FRAMEBUFFER_BINDING)
+    glBindFramebuffer(GL_FRAMEBUFFER, frameBuffer)
+    pixels = np.frombuffer(glReadPixels(x, y, w, h, GL_RGBA, GL_UNSIGNED_BYTE), np.uint8).reshape(h, w, 4)
+    glBindFramebuffer(GL_FRAMEBUFFER, previous)
+    return (pixels[:, :, 0] | pixels[:, :, 1].astype(int) << 8 | pixels[:, :, 2].astype(int) << 16) - 1
+
+ID_BUFFER = IDBuffer()
+
 class Scene:
   '''Defines a list of renderable objects'''
   
@@ -861,6 +1635,7 @@ class Scene:
     self.rends = rends
     self.ambientColor = ambientColor
     self.ambientPower = ambientPower
+    self.renderList = RenderList(self)
 
   # convenience functions for set operation
 
@@ -869,15 +1644,23 @@ class Scene:
 
   def add(self, rend):
     self.rends.add(rend)
+    self.renderList.dirty = True
+    changed()
 
   def remove(self, rend):
     self.rends.remove(rend)
+    self.renderList.dirty = True
+    changed()
 
   def discard(self, rend):
     self.rends.discard(rend)
+    self.renderList.dirty = True
+    changed()
 
   def clear(self):
     self.rends.clear()
+    self.renderList.dirty = True
+    changed()
 
   def render(self, camera, aspect=1.33):
     '''Renders this entire scene'''
@@ -893,6 +1676,7 @@ class Scene:
     # Push camera position/perspective matrix onto stack
     gluCamera(camera, aspect) # custom convenience function
     glMatrixMode(GL_MODELVIEW)
+    TEX_BUDGET.begin_frame(camTrueFovy)
 
     glPushMatrix()
     glTranslatef(*camera.pos)
@@ -908,60 +1692,112 @@ class Scene:
     global linkDepth
     linkDepth = 0
     
+    renderList = self.renderList
+    renderList.update()
+    renderList.begin(MODELVIEW.top(), frustumPlanes(camera, aspect))
+    MODELVIEW.push()
+
     Lamp.begin()
-    for rend in self.rends:
-      glPushMatrix()
-      rend.renderLight()
-      glPopMatrix()
+    renderList.renderLights()
     Lamp.end()
+    LIGHT_CLUSTERS.update(PHONG_SHADER, Lamp.lPositions[:Lamp.i], Lamp.lColorPowers[:Lamp.i],
+                          camTrueFovy, aspect, camera.zRange, lightAssignment,
+                          material_max(tex for _, tex in renderList.batches))
 
-    for rend in self.rends & selected:
-      glPushMatrix()
-      rend.render()
-      glPopMatrix()
-
-    for rend in self.rends - selected:
-      glPushMatrix()
-      rend.render()
-      glPopMatrix()
-
-    for rend in self.rends:
-      glPushMatrix()
-      rend.renderSelectedAE()
-      glPopMatrix()
+    renderList.render()
+    renderList.renderSelectedAE()
     
     ## RENDER OVERLAY
     glClear(GL_DEPTH_BUFFER_BIT)
-    for rend in self.rends:
-      glPushMatrix()
-      rend.renderOverlay()
-      glPopMatrix()
+    renderList.renderOverlay()
+    MODELVIEW.pop()
 
-  def getRendFromXY(self, XY, camera, aspect=1.33):
+    # resize textures for the next frame
+    if TEX_BUDGET.end_frame():
+      changed() # show them
+
+  def getHitFromXY(self, XY, camera, aspect=1.33, viewport=None):
+    '''
+Casts a ray from the camera through window coordinates XY in (viewport),
+GL's current viewport by default, and returns the first hit
+(rend, distance, triangle) as from RenderList.pick, or None.
     '''
-Uses ray-box collision to get closes renderable whose
-bbox collides with the ray made by the user's cursor.
+    if viewport is None:
+      viewport = glGetIntegerv(GL_VIEWPORT)
+    x, y, w, h = viewport
+    t = tan(radians(camera.getTrueFovy())/2)
+    X, Y = 2*(XY[0]-x)/w - 1, 2*(XY[1]-y)/h - 1 # normalised device coordinates
+    viewInv = np.linalg.inv(camera.viewMatrix())
+    origin = viewInv[3, 0:3]
+    direction = normalize(np.array([X*t*aspect, Y*t, -1.0]) @ viewInv[0:3, 0:3])
+    self.renderList.update()
+    return self.renderList.pick(origin, direction)
+
+  def getRendFromXY(self, XY, camera, aspect=1.33, viewport=None):
+    '''
+Gets the closest renderable under the user's cursor at window
+coordinates XY: what is drawn there with gpuPicking, which needs the
+GL context current, otherwise the first hit of getHitFromXY.
 If there aren't any, returns None.
     '''
-    gluCamera(camera, aspect)
-    glMatrixMode(GL_MODELVIEW)
-    glLoadIdentity()
-    rayV = gluUnProject(*XY,1.0)
-    rayV = normalize(rayV)
-    
-    gluCamera(camera, aspect)
-    glMatrixMode(GL_MODELVIEW)
-    result = None
-    minDist = float("Inf")
-    for rend in self.rends:
-      glPushMatrix()
-      for rend, dist in rend.rayBBIntersections(rayV):
-        if dist < minDist:
-          result = rend
-          minDist = dist
-      glPopMatrix()
+    if gpuPicking:
+      rends = self.getRendsInRect((XY[0], XY[1], 1, 1), camera, aspect, viewport)
+      return next(iter(rends), None)
+    hit = self.getHitFromXY(XY, camera, aspect, viewport)
+    return None if hit is None else hit[0]
 
-    return result
+  def getRendsInRect(self, rect, camera, aspect=1.33, viewport=None):
+    '''
+Renderables drawn in rectangle (x, y, w, h) of window coordinates in
+(viewport), GL's current viewport by default, read from ID_BUFFER.
+    '''
+    if viewport is None:
+      viewport = glGetIntegerv(GL_VIEWPORT)
+    ID_BUFFER.update(self.renderList, camera, aspect, viewport)
+    # into the image, inside it
+    x0, y0 = max(0, floor(rect[0]-viewport[0])), max(0, floor(rect[1]-viewport[1]))
+    x1, y1 = min(viewport[2], floor(rect[0]-viewport[0]+rect[2])), min(viewport[3], floor(rect[1]-viewport[1]+rect[3]))
+    if x1 <= x0 or y1 <= y0:
+      return set()
+    entries = np.unique(ID_BUFFER.read(x0, y0, x1-x0, y1-y0))
+    return {self.renderList.rends[i] for i in entries[entries >= 0]}
+
+  def getRendsInBox(self, minPoint, maxPoint):
+    '''Renderables whose boxes overlap the box [minPoint, maxPoint] in world coordinates'''
+    self.renderList.update()
+    return self.renderList.rendsInBox(minPoint, maxPoint)
+
+  def getRendsInFrustum(self, planes):
+    '''
+Renderables whose boxes may be in the frustum of planes, a 4xm matrix of
+planes in world coordinates as from frustumPlanes and (view @ planes).
+    '''
+    self.renderList.update()
+    return self.renderList.rendsInFrustum(planes)
+
+  def getRendsFromRect(self, rect, camera, aspect=1.33, viewport=None):
+    '''
+Models and Lamps shown in rectangle (x, y, w, h) of window coordinates
+in (viewport), GL's current viewport by default, nearest first. Found
+by their boxes, with the part of the camera's frustum through rect.
+A rectangle thinner than a pixel has nothing in it.
+    '''
+    if rect[2] < 1 or rect[3] < 1: # its frustum would be flat
+      return []
+    if viewport is None:
+      viewport = glGetIntegerv(GL_VIEWPORT)
+    x, y, w, h = viewport
+    x0, x1 = 2*(rect[0]-x)/w - 1, 2*(rect[0]+rect[2]-x)/w - 1 # normalised device coordinates
+    y0, y1 = 2*(rect[1]-y)/h - 1, 2*(rect[1]+rect[3]-y)/h - 1
+    view = camera.viewMatrix()
+    renderList = self.renderList
+    renderList.update()
+    entries = renderList.entriesInFrustum(view @ frustumPlanes(camera, aspect, (x0, y0, x1, y1)))
+    entries = entries[renderList.placedMask()[entries]]
+    centers = np.append(renderList.ownBounds[entries].mean(axis=1), np.ones((len(entries), 1)), axis=1)
+    entries = entries[np.argsort(-(centers @ view)[:, 2], kind="stable")] # by depth
+    _, first = np.unique(renderList.rendIDs[entries], return_index=True) # the nearest entry of each renderable
+    return [renderList.rends[i] for i in entries[np.sort(first)].tolist()]
 
   def rendExists(self, rend):
     '''Tests whether rend is in my tree of renderables.'''
@@ -999,10 +1835,13 @@ once an OpenGL context is established.
   if initialised:
     return
 
-  global PHONG_SHADER, FLAT_SHADER, PLAIN_SHADER
+  global PHONG_SHADER, FLAT_SHADER, PLAIN_SHADER, DEPTH_SHADER, ID_SHADER
   PHONG_SHADER = Shader(*SHADER_FILENAME_PAIRS["phong"])
   FLAT_SHADER = Shader(*SHADER_FILENAME_PAIRS["flat"])
   PLAIN_SHADER = Shader(*SHADER_FILENAME_PAIRS["plain"])
+  DEPTH_SHADER = Shader(*SHADER_FILENAME_PAIRS["depth"])
+  ID_SHADER = Shader(*SHADER_FILENAME_PAIRS["id"])
+  DRAWS.instancing = bool(glDrawElementsInstanced) and bool(glVertexAttribDivisor) # GL 3.3
   
   # Enable wanted gl modes
   glEnable(GL_DEPTH_TEST)
@@ -1017,7 +1856,7 @@ once an OpenGL context is established.
   glFogf(GL_FOG_DENSITY, 0.1)
 
   global frameBuffer
-  frameBuffer = glGenFramebuffers(1)
+  frameBuffer = glGenFramebuffers(1) # of ID_BUFFER
   
   
   initialised = True
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+'''
+framescheduler.py
+repaints the 3D view only when what it shows has changed
+
+Anything that changes what is drawn invalidates the view: the engine
+publishes changes to the scene, camera, highlight and textures through
+engine.changed, and the editor invalidates it after editing selections
+and assets. Invalidations are coalesced into at most one repaint per
+refresh of the screen, and nothing is repainted while nothing changes.
+'''
+
+from all_modules import *
+
+class FrameScheduler(QObject):
+  '''Repaints (widget) once after any number of invalidations, at most once per screen refresh'''
+  def __init__(self, widget):
+    super().__init__(widget)
+    self.widget = widget
+    self.timer = QTimer(self)
+    self.timer.setSingleShot(True)
+    self.timer.timeout.connect(self.frame)
+    self.lastFrame = 0.0 # time.monotonic() of the last repaint
+    self.invalidations = 0
+    self.frames = 0 # repaints asked for, fewer than invalidations when they are coalesced
+
+  def period(self):
+    '''Seconds between refreshes of the widget's screen'''
+    window = self.widget.windowHandle()
+    screen = window.screen() if window is not None else QGuiApplication.primaryScreen()
+    rate = screen.refreshRate() if screen is not None else 0
+    return 1/rate if rate > 0 else 1/60
+
+  def invalidate(self):
+    '''Repaint once the current screen refresh is over, unless a repaint is already due'''
+    self.invalidations += 1
+    if not self.timer.isActive():
+      wait = self.lastFrame + self.period() - time.monotonic()
+      self.timer.start(max(0, ceil(wait*1000)))
+
+  def frame(self):
+    self.lastFrame = time.monotonic()
+    self.frames += 1
+    self.widget.update()
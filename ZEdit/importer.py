@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+'''
+importer.py
+background import pipeline for meshes and textures
+
+Importing an asset file runs in three stages:
+  1. CPU work in worker pools - processes parse .obj files,
+     threads decode and resize images (PIL releases the GIL)
+  2. the prepared arrays are handed back to the main thread
+  3. the main thread, which owns the GL context, creates the
+     Mesh or Tex; all that is left for it is the GPU upload
+'''
+
+from all_modules import *
+from asset import Mesh, Tex, prepare_mesh, prepare_texture
+
+MESH_EXTS = [".obj"]
+TEX_EXTS = [".bmp", ".png", ".jpg", ".jpeg"]
+PUMP_INTERVAL = 1/60 # seconds importAll waits for an asset between processing events
+
+class Importer(QObject):
+  '''Imports asset files in worker pools, finishing each asset on the main thread'''
+  prepared = pyqtSignal(object) # (filename, future, finish), emitted from pool threads
+  imported = pyqtSignal(object, str) # asset, filename
+  failed = pyqtSignal(str, str) # filename, error message
+
+  def __init__(self, parent=None):
+    super().__init__(parent)
+    self.meshPool = None # started on first use, spawning processes is slow
+    self.texPool = None
+    self.submitted = 0
+    self.finished = 0
+    self.prepared.connect(self._finish) # queued, so it runs on the main thread
+
+  def getMeshPool(self):
+    if self.meshPool is None:
+      self.meshPool = concurrent.futures.ProcessPoolExecutor()
+    return self.meshPool
+
+  def getTexPool(self):
+    if self.texPool is None:
+      self.texPool = concurrent.futures.ThreadPoolExecutor()
+    return self.texPool
+
+  def canImport(self, filename):
+    return os.path.splitext(filename)[1].lower() in MESH_EXTS+TEX_EXTS
+
+  def submit(self, filename, **kwargs):
+    '''
+Start the CPU stage of importing asset file (filename).
+Returns (future, finish): finish(future.result()) creates the asset,
+passing kwargs on to Mesh or Tex, and must be called on the main thread.
+    '''
+    ext = os.path.splitext(filename)[1].lower()
+    if ext in MESH_EXTS:
+      future = self.getMeshPool().submit(prepare_mesh, filename)
+      finish = lambda prepared: Mesh(filename, prepared=prepared, **kwargs)
+    elif ext in TEX_EXTS:
+      future = self.getTexPool().submit(prepare_texture, filename)
+      finish = lambda prepared: Tex(filename, prepared=prepared, **kwargs)
+    else:
+      raise ValueError("Not an asset file: %s"%filename)
+    return future, finish
+
+  def importFiles(self, filenames):
+    '''Import asset files in the background; imported or failed is emitted for each'''
+    if self.finished == self.submitted: # previous batch is done
+      self.submitted = self.finished = 0
+    for fn in filenames:
+      future, finish = self.submit(fn)
+      self.submitted += 1
+      future.add_done_callback(lambda future, fn=fn, finish=finish: self.prepared.emit((fn, future, finish)))
+
+  def importAll(self, jobs, progress=None):
+    '''
+Import [(filename, kwargs), ...] in parallel and wait for all of them.
+Returns the assets in order of jobs. Calls progress(done, total) after each asset.
+Assets are finished as they arrive, and the window keeps repainting while
+the rest are prepared. User input waits until they are all in.
+Raises IOError if any asset fails, after cancelling the jobs not started
+and deleting every asset finished.
+    '''
+    started = [self.submit(fn, **kwargs) for fn, kwargs in jobs]
+    index = {future: i for i, (future, _) in enumerate(started)}
+    assets = [None]*len(jobs)
+    error = None
+    pending = set(index)
+    finished = 0
+    while pending:
+      done, pending = concurrent.futures.wait(pending, PUMP_INTERVAL, concurrent.futures.FIRST_COMPLETED)
+      for future in done:
+        i = index[future]
+        if future.cancelled():
+          continue
+        try:
+          assets[i] = started[i][1](future.result())
+        except Exception as e:
+          if error is None:
+            error = IOError("Unable to import %s. More info:\n%s"%(jobs[i][0], e))
+            for other in pending:
+              other.cancel()
+          continue
+        finished += 1
+        if progress is not None and error is None:
+          progress(finished, len(jobs))
+      QCoreApplication.processEvents(QEventLoop.ExcludeUserInputEvents)
+    if error is not None:
+      # running jobs were finished too, so their shared files and GL resources are released here
+      for asset in assets:
+        if asset is not None:
+          asset.delete()
+      raise error
+    return assets
+
+  def progress(self):
+    '''(assets finished, assets submitted) of the current background batch'''
+    return self.finished, self.submitted
+
+  def _finish(self, job):
+    fn, future, finish = job
+    self.finished += 1
+    try:
+      asset = finish(future.result())
+    except Exception as e:
+      self.failed.emit(fn, str(e))
+    else:
+      self.imported.emit(asset, fn)
+
+  def shutdown(self):
+    for pool in [self.meshPool, self.texPool]:
+      if pool is not None:
+        pool.shutdown(wait=False)
+    self.meshPool = self.texPool = None
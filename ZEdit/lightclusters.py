@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+'''
+lightclusters.py
+lists the lamps that can light each part of the scene for the phong shader
+
+A lamp reaches as far as its inverse-square light stays above
+LIGHT_CUTOFF on the most reflective texture drawn. Lamps are assigned to fragments in one of two ways:
+  MODEL_LIGHTS: each drawn model lists the lamps whose sphere of
+                influence overlaps its bounding box
+  CLUSTERED_LIGHTS: lamps are binned into clusters of the view frustum
+With ALL_LIGHTS every fragment is shaded with every lamp.
+
+The frustum is cut into CLUSTER_GRID tiles across the screen and
+depth slices spaced exponentially from the near to the far plane.
+A lamp is listed in every cluster that its sphere of influence may
+touch. The shader finds its fragment's cluster and only shades with
+the lamps listed there, instead of with all of them.
+
+GLSL 1.30 has neither uniform nor storage buffers, so the lists are
+kept in float textures:
+  cluster texture: (offset, count) into the index texture per cluster,
+                   one row per depth slice
+  index texture: the lamp indices of every cluster or model, back to back
+Models get their (offset, count) with their per-instance matrices.
+'''
+
+from all_modules import *
+
+ALL_LIGHTS, MODEL_LIGHTS, CLUSTERED_LIGHTS = 0, 1, 2 # ways of assigning lamps to fragments
+CLUSTER_GRID = (16, 9, 24) # tiles across, tiles down, depth slices
+LIGHT_CUTOFF = 1e-4 # light intensity a lamp is left out below
+FRESNEL_PEAK = 2.0**5 # most the phong shader's pow(1-a, 5.0) gets, lit from straight behind at a = -1
+MATERIAL_MAX = 1.0 + 1.0 + FRESNEL_PEAK # most a texture reflects, with diffuse, specular and fresnel at most 1
+INDEX_WIDTH = 4096 # texels per row of the index texture
+CLUSTER_UNIT, INDEX_UNIT = 1, 2 # texture units, the models' texture is on unit 0
+
+def material_max(textures):
+  '''
+Most light any of textures reflects, for a lamp of unit power at unit
+distance: the phong shader's diffuse, specular and fresnel terms peak at
+diffuse, specular and FRESNEL_PEAK*fresnel.
+  '''
+  return max((tex.diffuse + tex.specular + FRESNEL_PEAK*tex.fresnel for tex in textures), default=0.0)
+
+def influence_radii(colorPowers, materialMax=MATERIAL_MAX):
+  '''Distance at which each lamp's light, reflected by at most materialMax, falls below LIGHT_CUTOFF'''
+  return np.sqrt(materialMax * (np.asarray(colorPowers)**2).max(axis=1, initial=0) / LIGHT_CUTOFF)
+
+def slice_edges(near, far, slices):
+  '''Depths of the edges of the depth slices, spaced exponentially'''
+  return near * (far/near)**(np.arange(slices+1)/slices)
+
+def box_overlaps(centers, radii, bounds):
+  '''Boolean array (boxes, spheres) of which boxes (n,2,3) overlap the spheres (centers, radii)'''
+  distSquared = np.zeros((len(bounds), len(centers)))
+  for axis in range(3): # distance from each center to the nearest point of each box
+    c = centers[None, :, axis]
+    distSquared += np.maximum(np.maximum(bounds[:, None, 0, axis] - c, c - bounds[:, None, 1, axis]), 0)**2
+  return distSquared <= np.asarray(radii)[None]**2
+
+def tile_overlaps(lo, hi, tiles):
+  '''Boolean array (n, tiles) of which tiles across [-1, 1] overlap the ranges [lo, hi]'''
+  edges = np.linspace(-1, 1, tiles+1)
+  return (edges[None, 1:] >= lo[:, None]) & (edges[None, :-1] <= hi[:, None])
+
+def bin_lights(positions, radii, tanHalfFovy, aspect, near, far, grid=CLUSTER_GRID):
+  '''
+Boolean array (lights, slices, tiles down, tiles across) of the clusters
+each lamp's sphere of influence may touch. Positions are in view
+coordinates. The test is conservative, using the sphere's box.
+  '''
+  tilesX, tilesY, slices = grid
+  radii = np.asarray(radii)[:, None]
+  x, y, depth = positions[:, 0:1], positions[:, 1:2], -positions[:, 2:3]
+  edges = slice_edges(near, far, slices)
+  inZ = (edges[None, 1:] >= depth-radii) & (edges[None, :-1] <= depth+radii)
+  # extremes of the box on screen, at the nearest and furthest depth in front of the camera
+  dlo, dhi = np.maximum(depth-radii, near), np.maximum(depth+radii, near)
+  def screenRange(lo, hi, scale):
+    return (np.where(lo < 0, lo/dlo, lo/dhi).ravel()/scale,
+            np.where(hi > 0, hi/dlo, hi/dhi).ravel()/scale)
+  inX = tile_overlaps(*screenRange(x-radii, x+radii, tanHalfFovy*aspect), tilesX)
+  inY = tile_overlaps(*screenRange(y-radii, y+radii, tanHalfFovy), tilesY)
+  return inZ[:, :, None, None] & inY[:, None, :, None] & inX[:, None, None, :]
+
+class LightClusters:
+  '''Lamp lists of the phong shader, updated by Scene.render once per frame'''
+  def __init__(self, grid=CLUSTER_GRID):
+    self.grid = grid
+    self.clusterTex = self.indexTex = None
+    self.mode = ALL_LIGHTS
+    self.positions = np.empty((0, 3))
+    self.radii = np.empty(0)
+    self.lists = 0 # clusters or models with a lamp list
+    self.listed = 0 # lamp indices over all lists
+
+  def stats(self):
+    '''[[label, count], ...] of the last frame for the stats panel'''
+    perList = self.listed/self.lists if self.lists else len(self.positions)
+    return [["Lamps", len(self.positions)],
+            ["Lamps per %s"%["fragment", "model", "cluster"][self.mode], "%.1f"%perList]]
+
+  def upload(self, texID, unit, internalFormat, format, width, height, data):
+    glActiveTexture(GL_TEXTURE0+unit)
+    glBindTexture(GL_TEXTURE_2D, texID)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST) # no mipmaps, or it is incomplete
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+    glTexImage2D(GL_TEXTURE_2D, 0, internalFormat, width, height, 0, format, GL_FLOAT, data)
+    glActiveTexture(GL_TEXTURE0)
+
+  def uploadLists(self, inList):
+    '''
+Upload the lamp lists of boolean array inList (lists, lamps) to the index
+texture. Returns (offset, count) of each list as a float32 array (lists, 2).
+    '''
+    if self.indexTex is None:
+      self.clusterTex, self.indexTex = glGenTextures(2)
+    counts = inList.sum(axis=1)
+    _, lamps = np.nonzero(inList) # grouped by list
+    self.lists, self.listed = len(inList), len(lamps)
+    rows = max(1, -(-len(lamps)//INDEX_WIDTH))
+    indices = np.zeros(rows*INDEX_WIDTH, np.float32)
+    indices[:len(lamps)] = lamps
+    self.upload(self.indexTex, INDEX_UNIT, GL_R32F, GL_RED, INDEX_WIDTH, rows, indices)
+    return np.stack([np.cumsum(counts)-counts, counts], axis=1).astype(np.float32)
+
+  def update(self, shader, positions, colorPowers, trueFovy, aspect, zRange, mode=CLUSTERED_LIGHTS,
+             materialMax=MATERIAL_MAX):
+    '''
+Take the lamps of a frame at view coordinates (positions) with colorPowers,
+for a camera with trueFovy, aspect and zRange, and set shader up for mode.
+The frame's textures reflect at most materialMax, see material_max.
+With CLUSTERED_LIGHTS the lamps are binned here, with MODEL_LIGHTS
+RenderList.render lists them per model through assign.
+    '''
+    self.mode = mode
+    self.positions = positions
+    self.radii = influence_radii(colorPowers, materialMax)
+    self.lists = self.listed = 0
+    shader.use()
+    glUniform1i(shader.uniformLocs["clustered"], mode == CLUSTERED_LIGHTS)
+    glUniform1i(shader.uniformLocs["modelLights"], mode == MODEL_LIGHTS)
+    glUniform1i(shader.uniformLocs["lightIndexTex"], INDEX_UNIT)
+    if mode != CLUSTERED_LIGHTS:
+      return
+    tilesX, tilesY, slices = self.grid
+    near, far = zRange
+    inCluster = bin_lights(positions, self.radii, tan(radians(trueFovy)/2), aspect, near, far, self.grid)
+    clusters = self.uploadLists(inCluster.reshape(len(positions), tilesX*tilesY*slices).T) # (clusters, lamps)
+    self.upload(self.clusterTex, CLUSTER_UNIT, GL_RG32F, GL_RG, tilesX*tilesY, slices, clusters)
+
+    glUniform1i(shader.uniformLocs["clusterTex"], CLUSTER_UNIT)
+    glUniform3f(shader.uniformLocs["clusterGrid"], tilesX, tilesY, slices)
+    glUniform4f(shader.uniformLocs["viewport"], *glGetIntegerv(GL_VIEWPORT))
+    glUniform2f(shader.uniformLocs["zRange"], near, far)
+
+  def assign(self, bounds):
+    '''
+List the lamps of the frame that may light each box of bounds (n,2,3) in
+view coordinates. Returns (offset, count) of each box's list, (n,2).
+    '''
+    return self.uploadLists(box_overlaps(self.positions, self.radii, bounds))
+
+LIGHT_CLUSTERS = LightClusters()
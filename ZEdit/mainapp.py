@@ -12,11 +12,15 @@ from dropshadow import DropShadowFrame, _DropShadowWidget
 
 from rotpoint import Rot, Point
 from asset import id_gen, Asset, Mesh, Tex, Bulb
-from engine import Camera, Renderable, Model, Lamp, Directory, Link, initEngine, TreeError
+from engine import Camera, Renderable, Model, Lamp, Directory, Link, initEngine, TreeError, GPU, DRAWS, ID_BUFFER, gluMarquee
 import engine
 from userenv import UserEnv
 from remote import Remote
 from saver import Saver
+from importer import Importer, TEX_EXTS
+from texbudget import TEX_BUDGET
+from lightclusters import LIGHT_CLUSTERS
+from framescheduler import FrameScheduler
 
 PRECISION = 4
 EPSILON = 10**-PRECISION
@@ -36,6 +40,14 @@ def basePosRot(truePos, trueRot, sel):
 def shortfn(fn):
   return os.path.split(fn)[1]
 
+def sizefmt(nbytes):
+  '''Formats a number of bytes with binary units, e.g. "4.0 MiB"'''
+  for unit in ["B", "KiB", "MiB"]:
+    if nbytes < 1024:
+      return "%.1f %s"%(nbytes, unit)
+    nbytes /= 1024
+  return "%.1f GiB"%nbytes
+
 def cyclamp(x, R): # Like modulo, but based on custom range
   a, b = R
   return (x-a)%(b-a) + a
@@ -141,6 +153,7 @@ class InteractiveGLWidget(QGLWidget):
   drawScene = pyqtSignal(float) # signal emmited when wanting to redraw scene
   mouseOver = pyqtSignal(tuple)
   clicked = pyqtSignal(QMouseEvent)
+  marqueeSelect = pyqtSignal(tuple) # (x0, y0, x1, y1) dragged out so far
   requestSelect = pyqtSignal(object)
   requestUpdate = pyqtSignal()
   requestRectifyCamera = pyqtSignal()
@@ -158,13 +171,14 @@ class InteractiveGLWidget(QGLWidget):
     self.aspect = 1.0
     self.refresh_rate = 30
     self.refresh_period = ceil(1000/self.refresh_rate)
-    self.timer = QTimer()
+    self.timer = QTimer() # only runs while keys are held
     self.timer.setInterval(self.refresh_period)
     self.timer.timeout.connect(self.onTick)
     self.heldKeys = set()
     self.lastt = time.time()
     self.dt = 0
-    self.timer.start()
+    self.frames = FrameScheduler(self)
+    engine.changeListeners.append(self.frames.invalidate)
     self.setFocusPolicy(Qt.StrongFocus)
     self.setMouseTracking(True)
 
@@ -173,6 +187,7 @@ class InteractiveGLWidget(QGLWidget):
     self.mousePos = None
     self.trueMousePos = None
     self.dragging = False
+    self.marquee = None # (x0, y0, x1, y1) while Ctrl dragging out a selection rectangle
     self.cam_rot = None
 
     self.dropShadow = QGraphicsDropShadowEffect(self)
@@ -191,11 +206,18 @@ class InteractiveGLWidget(QGLWidget):
   def getCamera(self): # redefined elsewhere
     return Camera()
 
+  def invalidate(self):
+    '''Repaint on the next screen refresh'''
+    self.frames.invalidate()
+
   def initializeGL(self):
     initEngine()
 
   def paintGL(self):
     self.drawScene.emit(self.aspect)
+    if self.marquee is not None:
+      x0, y0, x1, y1 = self.marquee
+      gluMarquee(*self.qt2glXY((x0, y0)), *self.qt2glXY((x1, y1)), (0, 0, *self.dims))
 
   def resizeGL(self, w, h):
     self.dims = w, h
@@ -212,8 +234,10 @@ class InteractiveGLWidget(QGLWidget):
         self.requestLookAt.emit(engine.monoselected)
       else:
         self.requestLookAt.emit(Point(0, 0, 0)) # look at origin
-      self.update()
     self.heldKeys.add(event.key())
+    if (event.key() in ROT_DELTAS or event.key() in POS_DELTAS) and not self.timer.isActive():
+      self.lastt = time.time()
+      self.timer.start()
 
   def keyReleaseEvent(self, event):
     self.heldKeys.discard(event.key())
@@ -228,6 +252,8 @@ class InteractiveGLWidget(QGLWidget):
     if self.handleHeldKeys():
 ##      engine.renderingMode = engine.FLAT
       self.requestUpdate.emit()
+    else:
+      self.timer.stop()
 ##    else:
 ##      if not engine.renderingMode == engine.FULL and not self.dragging:
 ##        engine.renderingMode = engine.FULL
@@ -314,15 +340,21 @@ class InteractiveGLWidget(QGLWidget):
   def mousePressEvent(self, event):
     super().mousePressEvent(event)
     self.mousePos = event.x(), event.y()
+    if keyModFlags() & Qt.ControlModifier:
+      self.marquee = self.mousePos*2
+      return
     self.cam_rot = self.getCamera().rot
     self.dragging = True
-    self.update()
 
   def mouseMoveEvent(self, event):
     self.trueMousePos = X, Y = event.x(), event.y()
     cam = self.getCamera()
     sel = engine.monoselected
-    if self.dragging:
+    if self.marquee is not None:
+      self.marquee = self.mousePos + (X, Y)
+      self.marqueeSelect.emit(self.marquee)
+      self.invalidate()
+    elif self.dragging:
       if keyModFlags() & Qt.ShiftModifier:
         if isinstance(sel, Renderable):
           selpos = sel.getTruePos()
@@ -347,8 +379,8 @@ class InteractiveGLWidget(QGLWidget):
         cam.rot = Rot(dY/100, -dX/100, 0)*self.cam_rot
         
       self.requestRectifyCamera.emit()
-    self.mouseOver.emit((X, Y))
-    self.update()
+    else: # hovering, nothing is picked while a button is down
+      self.mouseOver.emit((X, Y))
 
   def mouseReleaseEvent(self, event):
     super().mouseReleaseEvent(event)
@@ -356,12 +388,17 @@ class InteractiveGLWidget(QGLWidget):
     self.sel_dr = None
     if (event.x(), event.y()) == self.mousePos:
       self.clicked.emit(event)
-    self.update()
+    elif self.marquee is not None:
+      self.marqueeSelect.emit(self.marquee)
+    if self.marquee is not None:
+      self.marquee = None
+      self.invalidate()
+    self.mouseOver.emit((event.x(), event.y())) # hovering again, maybe over something else
 
   def leaveEvent(self, event):
     super().leaveEvent(event)
     self.trueMousePos = None
-    engine.highlighted = None
+    engine.highlight(None)
 
   def focusInEvent(self, event):
     super().focusInEvent(event)
@@ -636,11 +673,29 @@ class ObjTree(QTreeWidget):
       self.topLevelItem(i).update()
 
   def select(self, obj):
+    self.selectMulti([obj])
+
+  def selectMulti(self, objs):
+    '''Select the nodes of objs and nothing else, scrolling to the first'''
+    nodes = [self.objNodeDict[obj] for obj in objs if obj in self.objNodeDict]
+    # one range per run of adjacent rows, selecting node by node takes quadratic time
+    rows = ddict(list) # parent index -> rows
+    for node in nodes:
+      index = self.indexFromItem(node)
+      rows[index.parent()].append(index.row())
+    selection = QItemSelection()
+    model, lastColumn = self.model(), self.columnCount()-1
+    for parent, parentRows in rows.items():
+      parentRows.sort()
+      start = parentRows[0]
+      for row, nextRow in zip(parentRows, parentRows[1:]+[None]):
+        if nextRow != row+1:
+          selection.select(model.index(start, 0, parent), model.index(row, lastColumn, parent))
+          start = nextRow
     self.blockSignals(True)
-    self.selectionModel().clearSelection()
-    if obj in self.objNodeDict:
-      self.objNodeDict[obj].setSelected(True)
-      self.scrollToItem(self.objNodeDict[obj])
+    self.selectionModel().select(selection, QItemSelectionModel.ClearAndSelect)
+    if nodes:
+      self.scrollToItem(nodes[0])
     self.blockSignals(False)
 
   def showObj(self, obj):
@@ -683,8 +738,7 @@ class ObjTree(QTreeWidget):
       self.requestSelect.emit(selItems[0].obj)
 
   def onItemEntered(self, item):
-    engine.highlighted = item.obj
-    self.requestUpdate.emit()
+    engine.highlight(item.obj)
 
   def keyPressEvent(self, event):
     selItems = self.selectedItems()
@@ -732,8 +786,7 @@ class ObjTree(QTreeWidget):
   def mouseMoveEvent(self, event):
     index = self.indexAt(event.pos())
     if index.row() == -1:
-      engine.highlighted = None
-      self.requestUpdate.emit()
+      engine.highlight(None)
     super().mouseMoveEvent(event)
 
   def mouseReleaseEvent(self, event):
@@ -863,6 +916,9 @@ class MainApp(QMainWindow):
     self.setWindowTitle(APPNAME)
     self.show()
     self.newProject(silent=True, base=True)
+    self.importer = Importer(self)
+    self.importer.imported.connect(self.assetImported)
+    self.importer.failed.connect(self.assetFailed)
     self.saver = Saver(self)
     
     self.setAcceptDrops(True)
@@ -969,11 +1025,30 @@ class MainApp(QMainWindow):
     scene.addAction(self.sceneMenu_makelamps)
     scene.addAction(self.sceneMenu_makegroups)
     scene.addAction(self.sceneMenu_quickgroup)
+    scene.addSeparator()
+    self.sceneMenu_exactpicking = QAction(self.icons["Model"], "&Exact Picking", checkable=True)
+    self.sceneMenu_exactpicking.setChecked(engine.exactPicking)
+    scene.addAction(self.sceneMenu_exactpicking)
+    self.sceneMenu_gpupicking = QAction(self.icons["3D Scene"], "&GPU Picking", checkable=True)
+    self.sceneMenu_gpupicking.setChecked(engine.gpuPicking)
+    scene.addAction(self.sceneMenu_gpupicking)
     render = bar.addMenu("&Render")
     self.renderMenu_fullmode = QAction(self.icons["3D Scene"], "&Full Mode")
     self.renderMenu_flatmode = QAction(self.icons["Model"], "Fl&at Mode")
     render.addAction(self.renderMenu_fullmode)
     render.addAction(self.renderMenu_flatmode)
+    render.addSeparator()
+    lighting = QActionGroup(render) # one way of assigning lamps at a time
+    self.renderMenu_lighting = dict()
+    for mode, text in [(engine.ALL_LIGHTS, "&Every Lamp"), (engine.MODEL_LIGHTS, "Lamps per &Model"), (engine.CLUSTERED_LIGHTS, "&Clustered Lamps")]:
+      action = QAction(self.icons["Lamp"], text, lighting, checkable=True)
+      action.setChecked(mode == engine.lightAssignment)
+      render.addAction(action)
+      self.renderMenu_lighting[mode] = action
+    render.addSeparator()
+    self.renderMenu_prepass = QAction(self.icons["3D Scene"], "&Depth Pre-pass", checkable=True)
+    self.renderMenu_prepass.setChecked(engine.depthPrepass)
+    render.addAction(self.renderMenu_prepass)
     view = bar.addMenu("&View")
     self.viewMenu_env = QAction(self.icons["Scene"], "E&nvironment", checkable=True)
     self.viewMenu_edit = QAction(self.icons["Edit"], "&Edit", checkable=True)
@@ -1075,8 +1150,13 @@ class MainApp(QMainWindow):
     self.sceneMenu_makelamps.triggered.connect(self.makeLamps)
     self.sceneMenu_makegroups.triggered.connect(self.makeGroups)
     self.sceneMenu_quickgroup.triggered.connect(self.quickGroup)
+    self.sceneMenu_exactpicking.toggled.connect(self.setExactPicking)
+    self.sceneMenu_gpupicking.toggled.connect(self.setGPUPicking)
     self.renderMenu_fullmode.triggered.connect(self.fullMode)
     self.renderMenu_flatmode.triggered.connect(self.flatMode)
+    for mode, action in self.renderMenu_lighting.items():
+      action.triggered.connect(lambda checked, mode=mode: self.setLightAssignment(mode))
+    self.renderMenu_prepass.toggled.connect(self.setDepthPrepass)
     self.viewMenu_env.triggered.connect(self.curryTogglePane(self.envPane))
     self.viewMenu_edit.triggered.connect(self.curryTogglePane(self.editPane))
     self.viewMenu_log.triggered.connect(self.curryTogglePane(self.logPane))
@@ -1087,8 +1167,12 @@ class MainApp(QMainWindow):
 
     # connect signals from widgets
     self.gl.drawScene.connect(self.remote.renderScene)
+    self.gl.drawScene.connect(lambda aspect: self.frameDrawn())
+    self.edit.currentChanged.connect(lambda i: self.updateStats()) # stats of the last frame when the panel is shown
+    self.editPane.visibilityChanged.connect(lambda visible: self.updateStats())
     self.gl.mouseOver.connect(self.highlightFromXY)
     self.gl.clicked.connect(lambda e: self.selectFromXY((e.x(),e.y())))
+    self.gl.marqueeSelect.connect(self.selectFromRect)
     self.gl.requestSelect.connect(self.select)
     self.gl.requestUpdate.connect(self.update)
     self.gl.requestRectifyCamera.connect(self.remote.rectifyCamera)
@@ -1232,18 +1316,36 @@ class MainApp(QMainWindow):
   def fullMode(self):
     '''Set rendering mode to FULL'''
     engine.renderingMode = engine.FULL
-    self.gl.update()
+    self.gl.invalidate()
 
   def flatMode(self):
     '''Set rendering mode to FLAT'''
     engine.renderingMode = engine.FLAT
-    self.gl.update()
+    self.gl.invalidate()
+
+  def setLightAssignment(self, mode):
+    '''Set which lamps each fragment is shaded with, one of engine.ALL_LIGHTS, MODEL_LIGHTS, CLUSTERED_LIGHTS'''
+    engine.lightAssignment = mode
+    self.gl.invalidate()
+
+  def setExactPicking(self, on):
+    '''Pick models by their triangles, or only by their bounding boxes'''
+    engine.exactPicking = on
+
+  def setGPUPicking(self, on):
+    '''Pick what is drawn under the cursor from the ID buffer, or by casting a ray'''
+    engine.gpuPicking = on
+
+  def setDepthPrepass(self, on):
+    '''Draw the depth of the scene before shading it, so that each pixel is shaded once'''
+    engine.depthPrepass = on
+    self.gl.invalidate()
 
   def toggleMode(self):
     '''Toggle rendering mode between FLAT and FULL'''
     engine.renderingMode += 1
     engine.renderingMode %= engine.NUM_MODES
-    self.gl.update()
+    self.gl.invalidate()
 
   def addEnvObj(self, envobj, directory=None):
     '''Add environment object into appropriate QListWidget'''
@@ -1396,8 +1498,7 @@ class MainApp(QMainWindow):
     fd.setFileMode(QFileDialog.ExistingFiles)
     fd.setNameFilters([r"Wavefront Object files (*.obj)"])
     if fd.exec_():
-      for fn in fd.selectedFiles():
-        self.loadAssetFile(fn)
+      self.importAssetFiles(fd.selectedFiles())
 
   def loadTextures(self):
     '''Prompt to load texture files'''
@@ -1407,8 +1508,7 @@ class MainApp(QMainWindow):
     fd.setFileMode(QFileDialog.ExistingFiles)
     fd.setNameFilters(["Images (*.bmp;*.png;*.jpg;*.jpeg)"])
     if fd.exec_():
-      for fn in fd.selectedFiles():
-        self.loadAssetFile(fn)
+      self.importAssetFiles(fd.selectedFiles())
 
   def makeBulb(self):
     '''Make new Bulb with default settings'''
@@ -1417,23 +1517,24 @@ class MainApp(QMainWindow):
     self.add(B)
     self.logEntry("Success", "Made bulb.")
 
-  def loadAssetFile(self, fn):
-    '''Load asset from file fn'''
-    ext = os.path.splitext(fn)[1]
-    if ext in [".bmp", ".png", ".jpg", ".jpeg"]:
-      try:
-        self.add(Tex(fn))
-      except:
-        self.logEntry("Error", "Bad texture file: %s"%shortfn(fn))
-      else:
-        self.logEntry("Success", "Loaded texture from %s"%shortfn(fn))
-    elif ext in [".obj"]:
-      try:
-        self.add(Mesh(fn))
-      except:
-        self.logEntry("Error", "Bad mesh file: %s"%shortfn(fn))
-      else:
-        self.logEntry("Success", "Loaded mesh from %s"%shortfn(fn))
+  def importAssetFiles(self, fns):
+    '''Import asset files fns in the background'''
+    fns = [fn for fn in fns if self.importer.canImport(fn)]
+    if fns:
+      self.logEntry("Info", "Importing %d asset file(s)..."%len(fns))
+      self.importer.importFiles(fns)
+
+  def assetImported(self, asset, fn):
+    '''Add asset finished by the importer'''
+    self.add(asset)
+    kind = "texture" if isinstance(asset, Tex) else "mesh"
+    self.logEntry("Success", "Loaded %s from %s (%d/%d)"%(kind, shortfn(fn), *self.importer.progress()))
+
+  def assetFailed(self, fn, message):
+    '''Report asset file the importer could not load'''
+    kind = "texture" if os.path.splitext(fn)[1].lower() in TEX_EXTS else "mesh"
+    reason = message.strip().splitlines()[-1] if message.strip() else "unknown error" # the cause, after "More info:"
+    self.logEntry("Error", "Bad %s file: %s (%d/%d): %s"%(kind, shortfn(fn), *self.importer.progress(), reason))
 
   def exportImage(self):
     '''Prompt to export image in a size'''
@@ -1759,9 +1860,28 @@ class MainApp(QMainWindow):
     ambientPower.valueChanged.connect(self.updateScene)
     recolorAmbient.clicked.connect(self.recolorAmbientLight)
 
+    stats = self.sceneEdit_stats = QTableWidget()
+    stats.verticalHeader().setVisible(False)
+    stats.horizontalHeader().setVisible(False)
+    stats.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+    stats.verticalHeader().setDefaultSectionSize(24)
+    texBudget = self.sceneEdit_texBudget = QSpinBox(minimum=16, maximum=65536, singleStep=64, suffix=" MiB")
+    texBudget.setValue(TEX_BUDGET.budget//2**20)
+    texBudget.valueChanged.connect(self.updateScene)
+    statsBox = QGroupBox("Stats")
+    statsLayout = QFormLayout()
+    statsBox.setLayout(statsLayout)
+    statsLayout.addRow(stats)
+    statsLayout.addRow("Texture budget", texBudget)
+    self.statsTimer = QTimer() # started by frames, so the stats cost nothing while the view is idle
+    self.statsTimer.setSingleShot(True)
+    self.statsTimer.setInterval(1000)
+    self.statsTimer.timeout.connect(self.updateStats)
+
     L.addWidget(heading)
     L.addWidget(ambientBox)
     L.addWidget(recolorAmbient)
+    L.addWidget(statsBox)
 
     self.updateSceneEdit()
 
@@ -1826,6 +1946,10 @@ class MainApp(QMainWindow):
     shininess = self.texEdit_shininess = QDoubleSpinBox(decimals=PRECISION, minimum=1, maximum=B32-1)
     for setting in diffuse, specular, fresnel, shininess:
       setting.valueChanged.connect(self.updateSelected)
+    mipmap = self.texEdit_mipmap = QCheckBox(text="Mipmaps", tristate=False)
+    anisotropy = self.texEdit_anisotropy = QSpinBox(minimum=1, maximum=int(MAX_ANISOTROPY))
+    mipmap.stateChanged.connect(self.updateSelected)
+    anisotropy.valueChanged.connect(self.updateSelected)
     change = QPushButton(text="Change Image", icon=self.icons["File"])
     delete = QPushButton(text="Delete", icon=self.icons["Delete"])
     name.textChanged.connect(self.updateSelected)
@@ -1837,6 +1961,12 @@ class MainApp(QMainWindow):
     matLayout.addRow("Specular", specular)
     matLayout.addRow("Fresnel", fresnel)
     matLayout.addRow("Shininess", shininess)
+
+    samplingBox = QGroupBox("Sampling")
+    samplingLayout = QFormLayout()
+    samplingBox.setLayout(samplingLayout)
+    samplingLayout.addWidget(mipmap)
+    samplingLayout.addRow("Anisotropy", anisotropy)
     
     change.clicked.connect(self.reinitSelected)
     delete.clicked.connect(self.deleteSelected)
@@ -1844,6 +1974,7 @@ class MainApp(QMainWindow):
     L.addWidget(name)
     L.addWidget(thumbnail)
     L.addWidget(matBox)
+    L.addWidget(samplingBox)
     L.addWidget(change)
     L.addWidget(delete)
     W = self.texEdit = QWidget()
@@ -2184,7 +2315,28 @@ class MainApp(QMainWindow):
   def updateScene(self):
     ambientPower = self.sceneEdit_ambientPower.value()
     self.remote.getScene().ambientPower = ambientPower
-    self.gl.update()
+    TEX_BUDGET.budget = self.sceneEdit_texBudget.value()*2**20
+    self.gl.invalidate()
+
+  def frameDrawn(self):
+    '''Refresh the stats panel up to a second after a frame, at most once a second'''
+    if self.sceneEdit.isVisible() and not self.statsTimer.isActive():
+      self.statsTimer.start()
+
+  def updateStats(self):
+    '''Refresh the stats panel'''
+    if not self.sceneEdit.isVisible():
+      return
+    stats = [["Texture VRAM", "%s / %s"%(sizefmt(TEX_BUDGET.resident()), sizefmt(TEX_BUDGET.budget))]]
+    stats.extend(TEX_BUDGET.stats())
+    stats.append(["Engine buffers", "%d (%s)"%(GPU.bufferCount(), sizefmt(GPU.bufferBytes()))])
+    stats.extend(self.remote.getScene().renderList.stats())
+    stats.extend(DRAWS.stats())
+    stats.extend(LIGHT_CLUSTERS.stats())
+    stats.extend(ID_BUFFER.stats())
+    loadQTable(self.sceneEdit_stats, stats)
+    self.sceneEdit_stats.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+    self.sceneEdit_stats.horizontalHeader().setSectionResizeMode(1, QHeaderView.ResizeToContents)
 
   def updateCamEdit(self): # true settings -> displayed settings
     '''Updates the displayed settings for the camera'''
@@ -2216,7 +2368,7 @@ class MainApp(QMainWindow):
     fovy = self.camEdit_fovy.value()
     zoom = self.camEdit_zoom.value()
     self.remote.configCamera(pos=pos, rot=rot, fovy=fovy, zoom=zoom)
-    self.gl.update()
+    self.gl.invalidate()
 
   def reinitSelected(self):
     '''Prompts user to reinitialise the selected object from different files/assets'''
@@ -2459,7 +2611,7 @@ class MainApp(QMainWindow):
       self.logEntry("Error", "Symlink cycle: %s"%e)
     else:
       self.rendTree.move(rend, directory)
-      self.gl.update()
+      self.gl.invalidate()
 
   def cut(self, obj):
     self.copy(obj)
@@ -2478,6 +2630,7 @@ class MainApp(QMainWindow):
       S.specular = self.texEdit_specular.value()/100
       S.fresnel = self.texEdit_fresnel.value()/100
       S.shininess = self.texEdit_shininess.value()
+      S.setFiltering(self.texEdit_mipmap.isChecked(), self.texEdit_anisotropy.value())
       self.texList.update()
       
     elif type(S) is Mesh:
@@ -2542,7 +2695,7 @@ class MainApp(QMainWindow):
       S.visible = self.linkEdit_visible.isChecked()
       self.rendTree.update()
       
-    self.gl.update()
+    self.gl.invalidate()
 
   def switchSelEdit(self, objType):
     '''Updates the stacked widget in the "Selected" tab of the edit pane'''
@@ -2578,20 +2731,30 @@ class MainApp(QMainWindow):
       for setting, val in [(self.texEdit_diffuse, diffuse),
                            (self.texEdit_specular, specular),
                            (self.texEdit_fresnel, fresnel),
-                           (self.texEdit_shininess, shininess)]:
+                           (self.texEdit_shininess, shininess),
+                           (self.texEdit_anisotropy, int(S.anisotropy))]:
         setting.blockSignals(True)
         setting.setValue(val)
         setting.blockSignals(False)
+      for checkbox, state in [(self.texEdit_mipmap, S.mipmap)]:
+        checkbox.blockSignals(True)
+        checkbox.setCheckState(state*2)
+        checkbox.blockSignals(False)
       self.texEdit.update()
         
     if type(S) is Mesh:
       name = S.name
       cullbackface = S.cullbackface
-      info = [["Vertices", len(S.vertices)-1],
+      info = [["Vertices", S.vertex_count],
               ["Edges", len(S.edges)],
-              ["Faces", len(S.tri_faces)+len(S.quad_faces)+len(S.poly_faces)],
+              ["Faces", S.face_count],
               ["Tris", len(S.vbo_tri_indices)//3],
-              ["VBO length", S.vbo_bufferlen]]
+              ["Face corners", S.vbo_cornercount],
+              ["VBO length", S.vbo_bufferlen],
+              ["VRAM", sizefmt(S.vram_bytes())],
+              ["Shared by", "%d meshes"%Mesh.geometries.refcount(S.key)],
+              ["Welding saved", "%s (%.1fx fewer vertices)"%(sizefmt(S.weld_savings()),
+                                                             S.vbo_cornercount/max(S.vbo_bufferlen, 1))]]
 
       loadQTable(self.meshEdit_info, info)
       self.meshEdit_info.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
@@ -2762,18 +2925,22 @@ class MainApp(QMainWindow):
     
   def select(self, obj):
     '''Selects an object for editing'''
+    self.selectMulti([] if obj is None else [obj])
+
+  def selectMulti(self, objs):
+    '''Selects objects, editing the first'''
     engine.selected.clear()
-    if obj is not None:
-      engine.selected.add(obj)
+    engine.selected.update(objs)
+    obj = objs[0] if objs else None
     if isinstance(obj, Renderable):
-      obj.update_bbox()
+      obj.update_bbox() # only the edited one, refreshing thousands of boxes would take seconds
     engine.monoselected = obj
     self.edit.setCurrentWidget(self.selScrollArea)
     self.updateSelEdit()
     self.gl.sel_dv = None
     self.gl.sel_dr = None
-    self.gl.update()
-    self.rendTree.select(obj)
+    self.gl.invalidate()
+    self.rendTree.selectMulti(objs)
 
   def selectParent(self):
     if isinstance(engine.monoselected, Renderable):
@@ -2824,7 +2991,7 @@ class MainApp(QMainWindow):
           self.select(parentNode.child(nextIndex).obj)
 
   def highlight(self, rend):
-    engine.highlighted = rend
+    engine.highlight(rend)
 
   def update(self):
     '''Overload: update to display correct features'''
@@ -2832,7 +2999,7 @@ class MainApp(QMainWindow):
     self.updateSceneEdit()
     self.updateCamEdit()
     self.updateSelEdit()
-    self.gl.update()
+    self.gl.invalidate()
 
   def closeEvent(self, event):
     if YNPrompt(self, "Close", "Exit %s? Unsaved progress may still be accessed next session."%APPNAME, factory=QMessageBox.warning):
@@ -2844,6 +3011,7 @@ class MainApp(QMainWindow):
     self.editPane.hide()
     self.logPane.hide()
     self.helpPane.hide()
+    self.importer.shutdown()
     self.saver.update()
 
   def dragEnterEvent(self, event):
@@ -2856,16 +3024,29 @@ class MainApp(QMainWindow):
     if len(paths) == 1 and os.path.splitext(paths[0])[1] == ".3dproj":
       self.load(paths[0])
     else:
-      for path in paths:
-        self.loadAssetFile(path)
+      self.importAssetFiles(paths)
 
-  def selectFromXY(self, XY):
+  def rendFromXY(self, XY):
+    '''Renderable under QT coordinates XY of the 3D view'''
     XY = self.gl.qt2glXY(XY)
-    self.select(self.remote.getScene().getRendFromXY(XY, self.remote.getCamera(), self.gl.aspect))
+    self.gl.makeCurrent() # the ID buffer is read outside of paintGL
+    return self.remote.getScene().getRendFromXY(XY, self.remote.getCamera(), self.gl.aspect, (0, 0, *self.gl.dims))
+
+  def selectFromXY(self, XY):
+    self.select(self.rendFromXY(XY))
 
   def highlightFromXY(self, XY):
-    XY = self.gl.qt2glXY(XY)
-    self.highlight(self.remote.getScene().getRendFromXY(XY, self.remote.getCamera(), self.gl.aspect))
+    self.highlight(self.rendFromXY(XY))
+
+  def selectFromRect(self, rect):
+    '''Select the Models and Lamps shown between corners (x0, y0, x1, y1) in QT coordinates of the 3D view, the nearest first'''
+    x0, y0 = self.gl.qt2glXY(rect[0:2])
+    x1, y1 = self.gl.qt2glXY(rect[2:4])
+    rect = min(x0, x1), min(y0, y1), abs(x1-x0), abs(y1-y0)
+    rends = self.remote.getScene().getRendsFromRect(rect, self.remote.getCamera(), self.gl.aspect, (0, 0, *self.gl.dims))
+    if set(rends) == engine.selected:
+      return # still the same while dragging
+    self.selectMulti(rends)
 
 if __name__ == "__main__":
   window = QApplication(sys.argv)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+'''
+meshcache.py
+on-disk cache of processed meshes
+
+Parsing a .obj file and generating its normals and VBO arrays is the
+slowest part of loading a mesh. The results are kept in the appdata
+folder, keyed by a hash of the source file's content (asset.content_key), in a flat binary
+format that is memory-mapped straight back in. Least recently used
+entries are evicted once the cache grows past MESH_CACHE_SIZE.
+
+Entry layout:
+  MAGIC, header length (uint32), JSON header,
+  then the raw data of each array, every array aligned to ALIGN bytes
+'''
+
+from all_modules import *
+from appdata import datapath
+
+MAGIC = b"ZMSH"
+VERSION = 1 # bump whenever the processed mesh format changes
+ALIGN = 64
+CACHE_DIR = "cache/meshes"
+EXT = ".zmesh"
+
+def aligned(n):
+  '''Round n up to a multiple of ALIGN'''
+  return -(-n//ALIGN)*ALIGN
+
+def entrypath(key):
+  '''Get absolute path of the cache entry for key'''
+  return datapath(os.path.join(CACHE_DIR, "%s-%d%s"%(key, VERSION, EXT)))
+
+def load(key):
+  '''
+Get (arrays, meta) of the entry for key, or None if there is no valid entry.
+arrays is a dict of read-only memory-mapped arrays, meta is the dict given to store.
+  '''
+  path = entrypath(key)
+  try:
+    with open(path, "rb") as f:
+      if f.read(len(MAGIC)) != MAGIC:
+        return None
+      headerlen, = struct.unpack("<I", f.read(4))
+      header = json.loads(f.read(headerlen).decode("utf-8"))
+    start = aligned(len(MAGIC)+4+headerlen)
+    arrays = dict()
+    for name, (dtype, shape, offset) in header["arrays"].items():
+      if 0 in shape: # empty arrays cannot be mapped
+        arrays[name] = np.empty(shape, dtype)
+      else:
+        arrays[name] = np.memmap(path, dtype=np.dtype(dtype), mode="r", offset=start+offset, shape=tuple(shape))
+    os.utime(path) # mark as recently used
+  except (OSError, ValueError, KeyError, struct.error):
+    return None
+  return arrays, header["meta"]
+
+def store(key, arrays, meta):
+  '''
+Write the entry for key: arrays is a dict of name -> ndarray,
+meta is a JSON-serialisable dict. Then evict old entries.
+  '''
+  header = {"meta": meta, "arrays": dict()}
+  offset = 0
+  for name, arr in arrays.items():
+    header["arrays"][name] = [arr.dtype.str, list(arr.shape), offset]
+    offset += aligned(arr.nbytes)
+  headerbytes = json.dumps(header).encode("utf-8")
+
+  path = entrypath(key)
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  tmppath = "%s.%d.tmp"%(path, os.getpid()) # workers may store the same mesh at once
+  with open(tmppath, "wb") as f:
+    f.write(MAGIC)
+    f.write(struct.pack("<I", len(headerbytes)))
+    f.write(headerbytes)
+    f.write(b"\0"*(aligned(f.tell())-f.tell()))
+    for arr in arrays.values():
+      f.write(np.ascontiguousarray(arr).data)
+      f.write(b"\0"*(aligned(arr.nbytes)-arr.nbytes))
+  os.replace(tmppath, path) # never leave a half-written entry behind
+  evict()
+
+def evict(limit=MESH_CACHE_SIZE):
+  '''Delete least recently used entries until the cache fits in limit bytes'''
+  folder = datapath(CACHE_DIR)
+  entries = []
+  for fn in os.listdir(folder):
+    if fn.endswith(EXT):
+      try:
+        st = os.stat(os.path.join(folder, fn))
+      except OSError: # evicted by another worker meanwhile
+        continue
+      entries.append((st.st_mtime, st.st_size, os.path.join(folder, fn)))
+  total = sum(size for _, size, _ in entries)
+  for _, size, path in sorted(entries):
+    if total <= limit:
+      break
+    try:
+      os.remove(path)
+    except OSError: # still mapped by a loaded mesh on some platforms
+      continue
+    total -= size
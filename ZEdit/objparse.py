@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+'''
+objparse.py
+bulk parser for Wavefront .obj files
+
+The whole file is read into one byte buffer. Every line is classified
+by its keyword with array operations, then each kind of record
+(v, vt, vn, f) is decoded as one contiguous block of text.
+No Python code runs per vertex or per face, so multi-million
+triangle scans load in seconds instead of minutes.
+'''
+
+from all_modules import *
+
+SPACE = ord(" ")
+NEWLINE = ord("\n")
+SLASH = ord("/")
+
+# scan event flags
+TOKEN = 1
+LINE_END = 2
+SLASH_IN_TOKEN = 4
+
+# record kinds
+OTHER = 0
+V = 1
+VT = 2
+VN = 3
+F = 4
+
+def group_index(counts):
+  '''
+Index of each element within its group, for groups of
+sizes (counts) laid back to back.
+Example - group_index([3, 1, 2]) gives [0, 1, 2, 0, 0, 1]
+  '''
+  counts = np.asarray(counts, np.int64)
+  starts = np.cumsum(counts) - counts
+  return np.arange(counts.sum()) - np.repeat(starts, counts)
+
+def decode(text, dtype):
+  '''Decode whitespace separated numbers in (text) into an array of (dtype)'''
+  if not text.strip():
+    return np.empty(0, dtype)
+  return np.fromstring(text, dtype=dtype, sep=" ")
+
+def gather_rows(values, counts, width):
+  '''
+Arrange (values), given back to back in groups of sizes (counts),
+into one row per group with (width) columns. Short groups are padded
+with zeros and extra values are dropped.
+  '''
+  if len(values) != counts.sum():
+    raise ValueError("Malformed record: expected %d numbers, read %d"%(counts.sum(), len(values)))
+  if (counts == width).all():
+    return values.reshape(-1, width)
+  rows = np.zeros((len(counts), width), values.dtype)
+  row = np.repeat(np.arange(len(counts)), counts)
+  col = group_index(counts)
+  keep = col < width
+  rows[row[keep], col[keep]] = values[keep]
+  return rows
+
+def parse_obj(filename):
+  '''
+Parses .obj file (filename) in one pass and returns
+(vertices, texcoords, normals, corners, face_sizes):
+  vertices   - float32 array (N, 3)
+  texcoords  - float32 array (M, 2)
+  normals    - float32 array (K, 3)
+  corners    - int array (C, 3) of (v, vt, vn) indices for each face corner,
+               faces back to back in file order. Missing indices are 0.
+  face_sizes - int array (F,) with the number of corners of each face
+Indices are kept exactly as written in the file (1-indexed).
+  '''
+  with open(filename, "rb") as f:
+    data = f.read()
+  buf = np.frombuffer(data + b"\n", np.uint8).copy()
+
+  # EVENTS: token starts, line ends and slashes, in file order.
+  # A token starts wherever a non-blank byte follows a blank one.
+  blank = buf <= SPACE # spaces, tabs and line breaks
+  is_nl = buf == NEWLINE
+  tok_start = np.empty_like(blank)
+  tok_start[0] = not blank[0]
+  tok_start[1:] = ~blank[1:] & blank[:-1]
+  events = tok_start.view(np.uint8)*TOKEN | is_nl.view(np.uint8)*LINE_END \
+           | (buf == SLASH).view(np.uint8)*SLASH_IN_TOKEN
+  del blank, is_nl, tok_start
+  pos = np.flatnonzero(events)
+  ev = events[pos]
+  del events
+  ev_tok = (ev & TOKEN).astype(bool)
+  ev_nl = (ev & LINE_END).astype(bool)
+  ev_line = np.cumsum(ev_nl) - ev_nl # lines ended before each event
+  ev_token = np.cumsum(ev_tok) - 1 # token each event belongs to
+
+  # LINES
+  line_ends = pos[ev_nl]
+  line_lengths = np.diff(np.concatenate(([-1], line_ends)))
+  n_lines = len(line_ends)
+
+  # TOKENS
+  tok = pos[ev_tok]
+  tok_line = ev_line[ev_tok]
+  slash_count = np.bincount(ev_token[(ev & SLASH_IN_TOKEN).astype(bool)], minlength=len(tok))
+  del pos, ev, ev_tok, ev_nl, ev_line, ev_token
+  first = np.ones(len(tok), bool)
+  first[1:] = tok_line[1:] != tok_line[:-1]
+
+  # KEYWORDS: the first token of every line
+  kw = tok[first]
+  kw_line = tok_line[first]
+  padded = np.concatenate((buf, [SPACE, SPACE]))
+  c0, c1, c2 = padded[kw], padded[kw+1], padded[kw+2]
+  blank1 = c1 <= SPACE
+  blank2 = c2 <= SPACE
+  is_v = (c0 == ord("v")) & blank1
+  is_vt = (c0 == ord("v")) & (c1 == ord("t")) & blank2
+  is_vn = (c0 == ord("v")) & (c1 == ord("n")) & blank2
+  is_f = (c0 == ord("f")) & blank1
+  line_kind = np.zeros(n_lines, np.uint8)
+  for kind, is_kind in [(V, is_v), (VT, is_vt), (VN, is_vn), (F, is_f)]:
+    line_kind[kw_line[is_kind]] = kind
+
+  # blank out the keywords so that only the numbers remain
+  buf[kw[is_v | is_vt | is_vn | is_f]] = SPACE
+  buf[kw[is_vt | is_vn]+1] = SPACE
+
+  fields = np.bincount(tok_line, minlength=n_lines) - 1
+  byte_kind = np.repeat(line_kind, line_lengths)
+
+  def block(kind):
+    '''Text of all records of a kind, and the number of fields in each record'''
+    return buf[byte_kind == kind].tobytes(), fields[line_kind == kind]
+
+  def coords(kind, width):
+    text, counts = block(kind)
+    values = decode(text, np.float32)
+    return gather_rows(values, counts, width)
+
+  vertices = coords(V, 3)
+  texcoords = coords(VT, 2)
+  normals = coords(VN, 3)
+
+  # FACES: v, v/vt, v//vn or v/vt/vn for each corner
+  text, face_sizes = block(F)
+  is_corner = ~first & (line_kind[tok_line] == F)
+  corner_fields = slash_count[is_corner] + 1
+  text = text.replace(b"//", b"/0/").replace(b"/", b" ")
+  values = decode(text, np.int64)
+  corners = gather_rows(values, corner_fields, 3)
+
+  return vertices, texcoords, normals, corners, face_sizes
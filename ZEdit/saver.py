@@ -92,9 +92,9 @@ class Saver:
         elif type(asset) is Tex:
           shutil.copy(datapath("save/assets/textures/%d.png"%asset.ID),
                       datapath("tmp/assets/textures/%d.png"%asset.ID))
-          f.write("t '%s' %d %s %s %s %s\n"%(asset.name, asset.ID,
-                                             asset.diffuse, asset.specular, asset.fresnel,
-                                             asset.shininess))
+          f.write("t '%s' %d %s %s %s %s %d %s\n"%(asset.name, asset.ID,
+                                                   asset.diffuse, asset.specular, asset.fresnel,
+                                                   asset.shininess, asset.mipmap, asset.anisotropy))
           tDict[asset.ID] = next(texturePlacements)
         elif type(asset) is Bulb:
           f.write("b '%s' %d %s %s %s %s\n"%(asset.name, asset.ID, *asset.color, asset.power))
@@ -172,9 +172,9 @@ class Saver:
     bulbs = [self.defaultBulb]
     directories = [None] # MainApp.add(app, rend, None) adds rend as toplevel item to the scene
     dirStack = [engine.monoselected]
-    for line in dataopen("tmp/blueprint.dat", "r"):
-##      print(line, end="")
-      words = shlex.split(line)
+    blueprint = [shlex.split(line) for line in dataopen("tmp/blueprint.dat", "r")]
+    assets = self.import_assets(blueprint)
+    for words in blueprint:
       if not words:
         continue
       command, *args = words
@@ -192,7 +192,7 @@ class Saver:
         if ID == 0:
           meshes.append(self.defaultMesh)
         else:
-          new_mesh = Mesh(datapath("tmp/assets/meshes/%d.obj"%ID), name=name, cullbackface=cullbackface)
+          new_mesh = next(assets)
           self.app.add(new_mesh)
           meshes.append(new_mesh)
           
@@ -201,9 +201,7 @@ class Saver:
         if ID == 0:
           textures.append(self.defaultTexture)
         else:
-          new_tex = Tex(datapath("tmp/assets/textures/%d.png"%ID),
-                        diffuse=diffuse, specular=specular, fresnel=fresnel,
-                        name=name)
+          new_tex = next(assets)
           self.app.add(new_tex)
           textures.append(new_tex)
 
@@ -261,6 +259,33 @@ class Saver:
         x,y,z,rx,ry,rz, fovy, zoom = castList([*[float]*6, float, float], args)
         self.R.configCamera(Point(x,y,z), Rot(rx,ry,rz), fovy, zoom)
 
+  def import_assets(self, blueprint):
+    '''Import all meshes and textures of blueprint in parallel and iterate over them in blueprint order'''
+    jobs = []
+    for words in blueprint:
+      if not words:
+        continue
+      command, *args = words
+      if command == "m":
+        name, ID, cullbackface = castList([str, int, int], args)
+        if ID != 0:
+          jobs.append((datapath("tmp/assets/meshes/%d.obj"%ID),
+                       dict(name=name, cullbackface=cullbackface)))
+      elif command == "t":
+        name, ID, diffuse, specular, fresnel, shininess, mipmap, anisotropy\
+          = castList([str, int, *[float]*3, float, int, float], args)
+        if mipmap is None: # saved before texture filtering was configurable
+          mipmap, anisotropy = True, MAX_ANISOTROPY
+        if ID != 0:
+          jobs.append((datapath("tmp/assets/textures/%d.png"%ID),
+                       dict(diffuse=diffuse, specular=specular, fresnel=fresnel, name=name,
+                            mipmap=bool(mipmap), anisotropy=anisotropy)))
+    return iter(self.app.importer.importAll(jobs, progress=self.log_progress))
+
+  def log_progress(self, done, total):
+    if done == total or done % max(1, total//10) == 0:
+      self.app.logEntry("Info", "Loaded %d of %d assets"%(done, total))
+
   def canRestore(self):
     return os.path.isfile(datapath("tmp/blueprint.dat"))
     
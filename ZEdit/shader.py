@@ -12,7 +12,7 @@ He forgot to add a shader.
 from all_modules import *
 
 SHADER_FILENAME_PAIRS = dict()
-for shader_name in ["plain", "flat", "phong"]:
+for shader_name in ["plain", "flat", "phong", "depth", "id"]:
   SHADER_FILENAME_PAIRS[shader_name] = ("./shaders/%s/vshader.glsl"%shader_name, "./shaders/%s/fshader.glsl"%shader_name)
 
 class Shader:
@@ -37,7 +37,23 @@ class Shader:
                         "lColorPowers": glGetUniformLocation(self.program, "lColorPowers"),
 ##                        "lDirections": glGetUniformLocation(self.program, "lDirections"),
 ##                        "lAOEs": glGetUniformLocation(self.program, "lAOEs"),
+                        "instanced": glGetUniformLocation(self.program, "instanced"),
+                        "drawLights": glGetUniformLocation(self.program, "drawLights"),
+                        "modelLights": glGetUniformLocation(self.program, "modelLights"),
+                        "clustered": glGetUniformLocation(self.program, "clustered"),
+                        "clusterTex": glGetUniformLocation(self.program, "clusterTex"),
+                        "lightIndexTex": glGetUniformLocation(self.program, "lightIndexTex"),
+                        "clusterGrid": glGetUniformLocation(self.program, "clusterGrid"),
+                        "viewport": glGetUniformLocation(self.program, "viewport"),
+                        "zRange": glGetUniformLocation(self.program, "zRange"),
+                        "drawID": glGetUniformLocation(self.program, "drawID"),
                         }
+    # per-instance matrices of instanced draws, -1 if the shader does not use one
+    self.attribLocs = {"instanceModelview": glGetAttribLocation(self.program, "instanceModelview"),
+                       "instanceNormalMatrix": glGetAttribLocation(self.program, "instanceNormalMatrix"),
+                       "instanceLights": glGetAttribLocation(self.program, "instanceLights"),
+                       "instanceID": glGetAttribLocation(self.program, "instanceID"),
+                       }
 
   def use(self):
     Shader.current = self
@@ -0,0 +1,4 @@
+#version 130
+
+void main() {
+}
\ No newline at end of file
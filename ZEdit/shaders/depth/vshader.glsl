@@ -0,0 +1,11 @@
+#version 130
+invariant gl_Position; // the same depth as the phong shader, which tests against it
+uniform bool instanced; // take the modelview from the per-instance attribute instead of GL's
+attribute mat4 instanceModelview;
+
+void main() {
+    if (instanced)
+        gl_Position = gl_ProjectionMatrix * (instanceModelview * gl_Vertex);
+    else
+        gl_Position = gl_ModelViewProjectionMatrix * gl_Vertex;
+}
@@ -0,0 +1,7 @@
+#version 130
+flat in float id; // a whole number below 2^24, exact in a float
+
+void main() {
+    // one byte of the ID in each of red, green and blue, least significant first
+    gl_FragColor = vec4(mod(id, 256.0), mod(floor(id/256.0), 256.0), floor(id/65536.0), 255.0)/255.0;
+}
@@ -0,0 +1,16 @@
+#version 130
+uniform bool instanced; // take the modelview and ID from the per-instance attributes instead
+uniform float drawID; // of a draw that is not instanced
+attribute mat4 instanceModelview;
+attribute float instanceID;
+flat out float id;
+
+void main() {
+    if (instanced) {
+        gl_Position = gl_ProjectionMatrix * (instanceModelview * gl_Vertex);
+        id = instanceID;
+    } else {
+        gl_Position = gl_ModelViewProjectionMatrix * gl_Vertex;
+        id = drawID;
+    }
+}
@@ -3,6 +3,7 @@ varying vec3 N;
 varying vec3 v;
 varying mediump vec2 texCoord;
 varying vec4 color;
+flat in vec2 lightRange; // (offset, count) of the model's lamp list
 uniform sampler2D texture;
 uniform vec3 ambientColorPower;
 uniform float diffuse; // how much diffused light a texture reflects
@@ -15,6 +16,15 @@ uniform vec3 lPositions[MAX_LIGHTS];
 uniform vec3 lColorPowers[MAX_LIGHTS];
 uniform int lCount;
 
+// lamp lists of models or clusters, see lightclusters.py
+uniform bool modelLights;
+uniform bool clustered;
+uniform sampler2D clusterTex; // (offset, count) per cluster, one row per depth slice
+uniform sampler2D lightIndexTex; // light indices of all lists
+uniform vec3 clusterGrid; // tiles across, tiles down, depth slices
+uniform vec4 viewport;
+uniform vec2 zRange;
+
 float dampen(float n)
 {
   return 1.0 - pow(2.7182818, -n);
@@ -61,8 +71,29 @@ void main()
   vec3 specularC = vec3(0.0, 0.0, 0.0);
   vec3 fresnelC = vec3(0.0, 0.0, 0.0);
 
-  for (int i = 0; i < lCount; i++) // for each light:
+  int first = 0;
+  int count = lCount;
+  int indexWidth = textureSize(lightIndexTex, 0).x;
+  if (clustered)
+  {
+    ivec2 tile = ivec2((gl_FragCoord.xy - viewport.xy) / viewport.zw * clusterGrid.xy);
+    float slice = floor(log(-v.z / zRange[0]) / log(zRange[1] / zRange[0]) * clusterGrid.z);
+    ivec3 last = ivec3(clusterGrid) - 1;
+    tile = clamp(tile, ivec2(0), last.xy);
+    vec2 cluster = texelFetch(clusterTex, ivec2(tile.y*int(clusterGrid.x) + tile.x, clamp(int(slice), 0, last.z)), 0).rg;
+    first = int(cluster[0]);
+    count = int(cluster[1]);
+  }
+  else if (modelLights)
+  {
+    first = int(lightRange[0]);
+    count = int(lightRange[1]);
+  }
+
+  for (int j = 0; j < count; j++) // for each light:
   {
+    int i = j;
+    if (clustered || modelLights) i = int(texelFetch(lightIndexTex, ivec2((first+j) % indexWidth, (first+j) / indexWidth), 0).r);
     // L: frag-->lightsrc
     vec3 relPos = lPositions[i] - v;
     float distSquared = lengthSquared(relPos); // for inverse square law
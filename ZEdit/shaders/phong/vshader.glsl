@@ -1,14 +1,30 @@
 #version 130
+invariant gl_Position; // the same depth as the depth pre-pass
 varying vec3 N;
 varying vec3 v; // eye coordinates
 varying mediump vec2 texCoord;
 varying vec4 color;
+flat out vec2 lightRange; // (offset, count) of the model's lamp list
+uniform bool instanced; // take the matrices from the per-instance attributes instead of GL's
+uniform vec2 drawLights; // lightRange of draws that are not instanced
+attribute mat4 instanceModelview;
+attribute mat3 instanceNormalMatrix;
+attribute vec2 instanceLights;
 
 void main(void)
 {
-    v = vec3(gl_ModelViewMatrix * gl_Vertex);
-    N = normalize(gl_NormalMatrix * gl_Normal);
+    if (instanced) {
+        vec4 eye = instanceModelview * gl_Vertex;
+        v = vec3(eye);
+        N = normalize(instanceNormalMatrix * gl_Normal);
+        gl_Position = gl_ProjectionMatrix * eye;
+        lightRange = instanceLights;
+    } else {
+        v = vec3(gl_ModelViewMatrix * gl_Vertex);
+        N = normalize(gl_NormalMatrix * gl_Normal);
+        gl_Position = gl_ModelViewProjectionMatrix * gl_Vertex;
+        lightRange = drawLights;
+    }
     texCoord = gl_MultiTexCoord0.xy;
-    gl_Position = gl_ModelViewProjectionMatrix * gl_Vertex;
     color = gl_Color;
 }
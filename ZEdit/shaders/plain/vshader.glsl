@@ -1,7 +1,12 @@
 #version 130
 varying vec4 color;
+uniform bool instanced; // take the modelview from the per-instance attribute instead of GL's
+attribute mat4 instanceModelview;
 
 void main() {
-    gl_Position = gl_ModelViewProjectionMatrix * gl_Vertex;
+    if (instanced)
+        gl_Position = gl_ProjectionMatrix * (instanceModelview * gl_Vertex);
+    else
+        gl_Position = gl_ModelViewProjectionMatrix * gl_Vertex;
     color = gl_Color;
-}
\ No newline at end of file
+}
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+'''
+texbudget.py
+keeps textures within a VRAM budget
+
+Every drawn texture asks for a resolution level from its model's
+projected size on screen: level 0 is the full TEX_SIZE, each level
+halves the width and height. Between frames the budget promotes the
+textures that need more detail and, when that does not fit, evicts
+the least recently drawn textures down to a small stand-in.
+Identical textures share one GL image (Tex.images), which is what
+the budget manages.
+'''
+
+from all_modules import *
+from asset import Tex, TEX_SIZE
+
+STANDIN_LEVEL = 5 # 32x32 stand-in for textures that have not been drawn lately
+PROMOTIONS_PER_FRAME = 2 # each promotion decodes the saved image, so spread them out
+
+def level_bytes(level, mipmap=True):
+  '''VRAM taken by a texture at resolution level'''
+  nbytes = (TEX_SIZE[0]>>level)*(TEX_SIZE[1]>>level)*4
+  return nbytes*4//3 if mipmap else nbytes
+
+def coverage_level(pixels):
+  '''Coarsest level that still gives a texture spanning (pixels) on screen one texel per pixel'''
+  if pixels <= 0:
+    return STANDIN_LEVEL
+  return max(0, min(STANDIN_LEVEL, int(np.log2(TEX_SIZE[1]/pixels))))
+
+class TexBudget:
+  '''Texture residency manager, driven by Scene.render once per frame'''
+  def __init__(self, budget=TEX_VRAM_BUDGET):
+    self.budget = budget # bytes
+    self.frame = 0
+    self.viewportHeight = 1
+    self.tanHalfFovy = 1.0
+
+  def textures(self):
+    '''Shared GL images of all textures'''
+    return Tex.images.resources()
+
+  def resident(self):
+    '''Bytes of VRAM taken by all textures'''
+    return sum(tex.vram_bytes() for tex in self.textures())
+
+  def stats(self):
+    '''[[label, count], ...] of texture residency for the stats panel'''
+    textures = list(self.textures())
+    return [["Textures", len(textures)],
+            ["At full resolution", sum(tex.level == 0 for tex in textures)],
+            ["Stand-ins", sum(tex.level >= STANDIN_LEVEL for tex in textures)]]
+
+  def begin_frame(self, trueFovy):
+    self.frame += 1
+    self.viewportHeight = glGetIntegerv(GL_VIEWPORT)[3]
+    self.tanHalfFovy = tan(radians(trueFovy)/2)
+
+  def request(self, tex, minPoint, maxPoint, modelviews):
+    '''Note that tex is drawn on the box (minPoint, maxPoint) in each 4x4 matrix of modelviews (n,4,4)'''
+    if tex.image is None: # deleted, drawn white
+      return
+    A = modelviews
+    lo, hi = np.array(minPoint, float), np.array(maxPoint, float)
+    center = np.append((lo+hi)/2, 1.0) @ A
+    radius = np.linalg.norm(hi-lo)/2 * np.linalg.norm(A[:, 0:3, 0:3], axis=2).max(axis=1)
+    dist = -center[:, 2]
+    with np.errstate(divide="ignore", invalid="ignore"): # only used where dist > radius
+      pixels = radius/(dist*self.tanHalfFovy) * self.viewportHeight
+    pixels[dist <= radius] = self.viewportHeight # camera is inside or right next to it
+    pixels[dist < -radius] = 0 # behind the camera
+    level = coverage_level(pixels.max(initial=0)) # the closest copy decides
+    image = tex.image
+    if image.lastDrawn != self.frame:
+      image.lastDrawn = self.frame
+      image.wantLevel = level
+    else:
+      image.wantLevel = min(image.wantLevel, level)
+
+  def end_frame(self):
+    '''
+Rebalance after a frame: promote drawn textures that need more detail,
+making room by evicting the least recently drawn ones to stand-ins and
+then by shrinking drawn ones that are sharper than they need to be.
+Returns True if any texture changed.
+    '''
+    changed = False
+    textures = list(self.textures())
+    resident = sum(tex.vram_bytes() for tex in textures)
+    drawn = [tex for tex in textures if tex.lastDrawn == self.frame]
+    # popped from the end: least recently drawn, most surplus detail
+    stale = sorted((tex for tex in textures if tex.lastDrawn != self.frame and tex.level < STANDIN_LEVEL),
+                   key=lambda tex: tex.lastDrawn, reverse=True)
+    surplus = sorted((tex for tex in drawn if tex.level < tex.wantLevel),
+                     key=lambda tex: tex.wantLevel - tex.level)
+
+    def setLevel(tex, level):
+      nonlocal resident, changed
+      resident -= tex.vram_bytes()
+      tex.setLevel(level)
+      resident += tex.vram_bytes()
+      changed = True
+
+    def makeRoom(nbytes):
+      while resident + nbytes > self.budget and stale:
+        setLevel(stale.pop(), STANDIN_LEVEL)
+      while resident + nbytes > self.budget and surplus:
+        tex = surplus.pop()
+        setLevel(tex, tex.wantLevel)
+      return resident + nbytes <= self.budget
+
+    wanting = sorted((tex for tex in drawn if tex.wantLevel < tex.level),
+                     key=lambda tex: tex.wantLevel - tex.level)
+    for tex in wanting[:PROMOTIONS_PER_FRAME]:
+      if makeRoom(level_bytes(tex.wantLevel, tex.mipmap) - tex.vram_bytes()):
+        setLevel(tex, tex.wantLevel)
+
+    # still over budget, e.g. after an import or a smaller budget
+    if not makeRoom(0):
+      for tex in sorted(textures, key=lambda tex: tex.vram_bytes(), reverse=True):
+        if resident <= self.budget:
+          break
+        if tex.level < STANDIN_LEVEL:
+          setLevel(tex, tex.level+1)
+    return changed
+
+TEX_BUDGET = TexBudget()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+'''
+benchgl.py
+an OpenGL context for the benchmarks, without the editor
+
+context() makes ZEdit's modules importable, moves into ZEdit/ where its
+assets are, and makes a context current: a QGLWidget like the
+editor's, or an EGL pbuffer when run with --egl on a machine without a
+display (Mesa's llvmpipe, for one).
+'''
+
+import os, sys
+
+ZEDIT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "ZEdit")
+
+def egl_context(w, h):
+  '''Make a pbuffer context current through EGL'''
+  os.environ["PYOPENGL_PLATFORM"] = "egl"
+  os.environ.setdefault("EGL_PLATFORM", "surfaceless")
+  import ctypes
+  from OpenGL import EGL
+  display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+  major, minor = EGL.EGLint(), EGL.EGLint()
+  assert EGL.eglInitialize(display, ctypes.pointer(major), ctypes.pointer(minor))
+  attribs = (EGL.EGLint*13)(EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT, EGL.EGL_RED_SIZE, 8, EGL.EGL_GREEN_SIZE, 8,
+                            EGL.EGL_BLUE_SIZE, 8, EGL.EGL_DEPTH_SIZE, 24, EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+                            EGL.EGL_NONE)
+  config, count = EGL.EGLConfig(), EGL.EGLint()
+  assert EGL.eglChooseConfig(display, attribs, ctypes.pointer(config), 1, ctypes.pointer(count)) and count.value
+  surface = EGL.eglCreatePbufferSurface(display, config, (EGL.EGLint*5)(EGL.EGL_WIDTH, w, EGL.EGL_HEIGHT, h, EGL.EGL_NONE))
+  EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+  ctx = EGL.eglCreateContext(display, config, EGL.EGL_NO_CONTEXT, None)
+  assert EGL.eglMakeCurrent(display, surface, surface, ctx)
+  # Mesa will not let the phong shader overload the builtins max and pow
+  from OpenGL.GL import shaders
+  compileShader = shaders.compileShader
+  def renamed(source, kind):
+    if isinstance(source, str):
+      source = (source.replace("float max(vec3 v)", "float max3(vec3 v)").replace("float m = max(v);", "float m = max3(v);")
+                .replace("vec3 pow(vec3 v, float e)", "vec3 pow3(vec3 v, float e)").replace("(pow(dampen(", "(pow3(dampen("))
+    return compileShader(source, kind)
+  shaders.compileShader = renamed
+  return ctx
+
+def qt_context(w, h):
+  '''Make a QGLWidget's context current'''
+  from PyQt5.QtWidgets import QApplication
+  from PyQt5.QtOpenGL import QGLWidget
+  global _app, _widget
+  _app = QApplication.instance() or QApplication(sys.argv[:1])
+  _widget = QGLWidget()
+  _widget.resize(w, h)
+  _widget.show() # its context is made with its window
+  _widget.makeCurrent()
+  return _widget
+
+def context(w=800, h=600):
+  '''Make a context of size (w, h) current for ZEdit, taking --egl out of sys.argv'''
+  egl = "--egl" in sys.argv
+  if egl:
+    sys.argv.remove("--egl")
+  ctx = egl_context(w, h) if egl else qt_context(w, h)
+  sys.path.insert(0, ZEDIT)
+  os.chdir(ZEDIT)
+  from OpenGL.GL import glViewport
+  glViewport(0, 0, w, h)
+  return ctx
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+'''
+bvh_bench.py
+times ZEdit's BVH against brute-force tests over every box
+
+Random boxes are spread through a cube that grows with their count, so
+the density stays the same. For each count this times building the
+tree, refitting it after 1% and after one of the boxes move, and ray,
+box and frustum queries against the same test run over all the boxes.
+Every query result is checked against the brute-force one.
+
+  $ python bvh_bench.py [count ...]   # default 1000 10000 100000 1000000
+'''
+
+import os, sys, time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "ZEdit"))
+import numpy as np
+from bvh import BVH, ray_hits, frustum_overlaps, box_overlaps
+
+rng = np.random.default_rng(0)
+
+def random_boxes(n):
+  '''n boxes (n,2,3) with sides 0.4 to 2 in a cube of half side (side), and side'''
+  side = 40*(n/1000)**(1/3)
+  centers = rng.uniform(-side, side, (n, 3))
+  halves = rng.uniform(0.2, 1.0, (n, 3))
+  return np.stack([centers-halves, centers+halves], axis=1), side
+
+def timed(f, reps):
+  '''(ms per call of f, its result) over reps calls, after one to warm up'''
+  f()
+  t = time.perf_counter()
+  for _ in range(reps):
+    result = f()
+  return (time.perf_counter()-t)/reps*1000, result
+
+def narrow_frustum(origin, halfAngle=5, near=0.1, far=1e5):
+  '''Planes of a frustum looking down -z from origin, in the layout of frustum_overlaps'''
+  t = np.tan(np.radians(halfAngle))
+  planes = np.array([[0, 0, -1, -near], [0, 0, 1, far],
+                     [0, -1, -t, 0], [0, 1, -t, 0], [-1, 0, -t, 0], [1, 0, -t, 0]], float)
+  view = np.identity(4)
+  view[3, 0:3] = -origin
+  return view @ planes.T
+
+def bench(n):
+  bounds, side = random_boxes(n)
+  t = time.perf_counter()
+  tree = BVH(bounds)
+  build = (time.perf_counter()-t)*1000
+
+  origin = np.array([0, 0, 3*side])
+  rays = []
+  for _ in range(20):
+    direction = rng.uniform(-side, side, 3) - origin
+    rays.append((origin, direction/np.linalg.norm(direction)))
+  brute = lambda ray: np.flatnonzero(ray_hits(*ray, bounds))
+  rayTree = np.mean([timed(lambda: tree.ray(*ray), 20)[0] for ray in rays[:5]])
+  rayBrute = np.mean([timed(lambda: brute(ray), 3)[0] for ray in rays[:5]])
+  for ray in rays:
+    assert np.array_equal(tree.ray(*ray), brute(ray))
+
+  lo, hi = np.full(3, -side/8), np.full(3, side/8)
+  boxTree, inBox = timed(lambda: tree.box(lo, hi), 20)
+  boxBrute, expected = timed(lambda: np.flatnonzero(box_overlaps(lo, hi, bounds)), 3)
+  assert np.array_equal(inBox, expected)
+
+  planes = narrow_frustum(origin)
+  frustumTree, inFrustum = timed(lambda: tree.frustum(planes), 20)
+  frustumBrute, expected = timed(lambda: np.flatnonzero(frustum_overlaps(planes, bounds)), 3)
+  assert np.array_equal(inFrustum, expected)
+
+  items = rng.choice(n, max(1, n//100), replace=False)
+  bounds[items] += rng.uniform(-1, 1, (len(items), 1, 3))
+  t = time.perf_counter()
+  tree.update(items, bounds[items])
+  refit = (time.perf_counter()-t)*1000
+  t = time.perf_counter()
+  tree.update(items[:1], bounds[items[:1]])
+  refitOne = (time.perf_counter()-t)*1000
+  for ray in rays:
+    assert np.array_equal(tree.ray(*ray), brute(ray))
+
+  print("%8d boxes: build %7.1f ms, refit 1%% %6.2f ms, refit 1 %5.3f ms" % (n, build, refit, refitOne))
+  print("          ray %6.3f ms vs %8.3f ms, box %6.3f ms vs %7.3f ms (%d), frustum %6.3f ms vs %8.3f ms (%d)"
+        % (rayTree, rayBrute, boxTree, boxBrute, len(inBox), frustumTree, frustumBrute, len(inFrustum)))
+
+if __name__ == "__main__":
+  BVH(random_boxes(100)[0]).update(np.arange(3), random_boxes(3)[0]) # warm up NumPy
+  for n in [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000, 1000000]:
+    bench(n)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+'''
+renderlist_bench.py
+times a frame of Scene.render with 1k, 10k and 100k models
+
+The models are cubes in directories of 100, at random places in front of
+the camera, with a few selected. Each count is timed with a still scene
+and with one model moved every frame. With --traversal the queued draws
+are dropped instead of drawn, which leaves the CPU time spent going
+through the RenderList.
+
+  $ python renderlist_bench.py [--egl] [--traversal] [count ...]
+'''
+
+import sys, time, random
+import benchgl
+
+W, H = 800, 600
+benchgl.context(W, H)
+traversalOnly = "--traversal" in sys.argv
+if traversalOnly:
+  sys.argv.remove("--traversal")
+
+from OpenGL.GL import glFinish
+import appdata, engine
+from engine import Scene, Camera, Model, Lamp, Directory
+from asset import Mesh, Tex, Bulb
+from rotpoint import Point, Rot
+
+appdata.datainit()
+engine.initEngine()
+if traversalOnly:
+  engine.DRAWS.flush = engine.DRAWS.draws.clear
+
+def random_point():
+  return Point(random.uniform(-40, 40), random.uniform(-20, 20), random.uniform(-80, -2))
+
+def bench(n, mesh, tex):
+  random.seed(1)
+  scene = Scene()
+  models = []
+  for i in range(max(1, n//100)):
+    directory = Directory(pos=random_point(), name="d%d"%i)
+    scene.add(directory)
+    for j in range(min(n, 100)):
+      model = Model(mesh, tex, pos=random_point(), name="m")
+      directory.add(model)
+      models.append(model)
+  scene.add(Lamp(Bulb(), pos=Point(0, 10, 0)))
+  camera = Camera(pos=Point(1, 2, 12), rot=Rot(-0.1, 0.2, 0))
+  engine.selected.clear()
+  engine.selected.update(models[:10])
+  engine.monoselected = models[3]
+  scene.render(camera, W/H) # builds the RenderList
+  glFinish()
+  frames = max(3, 3000//max(1, n//100))
+  def frameTime(step):
+    t = time.perf_counter()
+    for f in range(frames):
+      step(f)
+      scene.render(camera, W/H)
+    glFinish()
+    return (time.perf_counter()-t)/frames*1000
+  still = frameTime(lambda f: None)
+  moving = frameTime(lambda f: setattr(models[f%len(models)], "pos", random_point()))
+  print("%6d models: still %.1f ms/frame, one model moving %.1f ms/frame (%d frames)"%(len(models), still, moving, frames))
+
+if __name__ == "__main__":
+  mesh = Mesh("./assets/meshes/cube.obj")
+  tex = Tex("./assets/textures/abstract.jpg")
+  for n in [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000]:
+    bench(n, mesh, tex)
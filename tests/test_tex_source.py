@@ -0,0 +1,49 @@
+'''
+Textures sharing a working copy in cache/sources, without a GL context:
+TexImage is replaced by a stand-in that uploads nothing.
+'''
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "ZEdit"))
+
+import pytest
+from PIL import Image
+
+import appdata
+import asset
+from asset import Tex, prepare_texture, source_path
+
+class FakeTexImage:
+  def __init__(self, source, mipmap, anisotropy, textureData=None, size=None):
+    self.texID = 1
+  def delete(self):
+    pass
+
+@pytest.fixture
+def image(tmp_path, monkeypatch):
+  monkeypatch.setattr(appdata, "DATAPATH", str(tmp_path/"data"))
+  monkeypatch.setattr(asset, "TexImage", FakeTexImage)
+  appdata.datainit()
+  fn = str(tmp_path/"red.png")
+  Image.new("RGB", (8, 8), (255, 0, 0)).save(fn)
+  return fn
+
+def test_last_holder_deleted_between_prepare_and_finish(image):
+  holder = Tex(image)
+  prepared = prepare_texture(image) # a background import of the same content
+  holder.delete() # takes the working copy with it
+  assert not os.path.exists(source_path(prepared[0], ".png"))
+  tex = Tex(image, prepared=prepared)
+  assert os.path.isfile(source_path(tex.key, ".png"))
+  assert os.path.isfile(tex.tmpFilename)
+  assert Tex.sources.refcount(tex.key) == 1 and Tex.images.refcount(tex.imageKey()) == 1
+  tex.delete()
+  assert tex.key not in Tex.sources and not os.path.exists(source_path(prepared[0], ".png"))
+
+def test_failed_link_takes_no_references(image, monkeypatch):
+  prepared = prepare_texture(image)
+  def fail(src, dst):
+    raise FileNotFoundError(src)
+  monkeypatch.setattr(asset, "link_or_copy", fail)
+  with pytest.raises(FileNotFoundError):
+    Tex(image, prepared=prepared)
+  assert prepared[0] not in Tex.sources and len(Tex.images) == 0